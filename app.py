@@ -2,11 +2,21 @@ import streamlit as st
 from rag.rag_image import RAGPipelineUsingImage
 from rag.rag_text import RAGPipelineUsingText
 from rag.ingest import ingest_file
-from src.vectordbs.chromadb import ChromaDB
+from src.vectordbs.registry import get_vector_db
 from src.config import settings
 import time
 import os
-from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import queue
+import asyncio
+from src.clients import run_coroutine
+
+@st.cache_resource
+def get_collection(collection_name):
+    """
+    Returns the collection handle shared across Streamlit reruns and sessions.
+    """
+    return get_vector_db(collection_name)
 
 st.title("RAG Approach Comparison")
 st.subheader("Upload a PDF Document")
@@ -14,7 +24,7 @@ st.subheader("Upload a PDF Document")
 # State variables to track if ingestion has been done and the currently ingested file
 if 'ingested' not in st.session_state:
     st.session_state.ingested = False
-    st.session_state.current_file_name = None
+    st.session_state.current_file_hash = None
 
 uploaded_file = st.file_uploader("Choose a PDF file", type="pdf")
 
@@ -22,20 +32,26 @@ uploaded_file = st.file_uploader("Choose a PDF file", type="pdf")
 if uploaded_file:
     file_path = os.path.join(settings.DATA_STORAGE, uploaded_file.name)
 
-    # Reset the ingestion state if a new file is uploaded
-    if uploaded_file.name != st.session_state.current_file_name:
+    # Reset the ingestion state if a new or modified file is uploaded
+    file_bytes = uploaded_file.getvalue()
+    file_hash = hashlib.sha256(file_bytes).hexdigest()
+    if file_hash != st.session_state.current_file_hash:
         st.session_state.ingested = False
-        st.session_state.current_file_name = uploaded_file.name
+        st.session_state.current_file_hash = file_hash
 
-    # Ingest the file only once
+    # Ingest the file only once per session; ingest_file itself skips documents already in the store
     if not st.session_state.ingested:
         with open(file_path, "wb") as f:
-            f.write(uploaded_file.read())
+            f.write(file_bytes)
 
         with st.spinner('Reading the file...'):
             message = ingest_file(file_path)
 
-        st.success(message)
+        # Pages that failed are left out of the manifest, so ingesting the file again retries them
+        if message.startswith("Error"):
+            st.warning(message)
+        else:
+            st.success(message)
         st.session_state.ingested = True
 
 # Input box for the query
@@ -43,48 +59,59 @@ query = st.text_input("Enter your query")
 
 if query and st.session_state.ingested:
     try:
-        def run_text_mode():
-            collection_name = settings.TEXT_COLLECTION_NAME
-            vector_db_client = ChromaDB(collection_name=collection_name)
-            start_time = time.time()
-            result, total_tokens, input_tokens = RAGPipelineUsingText(vector_db_client).get_query(query)
-            elapsed_time = time.time() - start_time
-            return result, total_tokens, input_tokens, elapsed_time
-
-        def run_image_mode():
-            collection_name = settings.IMAGE_COLLECTION_NAME
-            vector_db_client = ChromaDB(collection_name=collection_name)
-            start_time = time.time()
-            result, total_tokens, input_tokens = RAGPipelineUsingImage(vector_db_client).get_query(query)
-            elapsed_time = time.time() - start_time
-            return result, total_tokens, input_tokens, elapsed_time
-
-        with ThreadPoolExecutor() as executor:
-            with st.spinner('Processing...'):
-                text_future = executor.submit(run_text_mode)
-                image_future = executor.submit(run_image_mode)
-
-                # Retrieve results
-                text_mode_answer, text_mode_total_tokens, text_mode_input_tokens, text_mode_time = text_future.result()
-                image_mode_answer, image_mode_total_tokens, image_mode_input_tokens, image_mode_time = image_future.result()
-
         st.write(f"LLM used: {settings.CHAT_MODEL}")
         # Display answers side-by-side
         col1, col2 = st.columns(2)
 
         with col1:
             st.header("Text Mode")
-            st.markdown(f"**Response:** {text_mode_answer}")
-            st.write(f"Response Time: {text_mode_time:.2f} seconds")
-            st.write(f"Total tokens used: {text_mode_total_tokens}")
-            st.write(f"Input tokens used: {text_mode_input_tokens}")
+            text_answer_box = st.empty()
+            text_stats_box = st.empty()
 
         with col2:
             st.header("Image Mode")
-            st.markdown(f"**Response:** {image_mode_answer}")
-            st.write(f"Response Time: {image_mode_time:.2f} seconds")
-            st.write(f"Total tokens used: {image_mode_total_tokens}")
-            st.write(f"Input tokens used: {image_mode_input_tokens}")
+            image_answer_box = st.empty()
+            image_stats_box = st.empty()
+
+        # Streamlit elements are updated from this script's thread, the streams send their updates here
+        updates = queue.Queue()
+
+        async def stream_mode(pipeline, answer_box, stats_box):
+            start_time = time.time()
+            first_token_time = None
+            answer = ""
+            stream = await pipeline.get_query_async(query, stream=True)
+            # Render tokens as they arrive
+            async for token in stream:
+                if first_token_time is None:
+                    first_token_time = time.time() - start_time
+                answer += token
+                updates.put((answer_box, f"**Response:** {answer}"))
+            elapsed_time = time.time() - start_time
+            updates.put((stats_box,
+                f"Time to first token: {first_token_time or elapsed_time:.2f} seconds  \n"
+                f"Response Time: {elapsed_time:.2f} seconds  \n"
+                f"Total tokens used: {stream.result['tokens_used']}  \n"
+                f"Input tokens used: {stream.result['prompt_tokens']}"
+                + ("  \nAnswered from cache" if stream.result.get("cached") else "")
+            ))
+
+        async def run_both_modes():
+            # Both modes stream as coroutines on the process-wide event loop, whose pooled client outlives this rerun
+            try:
+                await asyncio.gather(
+                    stream_mode(RAGPipelineUsingText(get_collection(settings.TEXT_COLLECTION_NAME)), text_answer_box, text_stats_box),
+                    stream_mode(RAGPipelineUsingImage(get_collection(settings.IMAGE_COLLECTION_NAME)), image_answer_box, image_stats_box),
+                )
+            finally:
+                updates.put(None)
+
+        with st.spinner('Processing...'):
+            future = run_coroutine(run_both_modes())
+            while (update := updates.get()) is not None:
+                box, text = update
+                box.markdown(text)
+            future.result()
 
     except Exception as e:
         st.error(f"An error occurred: {e}")
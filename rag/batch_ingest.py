@@ -0,0 +1,117 @@
+import argparse
+import glob
+import os
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Optional
+
+from src.config import settings
+from src.jobs import JobQueue
+from rag.ingest import ingest_document
+
+
+def find_files(targets: List[str], extension: str = ".pdf") -> List[str]:
+    """
+    Expands directories (recursively) and glob patterns into the files to ingest.
+    """
+    files = set()
+    for target in targets:
+        if os.path.isdir(target):
+            matches = glob.glob(os.path.join(target, "**", f"*{extension}"), recursive=True)
+        else:
+            matches = glob.glob(target, recursive=True)
+        files.update(os.path.abspath(path) for path in matches if os.path.isfile(path) and path.lower().endswith(extension))
+    return sorted(files)
+
+
+def ingest_job(jobs: JobQueue, file_path: str) -> Optional[int]:
+    """
+    Ingests one claimed file and checkpoints its outcome.
+
+    Returns:
+        Optional[int]: Number of pages ingested (0 when the file was already ingested), None if it failed.
+    """
+    start_time = time.time()
+    try:
+        message, pages = ingest_document(file_path)
+        if message.startswith("Error"):
+            raise RuntimeError(message)
+    except Exception as e:
+        jobs.fail(file_path, "".join(traceback.format_exception_only(type(e), e)).strip())
+        print(f"Failed {file_path}: {e}")
+        return None
+    jobs.complete(file_path, pages)
+    print(f"Done {file_path}: {pages} pages in {time.time() - start_time:.1f}s")
+    return pages
+
+
+def batch_ingest(targets: List[str], concurrency: int = None, retry_failed: bool = False, jobs_path: str = None) -> dict:
+    """
+    Ingests every PDF found under the targets, resuming from the job table of a previous run.
+
+    Files are ingested `concurrency` at a time. Within a file, parsing and page rendering run on the
+    shared process pool and the embedding/LLM calls on the rate-limited worker pool, so these stages of
+    different files overlap.
+
+    Args:
+        targets (List[str]): Directories and glob patterns.
+        concurrency (int, optional): Files ingested at once. Defaults to settings.BATCH_FILE_CONCURRENCY.
+        retry_failed (bool, optional): Also retry the files that failed in previous runs. Default is False.
+        jobs_path (str, optional): Job table location. Defaults to settings.JOBS_DB_PATH.
+
+    Returns:
+        dict: Run statistics: documents, pages, skipped (already ingested), failed, seconds, docs_per_sec, pages_per_sec.
+    """
+    concurrency = concurrency or settings.BATCH_FILE_CONCURRENCY
+    jobs = JobQueue(jobs_path)
+    recovered = jobs.recover(retry_failed)
+    queued = jobs.enqueue(find_files(targets))
+    print(f"{queued} files to ingest ({recovered} resumed from a previous run), {concurrency} at a time")
+
+    documents = pages = skipped = failed = 0
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="rag-ingest") as executor:
+        running = set()
+        while True:
+            while len(running) < concurrency and (file_path := jobs.claim()) is not None:
+                running.add(executor.submit(ingest_job, jobs, file_path))
+            if not running:
+                break
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                file_pages = future.result()
+                if file_pages is None:
+                    failed += 1
+                elif file_pages == 0:
+                    skipped += 1
+                else:
+                    documents += 1
+                    pages += file_pages
+    elapsed = time.time() - start_time
+
+    stats = {
+        "documents": documents,
+        "pages": pages,
+        "skipped": skipped,
+        "failed": failed,
+        "seconds": elapsed,
+        "docs_per_sec": documents / elapsed if elapsed else 0.0,
+        "pages_per_sec": pages / elapsed if elapsed else 0.0,
+    }
+    print(f"Ingested {documents} documents ({pages} pages) in {elapsed:.1f}s: "
+          f"{stats['docs_per_sec']:.2f} docs/sec, {stats['pages_per_sec']:.2f} pages/sec ({skipped} already ingested)")
+    if failed:
+        print(f"{failed} files failed, run again with --retry-failed to retry them")
+    print(f"Jobs: {jobs.counts()}")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest many PDFs, resuming from where a previous run stopped.")
+    parser.add_argument("targets", nargs="+", help="Directories (searched recursively) or glob patterns of PDF files")
+    parser.add_argument("--concurrency", type=int, default=None, help="Files ingested at once")
+    parser.add_argument("--retry-failed", action="store_true", help="Retry the files that failed in previous runs")
+    parser.add_argument("--jobs-db", default=None, help="Job table location")
+    args = parser.parse_args()
+    batch_ingest(args.targets, args.concurrency, args.retry_failed, args.jobs_db)
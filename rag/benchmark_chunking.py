@@ -0,0 +1,129 @@
+import argparse
+import time
+from collections import Counter
+from typing import List, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from src.config import settings
+from src.document import ParsedDocument
+from src.embeddings.cached_embeddings import get_embeddings
+from src.text_mode.chunking import ChunkingStrategy
+from src.text_mode.local_chunker import CLAUSE_PATTERN
+
+# Reference headings: blocks of at most this many words, in a font this much larger than the body text
+HEADING_MAX_WORDS = 12
+HEADING_FONT_RATIO = 1.2
+
+
+class CountingEmbeddings(Embeddings):
+    """
+    Wraps the embeddings model to count the texts a chunker sends to it. The model is only built
+    on the first call, so chunkers that embed nothing never create it.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.texts = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        return get_embeddings().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        self.texts += 1
+        return get_embeddings().embed_query(text)
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def reference_structure(document: ParsedDocument) -> Tuple[List[str], List[str]]:
+    """
+    Reads the headings and top-level clauses of a document from its layout alone, so that every
+    chunker is graded against the same reference, which none of them produced.
+
+    A heading is a short block set in a larger font than the body text, the font of most of the
+    document's characters. A top-level clause runs from a line matching CLAUSE_PATTERN with an
+    undotted number ("12.", "(a)", "Section 4") to the next one or the end of its block; only
+    clauses short enough to fit in one chunk are kept.
+    """
+    blocks = [block for page in document.pages for block in page.blocks]
+    if not blocks:
+        return [], []
+    characters = Counter()
+    for block in blocks:
+        characters[round(block.font_size, 1)] += len(block.text)
+    body_size = characters.most_common(1)[0][0]
+
+    headings, clauses = [], []
+    for block in blocks:
+        if len(block.text.split()) <= HEADING_MAX_WORDS and round(block.font_size, 1) >= body_size * HEADING_FONT_RATIO:
+            headings.append(normalize(block.text))
+            continue
+        clause = None
+        for line in block.text.split("\n"):
+            match = CLAUSE_PATTERN.match(line)
+            if match and "." not in (match.group("number") or ""):
+                if clause is not None:
+                    clauses.append(clause)
+                clause = line
+            elif clause is not None:
+                clause += "\n" + line
+        if clause is not None:
+            clauses.append(clause)
+    clauses = [normalize(clause) for clause in clauses if len(clause) <= settings.CHUNK_SIZE]
+    return headings, [clause for clause in clauses if clause]
+
+
+def structure_scores(document: ParsedDocument, chunks: List[str]) -> dict:
+    """
+    Measures how well chunks follow the document's structure, the same way for every chunker:
+    the share of headings that start a chunk, and the share of top-level clauses kept whole in one chunk.
+    """
+    headings, clauses = reference_structure(document)
+    normalized = [normalize(chunk) for chunk in chunks]
+    starting = sum(any(chunk.startswith(heading) for chunk in normalized) for heading in headings)
+    intact = sum(any(clause in chunk for chunk in normalized) for clause in clauses)
+    return {
+        "headings_starting_chunks": starting / len(headings) if headings else float("nan"),
+        "clauses_intact": intact / len(clauses) if clauses else float("nan"),
+    }
+
+
+def benchmark(file_path: str, chunk_types: List[str]) -> None:
+    """
+    Chunks a PDF with each chunking type and prints time, embeddings calls, chunk sizes and structure scores.
+    """
+    document = ParsedDocument.load(file_path)
+    pages = document.documents()
+    print(f"{file_path}: {len(pages)} pages, {sum(len(page.page_content) for page in pages)} characters")
+    print(f"{'type':<10} {'seconds':>8} {'embed calls':>11} {'embed texts':>11} {'chunks':>7} {'mean':>6} "
+          f"{'p95':>6} {'max':>6} {'headings':>9} {'clauses':>8}")
+    for chunk_type in chunk_types:
+        counter = CountingEmbeddings()
+        strategy = ChunkingStrategy([pages], document, chunk_type=chunk_type, embeddings=counter)
+        start_time = time.perf_counter()
+        try:
+            chunks = [chunk.page_content for chunk in strategy.split_texts()]
+        except Exception as e:
+            print(f"{chunk_type:<10} failed: {type(e).__name__}: {e}")
+            continue
+        elapsed = time.perf_counter() - start_time
+        sizes = np.array([len(chunk) for chunk in chunks]) if chunks else np.zeros(1, dtype=int)
+        scores = structure_scores(document, chunks)
+        print(f"{chunk_type:<10} {elapsed:8.2f} {counter.calls:11d} {counter.texts:11d} {len(chunks):7d} "
+              f"{sizes.mean():6.0f} {np.percentile(sizes, 95):6.0f} {sizes.max():6d} "
+              f"{scores['headings_starting_chunks']:9.1%} {scores['clauses_intact']:8.1%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare chunking types on a PDF.")
+    parser.add_argument("file_path", help="PDF to chunk")
+    parser.add_argument("--types", nargs="+", default=["local", "recursive", "semantic"], help="Chunking types to compare")
+    args = parser.parse_args()
+    benchmark(args.file_path, args.types)
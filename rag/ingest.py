@@ -1,48 +1,139 @@
 from src.image_mode.main import load_images
-from src.text_mode.main import load_embeddings
+from src.text_mode.ingestor import TextDataIngestor, TableDataIngestor, ImageDataIngestor
 from src.config import settings
 import os
-from src.vectordbs.chromadb import ChromaDB
-from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, NamedTuple, Optional
+from src.vectordbs.registry import get_vector_db
+from src.manifest import document_name, get_manifest
+from src.document import ParsedDocument
+from src.pipeline import Pipeline
 
 def ingest_file(file_path):
+    return ingest_document(file_path)[0]
+
+def ingest_document(file_path):
+    """
+    Ingests a file in both modes, only processing what changed since it was last ingested.
+
+    Returns:
+        Tuple[str, int]: The result message and the number of pages ingested.
+    """
     vector_database = settings.VECTOR_DB
     data_directory = settings.DATA_STORAGE
     vector_database = vector_database.lower()
 
     if not os.path.exists(data_directory) or not os.path.isdir(data_directory):
-        return "Error: Data directory does not exist."
+        return "Error: Data directory does not exist.", 0
     
     if not os.path.exists(file_path):
         print("Error: File does not exist.")
 
     # Check for supported vector databases
     if vector_database not in settings.SUPPORTED_DATABASES:
-        return "Error: Vector database not supported."
+        return "Error: Vector database not supported.", 0
     
-    print("##########################################################################")
-    print("Ingesting file using image mode")
-    if vector_database == "chromadb":
-        collection_name = settings.IMAGE_COLLECTION_NAME  
-        vector_db_client = ChromaDB(collection_name=collection_name) 
-    result_message = load_images(vector_db_client=vector_db_client, file_path=file_path)
-    print(result_message)
+    pipeline = build_pipeline(file_path)
+    try:
+        results = pipeline.run()
+    finally:
+        document = pipeline.results.get("parse")
+        if document is not None:
+            document.close()
+    print(pipeline.report())
 
-    
-    print("##########################################################################")
-    print("Ingesting file using text mode")
-    if vector_database == "chromadb":
-        collection_name = settings.TEXT_COLLECTION_NAME  
-        vector_db_client = ChromaDB(collection_name=collection_name) 
-    result_message = load_embeddings(vector_db_client=vector_db_client, file_path=file_path)
-    print(result_message)
-
-    # # Parallelize both ingestion modes
-    # with ThreadPoolExecutor() as executor:
-    #     executor.submit(ingest_image_mode)
-    #     executor.submit(ingest_text_mode)
-
-    return "File ready to use"
+    plans = [results["image_plan"], results["text_plan"]]
+    ingested = any(plan is not None for plan in plans)
+    pages_ingested = max((plan.page_count for plan in plans if plan is not None), default=0)
+    failed_pages = sorted(set(results["image_manifest"]) | set(results["text_manifest"]))
+    if failed_pages:
+        return f"Error: pages {failed_pages} could not be ingested, ingest the file again to retry them.", pages_ingested
+    return ("File ready to use" if ingested else "File already ingested, ready to use"), pages_ingested
+
+class ModePlan(NamedTuple):
+    """
+    What one ingestion mode does for a document, once its stale vectors are deleted.
+    """
+    collection_name: str
+    vector_db_client: Any
+    pages: Optional[List[int]]  # None ingests every page
+    page_count: int
+    removed_pages: List[int]
+
+def build_pipeline(file_path):
+    """
+    Builds the ingestion graph of a file: both modes start from one ParsedDocument, and the
+    stages of image mode and the text, table and embedded image stages of text mode run concurrently.
+    The manifest of a mode is updated once all of its stages are done, without the pages some stage
+    failed on, so that they are ingested again next time.
+    """
+    # Compare the file against what is already stored to only ingest what changed
+    manifest = get_manifest()
+    file_name = document_name(file_path)
+
+    def parse():
+        return ParsedDocument.load(file_path)
+
+    def plan(mode, collection_name):
+        def run(document):
+            file_hash, page_hashes = document.file_hash, document.page_hashes
+            changes = manifest.diff(collection_name, file_name, file_hash, page_hashes)
+            if changes is None:
+                print(f"{file_name} is unchanged, skipping {mode} mode")
+                return None
+            pages, removed_pages = changes
+            # Single-page documents are always rebuilt as a whole
+            if len(page_hashes) == 1:
+                pages = None
+
+            print(f"Ingesting file using {mode} mode (pages: {pages or 'all'})")
+            vector_db_client = get_vector_db(collection_name)
+            # Remove the stale vectors first: the whole document, or only its changed and removed pages
+            vector_db_client.delete_vectors(file_name, None if pages is None else pages + removed_pages)
+            return ModePlan(collection_name, vector_db_client, pages, len(page_hashes) if pages is None else len(pages), removed_pages)
+        return run
+
+    def ingest(load, extensions=None, on_removal=False):
+        # Stages return the pages they failed on
+        # on_removal stages also run when pages were only removed, to store again what those pages held
+        def run(document, mode_plan):
+            if mode_plan is None or mode_plan.page_count == 0 and not (on_removal and mode_plan.removed_pages):
+                return []
+            if extensions is not None and not file_path.endswith(extensions):
+                return []
+            return load(document, mode_plan)
+        return run
+
+    def record(document, mode_plan, *stage_failures):
+        failed_pages = sorted({page for pages in stage_failures for page in pages})
+        if mode_plan is not None:
+            manifest.update(mode_plan.collection_name, file_name, document.file_hash, document.page_hashes, failed_pages)
+        return failed_pages
+
+    pipeline = Pipeline(file_name)
+    pipeline.add_stage("parse", parse)
+    pipeline.add_stage("image_plan", plan("image", settings.IMAGE_COLLECTION_NAME), ("parse",))
+    pipeline.add_stage("text_plan", plan("text", settings.TEXT_COLLECTION_NAME), ("parse",))
+
+    def page_images(document, mode_plan):
+        message, failed_pages = load_images(vector_db_client=mode_plan.vector_db_client, file_path=file_path, pages=mode_plan.pages, document=document)
+        print(message)
+        return failed_pages
+
+    pipeline.add_stage("page_images", ingest(page_images), ("parse", "image_plan"))
+    # Embedded images shared between pages are kept once per document, attributed to one of them
+    text_stages = {
+        "text": (TextDataIngestor, (".pdf", ".docx", ".html"), False),
+        "tables": (TableDataIngestor, (".pdf", ".docx"), False),
+        "embedded_images": (ImageDataIngestor, (".pdf", ".docx"), True),
+    }
+    for name, (ingestor, extensions, on_removal) in text_stages.items():
+        pipeline.add_stage(name, ingest(
+            lambda d, p, ingestor=ingestor: ingestor(db_client=p.vector_db_client).main(file_path, p.pages, d), extensions, on_removal
+        ), ("parse", "text_plan"))
+
+    pipeline.add_stage("image_manifest", record, ("parse", "image_plan", "page_images"))
+    pipeline.add_stage("text_manifest", record, ("parse", "text_plan", *text_stages))
+    return pipeline
 
 if __name__ == "__main__":
     path = r"data/JA-207652.pdf"
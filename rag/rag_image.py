@@ -1,7 +1,11 @@
 from src.vectordbs.base import VectorDatabaseInterface
 from src.config import settings
 from src.prompts import PredefinedPrompts
-from src.utils import ask_gpt, convert_image_to_base64
+from src.utils import ask_gpt, ask_gpt_async
+from src.answer_cache import cached_response, get_answer_cache
+from src.image_mode.payload_store import load_page_payload
+import asyncio
+import time
 
 class RAGPipelineUsingImage:
     def __init__(self, db_client: VectorDatabaseInterface):
@@ -14,21 +18,68 @@ class RAGPipelineUsingImage:
         self.database = db_client
         
 
-    def get_query(self, query: str) -> dict:
-        # Retrieve relevant documents
-        retrieved_docs = self.database.query_vector(query)
+    def build_request(self, query: str, retrieved_docs: list) -> tuple:
         # print(retrieved_docs)
         image_paths = [doc.metadata.get('file_path') for doc in retrieved_docs]
         print(image_paths)
 
-        base64_images = [convert_image_to_base64(image_path) for image_path in image_paths]
+        base64_images = [load_page_payload(image_path) for image_path in image_paths]
         
         prompt = PredefinedPrompts.rag_prompt_template.format(context="", question = query)
+        return prompt, base64_images
+
+    def get_query(self, query: str, stream: bool = False) -> dict:
+        """
+        Answer a query from the retrieved context.
+
+        Args:
+            query (str): The user question.
+            stream (bool, optional): Return a GPTStream of answer tokens instead of the full answer. Default is False.
+
+        Returns:
+            tuple: (answer, total tokens, input tokens), or a GPTStream when streaming.
+        """
+        start_time = time.time()
+        answer_cache = get_answer_cache()
+        scope = answer_cache.scope(self.database.collection_name, "image")
+        cached = answer_cache.lookup(scope, query)
+        if cached is not None:
+            return cached_response(cached, stream, start_time)
+
+        # Retrieve relevant documents
+        retrieved_docs = self.database.query_vector(query)
+        prompt, base64_images = self.build_request(query, retrieved_docs)
 
-        response = ask_gpt(prompt, base64_images)
+        response = answer_cache.remember(scope, query, ask_gpt(prompt, base64_images, stream=stream))
+        if stream:
+            return response
         
         return (response['response'], response['tokens_used'] , response['prompt_tokens'])
 
+    async def get_query_async(self, query: str, stream: bool = False) -> dict:
+        """
+        Async variant of get_query; returns an AsyncGPTStream when streaming.
+        """
+        start_time = time.time()
+        answer_cache = get_answer_cache()
+        scope = answer_cache.scope(self.database.collection_name, "image")
+        # Embed the query off the event loop, once for the lookup and the store; retrieval then finds it in the embedding cache
+        embedding = await asyncio.to_thread(answer_cache.embed, query) if answer_cache.enabled else None
+        cached = answer_cache.lookup(scope, query, embedding)
+        if cached is not None:
+            return cached_response(cached, stream, start_time)
+
+        # Retrieve relevant documents
+        retrieved_docs = await self.database.query_vector_async(query)
+        # Page payloads may have to be read and encoded on a store miss, keep it off the event loop
+        prompt, base64_images = await asyncio.to_thread(self.build_request, query, retrieved_docs)
+
+        response = answer_cache.remember(scope, query, await ask_gpt_async(prompt, base64_images, stream=stream), embedding)
+        if stream:
+            return response
+
+        return (response['response'], response['tokens_used'] , response['prompt_tokens'])
+
     def process_output(self, response: str) -> dict:
         """
         Process the language model output into a structured dictionary of fields.
@@ -51,9 +102,9 @@ class RAGPipelineUsingImage:
     
 
 if __name__ == "__main__":
-    from src.vectordbs.chromadb import ChromaDB
+    from src.vectordbs.registry import get_vector_db
     from src.config import settings
     collection_name = "userimages"
-    vector_db = ChromaDB(collection_name=collection_name)
+    vector_db = get_vector_db(collection_name)
     ans = RAGPipelineUsingImage(vector_db).get_query("what is the length of the contract?")
     print(ans)
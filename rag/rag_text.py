@@ -1,7 +1,11 @@
 from src.vectordbs.base import VectorDatabaseInterface
 from src.config import settings
 from src.prompts import PredefinedPrompts
-from src.utils import ask_gpt
+from src.utils import ask_gpt, ask_gpt_async, count_tokens
+from src.text_mode.context_packer import pack_context
+from src.answer_cache import cached_response, get_answer_cache
+import asyncio
+import time
 
 class RAGPipelineUsingText:
     def __init__(self, db_client: VectorDatabaseInterface):
@@ -15,24 +19,72 @@ class RAGPipelineUsingText:
         # self.llm = ChatOpenAI(temperature=settings.TEMPERATURE, model=settings.CHAT_MODEL, openai_api_key = settings.OPENAI_API_KEY)
 
 
-    def get_query(self, query: str) -> dict:
+    def build_prompt(self, query: str, retrieved_docs: list) -> str:
+        # Fit the most relevant distinct chunks into what the template and question leave of the prompt budget
+        overhead = count_tokens(PredefinedPrompts.rag_prompt_template.format(context="", question=query), settings.CHAT_MODEL)
+        packed_docs = pack_context(retrieved_docs, settings.MAX_TOKEN_LIMIT - overhead)
+        context = "\n\n".join([doc.page_content for doc in packed_docs])
+    
+        return PredefinedPrompts.rag_prompt_template.format(context=context, question = query)
+
+    def get_query(self, query: str, stream: bool = False) -> dict:
+        """
+        Answer a query from the retrieved context.
+
+        Args:
+            query (str): The user question.
+            stream (bool, optional): Return a GPTStream of answer tokens instead of the full answer. Default is False.
+
+        Returns:
+            tuple: (answer, total tokens, input tokens), or a GPTStream when streaming.
+        """
+        start_time = time.time()
+        answer_cache = get_answer_cache()
+        scope = answer_cache.scope(self.database.collection_name, "text")
+        cached = answer_cache.lookup(scope, query)
+        if cached is not None:
+            return cached_response(cached, stream, start_time)
+
         # Retrieve relevant documents
         retrieved_docs = self.database.query_vector(query)
         
-        # Concatenate the retrieved documents' content to provide context
-        context = "\n\n".join([doc.page_content for doc in retrieved_docs])
-    
-        prompt = PredefinedPrompts.rag_prompt_template.format(context=context, question = query)
+        prompt = self.build_prompt(query, retrieved_docs)
         
-        response = ask_gpt(prompt)
+        response = answer_cache.remember(scope, query, ask_gpt(prompt, stream=stream))
+        if stream:
+            return response
         
         return (response['response'], response['tokens_used'] , response['prompt_tokens'])
+
+    async def get_query_async(self, query: str, stream: bool = False) -> dict:
+        """
+        Async variant of get_query; returns an AsyncGPTStream when streaming.
+        """
+        start_time = time.time()
+        answer_cache = get_answer_cache()
+        scope = answer_cache.scope(self.database.collection_name, "text")
+        # Embed the query off the event loop, once for the lookup and the store; retrieval then finds it in the embedding cache
+        embedding = await asyncio.to_thread(answer_cache.embed, query) if answer_cache.enabled else None
+        cached = answer_cache.lookup(scope, query, embedding)
+        if cached is not None:
+            return cached_response(cached, stream, start_time)
+
+        # Retrieve relevant documents
+        retrieved_docs = await self.database.query_vector_async(query)
+
+        prompt = self.build_prompt(query, retrieved_docs)
+
+        response = answer_cache.remember(scope, query, await ask_gpt_async(prompt, stream=stream), embedding)
+        if stream:
+            return response
+
+        return (response['response'], response['tokens_used'] , response['prompt_tokens'])
     
 
 if __name__ == "__main__":
-    from src.vectordbs.chromadb import ChromaDB
+    from src.vectordbs.registry import get_vector_db
     from src.config import settings
     collection_name = "usertext"
-    vector_db = ChromaDB(collection_name=collection_name)
+    vector_db = get_vector_db(collection_name)
     ans = RAGPipelineUsingText(vector_db).get_query("what is the length of the contract?")
     print(ans)
@@ -0,0 +1,217 @@
+import re
+import threading
+import time
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from src.config import settings
+from src.embeddings.cache import normalize_text
+from src.embeddings.cached_embeddings import get_embeddings
+from src.manifest import DocumentManifest, get_manifest
+from src.ttl_cache import TTLCache
+from src.utils import GPTStream
+
+NUMBER_PATTERN = re.compile(r"\d+")
+
+
+class CachedAnswer(NamedTuple):
+    """
+    An answer kept by the answer cache, with the unit-norm embedding of the query it answered.
+    """
+    query: str
+    embedding: np.ndarray
+    answer: str
+    tokens_used: int
+    prompt_tokens: int
+
+
+class CachedAnswerStream:
+    """
+    Stands in for a GPTStream/AsyncGPTStream when the answer comes from the cache: yields the whole
+    answer at once and exposes the same `result` dictionary, with no tokens used.
+    """
+
+    def __init__(self, cached: CachedAnswer, start_time: float):
+        self.answer = cached.answer
+        time_taken = time.time() - start_time
+        self.result = {
+            "response": cached.answer,
+            "time_taken": time_taken,
+            "time_to_first_token": time_taken,
+            "tokens_used": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "estimated_cost": 0.0,
+            "cached": True,
+        }
+
+    def __iter__(self):
+        yield self.answer
+
+    async def __aiter__(self):
+        yield self.answer
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a query for exact matching: case, whitespace and trailing punctuation are ignored.
+    """
+    return normalize_text(query).lower().rstrip(" ?!.")
+
+
+class AnswerCache:
+    """
+    Cache of RAG answers for repeated and near-duplicate questions.
+
+    Answers are scoped by (collection, version of its document set, mode, chat model), so they are
+    dropped as soon as a document of the collection is ingested or changes. A query is looked up by
+    its normalized text first, then by the cosine similarity of its embedding to the cached queries
+    of the same scope.
+    """
+
+    def __init__(self, max_entries: int = None, ttl: float = None, threshold: float = None, manifest: DocumentManifest = None):
+        """
+        Args:
+            max_entries (int, optional): Answers kept before LRU eviction. Defaults to settings.ANSWER_CACHE_MAX_ENTRIES.
+            ttl (float, optional): Seconds an answer stays valid. Defaults to settings.ANSWER_CACHE_TTL.
+            threshold (float, optional): Minimum similarity of a near-duplicate query. Defaults to settings.ANSWER_CACHE_SIMILARITY_THRESHOLD.
+            manifest (DocumentManifest, optional): Source of the document set versions. Defaults to the vector database's manifest.
+        """
+        self.enabled = settings.ANSWER_CACHE_ENABLED
+        self.entries = TTLCache(max_entries or settings.ANSWER_CACHE_MAX_ENTRIES, ttl or settings.ANSWER_CACHE_TTL)
+        self.threshold = threshold or settings.ANSWER_CACHE_SIMILARITY_THRESHOLD
+        self.manifest = manifest or get_manifest()
+        self.lock = threading.Lock()
+        self.lookups = 0
+        self.exact_hits = 0
+        self.semantic_hits = 0
+
+    def scope(self, collection_name: str, mode: str) -> Tuple[str, str, str, str]:
+        """
+        Returns the scope of the answers of a pipeline: (collection, document set version, mode, chat model).
+        """
+        return collection_name, self.manifest.version(collection_name), mode, settings.CHAT_MODEL
+
+    @staticmethod
+    def embed(query: str) -> np.ndarray:
+        embedding = np.asarray(get_embeddings().embed_query(query), dtype=np.float32)
+        return embedding / (np.linalg.norm(embedding) or 1.0)
+
+    def lookup(self, scope: tuple, query: str, embedding: np.ndarray = None) -> Optional[CachedAnswer]:
+        """
+        Returns the cached answer of a query, or of a near-duplicate query, in the given scope.
+
+        Args:
+            scope (tuple): The scope returned by `scope`.
+            query (str): The user question.
+            embedding (np.ndarray, optional): The query's embedding from `embed`. Default is None, which
+                embeds the query when near-duplicates have to be compared.
+
+        Returns:
+            Optional[CachedAnswer]: The cached answer, or None on a miss.
+        """
+        if not self.enabled:
+            return None
+        with self.lock:
+            self.lookups += 1
+
+        cached = self.entries.get((scope, normalize_query(query)))
+        if cached is not None:
+            with self.lock:
+                self.exact_hits += 1
+            return cached
+
+        # Near-duplicates must mention the same numbers: "page 3" and "page 4" embed almost identically
+        numbers = NUMBER_PATTERN.findall(query)
+        candidates = [(key, value) for key, value in self.entries.items()
+                      if key[0] == scope and NUMBER_PATTERN.findall(value.query) == numbers]
+        if not candidates:
+            return None
+        if embedding is None:
+            embedding = self.embed(query)
+        similarities = np.stack([value.embedding for _, value in candidates]) @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+
+        key, cached = candidates[best]
+        self.entries.get(key)  # Mark as recently used
+        with self.lock:
+            self.semantic_hits += 1
+        return cached
+
+    def store(self, scope: tuple, query: str, result: dict, embedding: np.ndarray = None) -> None:
+        """
+        Caches the answer of a query.
+
+        Args:
+            scope (tuple): The scope returned by `scope`.
+            query (str): The user question.
+            result (dict): The result dictionary of ask_gpt.
+            embedding (np.ndarray, optional): The query's embedding from `embed`. Default is None, which
+                embeds the query, a blocking API call on a miss of the embedding cache.
+        """
+        if not self.enabled or not result.get("response"):
+            return
+        if embedding is None:
+            embedding = self.embed(query)
+        self.entries.put((scope, normalize_query(query)), CachedAnswer(
+            query, embedding, result["response"], result["tokens_used"], result["prompt_tokens"]
+        ))
+
+    def remember(self, scope: tuple, query: str, response, embedding: np.ndarray = None):
+        """
+        Caches the answer of ask_gpt's response; a stream is cached once it has been fully read.
+
+        Async pipelines pass the query's embedding, so that caching never blocks their event loop.
+
+        Returns:
+            The response, unchanged.
+        """
+        if isinstance(response, GPTStream):
+            response.on_finish = lambda result: self.store(scope, query, result, embedding)
+        else:
+            self.store(scope, query, response, embedding)
+        return response
+
+    def stats(self) -> dict:
+        """
+        Returns the cache's lookup counters and hit rate.
+        """
+        with self.lock:
+            hits = self.exact_hits + self.semantic_hits
+            return {
+                "lookups": self.lookups,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.lookups - hits,
+                "hit_rate": hits / self.lookups if self.lookups else 0.0,
+                "entries": len(self.entries),
+                "evictions": self.entries.evictions,
+            }
+
+
+def cached_response(cached: CachedAnswer, stream: bool, start_time: float):
+    """
+    Returns a cached answer in the shape of a pipeline's get_query result: a stream, or
+    (answer, total tokens, input tokens) with no tokens used.
+    """
+    if stream:
+        return CachedAnswerStream(cached, start_time)
+    return (cached.answer, 0, 0)
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    """
+    Returns the process-wide answer cache.
+    """
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache()
+        return _answer_cache
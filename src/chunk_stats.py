@@ -0,0 +1,55 @@
+import hashlib
+from typing import Any, Dict, List, Optional
+
+from src.config import settings
+from src.embeddings.cache import normalize_text
+from src.utils import get_encoding
+
+SOURCE_TYPES = ("text", "table", "image")
+
+
+def content_hash(text: str) -> str:
+    """
+    Returns the hash identifying a chunk's content, insensitive to case, whitespace and unicode variants.
+    """
+    return hashlib.sha256(normalize_text(text).lower().encode("utf-8")).hexdigest()
+
+
+def compute_chunk_stats(texts: List[str], source_type: str, model_name: str = None) -> List[Dict[str, Any]]:
+    """
+    Computes the sizing metadata of chunks in one batched pass: token count, character count,
+    source type and content hash.
+
+    Tokens are counted with the chat model's encoding, since they size the prompts the chunks go into.
+    encode_batch tokenizes the whole batch in tiktoken's native thread pool.
+
+    Args:
+        texts (List[str]): Chunk contents.
+        source_type (str): "text", "table" or "image".
+        model_name (str, optional): Model whose tokenizer is used. Defaults to settings.CHAT_MODEL.
+
+    Returns:
+        List[Dict[str, Any]]: One metadata dictionary per chunk.
+    """
+    if source_type not in SOURCE_TYPES:
+        raise ValueError(f"Unsupported source type '{source_type}', expected one of {SOURCE_TYPES}")
+    encoded = get_encoding(model_name or settings.CHAT_MODEL).encode_batch(texts, disallowed_special=())
+    return [
+        {
+            "token_count": len(tokens),
+            "char_count": len(text),
+            "source_type": source_type,
+            "content_hash": content_hash(text),
+        }
+        for text, tokens in zip(texts, encoded)
+    ]
+
+
+def with_chunk_stats(texts: List[str], metadata_list: List[Optional[Dict[str, Any]]], source_type: str) -> List[Dict[str, Any]]:
+    """
+    Returns the metadata of chunks extended with their stats; every chunk also gets a page, 1 if unknown.
+    """
+    return [
+        {"page": 1, **(metadata or {}), **stats}
+        for metadata, stats in zip(metadata_list, compute_chunk_stats(texts, source_type))
+    ]
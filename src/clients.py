@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import weakref
+from concurrent.futures import Future
+from typing import Any, Coroutine
+
+import httpx
+import openai
+from langchain_openai import ChatOpenAI
+
+from src.config import settings
+
+_lock = threading.Lock()
+_http_client = None
+_openai_client = None
+_chat_model = None
+_event_loop = None
+# Async clients are bound to the event loop they were created in, so there is one per loop
+_async_openai_clients = weakref.WeakKeyDictionary()
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    )
+
+
+def get_http_client() -> httpx.Client:
+    """
+    Returns the process-wide HTTP client whose connection pool is shared by every OpenAI call.
+    """
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(limits=_http_limits(), timeout=settings.HTTP_TIMEOUT)
+        return _http_client
+
+
+def get_openai_client() -> openai.OpenAI:
+    """
+    Returns the process-wide OpenAI client.
+    """
+    global _openai_client
+    http_client = get_http_client()
+    with _lock:
+        if _openai_client is None:
+            # Retries are handled by src.executor.call_with_retries
+            _openai_client = openai.OpenAI(api_key=settings.OPENAI_API_KEY, http_client=http_client, max_retries=0)
+        return _openai_client
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    Returns the process-wide event loop, which runs forever in a daemon thread.
+
+    Synchronous callers, such as the Streamlit script that reruns on every interaction, submit
+    their coroutines to it with run_coroutine instead of starting a loop each time, so that the
+    loop's AsyncOpenAI client and its connection pool serve every query of the process.
+    """
+    global _event_loop
+    with _lock:
+        if _event_loop is None:
+            _event_loop = asyncio.new_event_loop()
+            threading.Thread(target=_event_loop.run_forever, name="rag-event-loop", daemon=True).start()
+        return _event_loop
+
+
+def run_coroutine(coroutine: Coroutine) -> "Future[Any]":
+    """
+    Schedules a coroutine on the process-wide event loop.
+
+    Returns:
+        Future[Any]: Completed with the coroutine's result, or its exception.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop())
+
+
+def get_async_openai_client() -> openai.AsyncOpenAI:
+    """
+    Returns the AsyncOpenAI client of the running event loop, with its own pooled HTTP client.
+
+    Loops other than the process-wide one (see get_event_loop) each get a client of their own.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_openai_clients.get(loop)
+        if client is None:
+            client = openai.AsyncOpenAI(
+                api_key=settings.OPENAI_API_KEY,
+                http_client=httpx.AsyncClient(limits=_http_limits(), timeout=settings.HTTP_TIMEOUT),
+                max_retries=0,
+            )
+            _async_openai_clients[loop] = client
+        return client
+
+
+def get_chat_model() -> ChatOpenAI:
+    """
+    Returns the process-wide LangChain chat model.
+    """
+    global _chat_model
+    http_client = get_http_client()
+    with _lock:
+        if _chat_model is None:
+            _chat_model = ChatOpenAI(
+                temperature=settings.TEMPERATURE,
+                model=settings.CHAT_MODEL,
+                openai_api_key=settings.OPENAI_API_KEY,
+                http_client=http_client,
+            )
+        return _chat_model
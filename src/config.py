@@ -11,7 +11,22 @@ class Settings(BaseSettings):
     #Databases
     VECTOR_DB: str = "chromadb"
     DB_NAME: str = "./chroma"
-    SUPPORTED_DATABASES :list = ['chromadb']
+    MANIFEST_PATH: str = os.path.join(DB_NAME, "manifest.json")
+    SUPPORTED_DATABASES :list = ['chromadb', 'local']
+    # Local vector database (VECTOR_DB = "local")
+    LOCAL_DB_PATH: str = "./local_vector_db"
+    LOCAL_DB_DTYPE: str = "float32"  # "float32", "float16" or "int8"
+    LOCAL_DB_INDEX: str = "exact"  # "exact", "ivf", "hnsw", or the quantized "sq8" and "pq"
+    IVF_NLIST: int = 0  # 0 uses sqrt(number of vectors)
+    IVF_NPROBE: int = 8
+    IVF_MIN_VECTORS: int = 1024
+    HNSW_M: int = 16
+    HNSW_EF_CONSTRUCTION: int = 200
+    HNSW_EF_SEARCH: int = 64
+    PQ_SUBVECTORS: int = 0  # 0 uses dimension / 4, 16x smaller than float32
+    QUANTIZATION_MIN_VECTORS: int = 1024
+    QUANTIZATION_TRAIN_SAMPLE: int = 10000
+    RERANK_CANDIDATES: int = 100
     TEXT_COLLECTION_NAME:str = "usertext"
     IMAGE_COLLECTION_NAME:str = "userimages"
 
@@ -20,16 +35,97 @@ class Settings(BaseSettings):
     EMBEDDINGS_MODEL: str = "text-embedding-ada-002"
     TEMPERATURE: float = 0.8
     OPENAI_API_KEY: str = "INSERT YOUR API KEY HERE"  
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_TIMEOUT: float = 120.0
      
     # Chunking
     CHUNK_SIZE: int = 1000
     CHUNK_OVERLAP: int = 100
-    CHUNK_TYPE: str = "semantic"
-    MAX_TOKEN_LIMIT:int = 10000
+    CHUNK_TYPE: str = "semantic"  # "semantic", "recursive" or "local" (no embeddings calls)
+    LOCAL_CHUNK_MIN_SIZE: int = 200  # characters a chunk reaches before topic shifts may end it
+    LOCAL_CHUNK_WINDOW: int = 3  # units on each side of a gap compared to detect topic shifts
+    LOCAL_CHUNK_SPLIT_THRESHOLD: float = 0.9  # boundary score (dissimilarity + clause bonus) that ends a chunk
+    LOCAL_CHUNK_CLAUSE_BONUS: float = 0.3  # added to the score before a top-level clause, half before sub-clauses
+    LOCAL_CHUNK_HEADING_RATIO: float = 1.15  # font size over the body size that makes a block a heading
+    MAX_TOKEN_LIMIT:int = 10000  # prompt budget of text mode: template, question and packed context
+    CONTEXT_DEDUP_OVERLAP: float = 0.8  # share of a chunk's word 8-grams already packed that makes it a duplicate
+
+    # Execution
+    MAX_WORKERS: int = 16
+    PIPELINE_WORKERS: int = 8  # ingestion stages running at once, across all documents
+    MAX_RETRIES: int = 5
+    RETRY_BASE_DELAY: float = 1.0
+    RETRY_MAX_DELAY: float = 60.0
+    CHAT_REQUESTS_PER_MINUTE: int = 500
+    CHAT_TOKENS_PER_MINUTE: int = 200000
+    EMBEDDINGS_REQUESTS_PER_MINUTE: int = 3000
+    EMBEDDINGS_TOKENS_PER_MINUTE: int = 1000000
+
+    # Rendering
+    RENDER_DPI: int = 200
+    RENDER_WORKERS: int = os.cpu_count() or 1
+    RENDER_PAGES_PER_TASK: int = 4
+
+    # Table extraction
+    TABLE_WORKERS: int = 2  # tabula processes, each keeping its own JVM warm
+    TABLE_PAGES_PER_TASK: int = 8
+    TABLE_PRECHECK: bool = True  # only send tabula the pages with ruling lines or column-aligned text
+
+    # Images sent to the vision model
+    IMAGE_MAX_DIM: int = 1536
+    IMAGE_FORMAT: str = "JPEG"  # "JPEG", "WEBP" or "PNG"
+    IMAGE_QUALITY: int = 80
+    IMAGE_GRAYSCALE_TEXT_PAGES: bool = True
+    IMAGE_GRAYSCALE_MAX_SATURATION: float = 12.0
+    IMAGE_DETAIL: str = "auto"  # "auto", "low" or "high"
+    IMAGE_CACHE_DIR: str = "./image_cache"  # payloads of embedded images; page images have their payload store
+    PAYLOAD_STORE_FLUSH_PAGES: int = 64  # page payloads buffered in memory before they are written to the store
+
+    # Images embedded in documents, described once per unique image
+    EMBEDDED_IMAGE_MIN_DIM: int = 32  # smaller images (rules, bullets, icons) are decorative
+    EMBEDDED_IMAGE_MIN_AREA: int = 64 * 64
+    EMBEDDED_IMAGE_DHASH_DISTANCE: int = 4  # max differing bits of the 64-bit dHash of near-duplicates
+    KV_CACHE_PATH: str = "./kv_cache.sqlite"  # image descriptions and other results reused across documents
+
+    # Lexical (BM25) retrieval, fused with dense retrieval in the listed collections
+    LEXICAL_COLLECTIONS: list = [TEXT_COLLECTION_NAME]
+    LEXICAL_INDEX_PATH: str = "./lexical_index"
+    HYBRID_CANDIDATES: int = 20  # results of each leg passed to rank fusion
+    RRF_K: int = 60
+    DENSE_TIMEOUT: float = 10.0  # seconds before answering from the lexical leg alone
+
+    # Retrieval cache: (query embedding, k, filter) -> documents, per process. 0 disables it
+    RETRIEVAL_CACHE_MAX_ENTRIES: int = 1024
+    RETRIEVAL_CACHE_TTL: float = 300  # seconds, bounds staleness after writes made outside this code
+
+    # Answer cache
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_MAX_ENTRIES: int = 1000
+    ANSWER_CACHE_TTL: float = 24 * 3600  # seconds
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = 0.95  # cosine similarity of query embeddings
+
+    # Embedding cache
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_DIR: str = "./embedding_cache"
+    EMBEDDING_CACHE_MAX_MB: int = 1024
+    EMBEDDING_CACHE_FLUSH_ROWS: int = 512  # new embeddings buffered in memory before they are written to disk
+    EMBEDDING_CACHE_FLUSH_SECONDS: float = 30  # longest time new embeddings stay buffered
+
+    # Table summaries, several tables per prompt
+    TABLE_SUMMARY_BATCH_TOKENS: int = 6000  # tables tokens per prompt; a larger table is summarized alone
+    TABLE_SUMMARY_BATCH_SIZE: int = 10  # tables per prompt, bounded so that their summaries fit the output
+
+    # Ingestion
+    EMBED_BATCH_SIZE: int = 100
+    EMBED_BATCH_MAX_TOKENS: int = 100000
+    JOBS_DB_PATH: str = "./ingest_jobs.sqlite"
+    BATCH_FILE_CONCURRENCY: int = 4  # files ingested at once by rag/batch_ingest.py
 
     # Retrieval
     CHAIN_TYPE: str = "stuff"
     NUM_DOCS: int = 5
+    RETRIEVAL_MODE: str = "auto"  # "direct", "self_query" or "auto"
     
 
 settings = Settings()
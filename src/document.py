@@ -0,0 +1,262 @@
+import hashlib
+import threading
+from collections import Counter
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import fitz  # PyMUPDF
+
+from src.manifest import hash_file, hash_page
+
+# Drawn segments shorter than this (in points) are glyph decorations rather than table rules
+MIN_RULE_LENGTH = 5.0
+# A ruled table has at least two rows and two columns, so three rules in each direction
+MIN_RULES = 3
+# A text grid has at least this many rows of cells aligned on shared columns
+MIN_GRID_ROWS = 3
+# Cell edges closer than this many points belong to the same column
+COLUMN_TOLERANCE = 5.0
+
+Box = Tuple[float, float, float, float]
+
+
+class TextBlock(NamedTuple):
+    bbox: Box
+    text: str
+    font_size: float  # largest span of the block, to tell headings from body text
+    bold: bool
+
+
+class PageImage(NamedTuple):
+    xref: int
+    width: int
+    height: int
+    digest: str  # sha256 of the image's raw stream, equal for the same image embedded under different xrefs
+
+
+class TableCandidate(NamedTuple):
+    """
+    A page region that looks like a table: "ruled" when drawn with rules, "grid" when its text is laid out in aligned columns.
+    """
+    bbox: Box
+    kind: str
+
+
+class ParsedPage(NamedTuple):
+    number: int  # 1-based
+    width: float
+    height: float
+    text: str
+    blocks: List[TextBlock]
+    images: List[PageImage]
+    table_candidates: List[TableCandidate]
+    content_hash: str
+
+
+def union(boxes: List[Box]) -> Box:
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+def find_ruled_table(page: fitz.Page) -> Optional[TableCandidate]:
+    """
+    Returns the region covered by the horizontal and vertical rules drawn on a page, if there are enough of them to make a table.
+    """
+    horizontal, vertical = [], []
+    for path in page.get_cdrawings():
+        for item in path["items"]:
+            if item[0] == "l":
+                rect = fitz.Rect(item[1], item[2]).normalize()
+            elif item[0] == "re":
+                rect = fitz.Rect(item[1]).normalize()
+            else:
+                continue
+            box = tuple(rect)
+            if rect.height < 2 and rect.width >= MIN_RULE_LENGTH:
+                horizontal.append(box)
+            elif rect.width < 2 and rect.height >= MIN_RULE_LENGTH:
+                vertical.append(box)
+            elif rect.width >= MIN_RULE_LENGTH and rect.height >= MIN_RULE_LENGTH:
+                # A cell rectangle draws two rules in each direction
+                horizontal.extend([box, box])
+                vertical.extend([box, box])
+    if len(horizontal) < MIN_RULES or len(vertical) < MIN_RULES:
+        return None
+    return TableCandidate(union(horizontal + vertical), "ruled")
+
+
+def find_text_grid(line_boxes: List[Box]) -> Optional[TableCandidate]:
+    """
+    Returns the region of a page where text lines form rows of at least two cells that share
+    column edges (left or right aligned) with other rows.
+    """
+    rows: Dict[int, List[Box]] = {}
+    for box in line_boxes:
+        rows.setdefault(round(box[3] / 2), []).append(box)
+    multi_cell_rows = [cells for cells in rows.values() if len(cells) >= 2]
+    if len(multi_cell_rows) < MIN_GRID_ROWS:
+        return None
+
+    def edges(cell: Box) -> Tuple[Tuple[str, int], Tuple[str, int]]:
+        return ("left", round(cell[0] / COLUMN_TOLERANCE)), ("right", round(cell[2] / COLUMN_TOLERANCE))
+
+    edge_counts = Counter(edge for cells in multi_cell_rows for cell in cells for edge in edges(cell))
+    columns = {edge for edge, count in edge_counts.items() if count >= MIN_GRID_ROWS}
+    grid_rows = [
+        cells for cells in multi_cell_rows
+        if sum(any(edge in columns for edge in edges(cell)) for cell in cells) >= 2
+    ]
+    if len(grid_rows) < MIN_GRID_ROWS:
+        return None
+    return TableCandidate(union([cell for cells in grid_rows for cell in cells]), "grid")
+
+
+def image_info(doc: fitz.Document, image: tuple, image_digests: Dict[int, str]) -> PageImage:
+    xref = image[0]
+    if xref not in image_digests:
+        image_digests[xref] = hashlib.sha256(doc.xref_stream_raw(xref) or b"").hexdigest()
+    return PageImage(xref, image[2], image[3], image_digests[xref])
+
+
+def parse_page(doc: fitz.Document, page: fitz.Page, image_digests: Dict[int, str]) -> ParsedPage:
+    """
+    Reads everything the ingestors need from one page: text blocks with their font sizes, image
+    xrefs and digests, table candidates and the page's content hash.
+
+    `image_digests` caches the digests by xref across the pages of the document.
+    """
+    # TEXTFLAGS_TEXT leaves out image blocks, so their pixels are not decoded here
+    layout = page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT, sort=False)
+    blocks = []
+    line_boxes = []
+    for block in layout["blocks"]:
+        lines = [line for line in block.get("lines", []) if line["spans"]]
+        if not lines:
+            continue
+        spans = [span for line in lines for span in line["spans"]]
+        blocks.append(TextBlock(
+            bbox=tuple(block["bbox"]),
+            text="\n".join("".join(span["text"] for span in line["spans"]) for line in lines),
+            font_size=max(span["size"] for span in spans),
+            bold=any(span["flags"] & fitz.TEXT_FONT_BOLD for span in spans),
+        ))
+        line_boxes.extend(tuple(line["bbox"]) for line in lines if "".join(span["text"] for span in line["spans"]).strip())
+
+    table_candidates = [candidate for candidate in (find_ruled_table(page), find_text_grid(line_boxes)) if candidate]
+    return ParsedPage(
+        number=page.number + 1,
+        width=page.rect.width,
+        height=page.rect.height,
+        text="".join(block.text + "\n" for block in blocks),
+        blocks=blocks,
+        images=[image_info(doc, image, image_digests) for image in page.get_images(full=True)],
+        table_candidates=table_candidates,
+        content_hash=hash_page(doc, page),
+    )
+
+
+def parse_pdf(file_path: str) -> Tuple[str, List[ParsedPage]]:
+    """
+    Parses a whole PDF in one pass. Runs in a worker process.
+
+    Returns:
+        Tuple[str, List[ParsedPage]]: The file hash and the parsed pages, page 1 first.
+    """
+    with fitz.open(file_path) as doc:
+        image_digests: Dict[int, str] = {}
+        pages = [parse_page(doc, page, image_digests) for page in doc]
+    return hash_file(file_path), pages
+
+
+class ParsedDocument:
+    """
+    A document parsed once and shared by every ingestion stage.
+
+    PDFs are parsed on the shared process pool. Embedded image bytes are read on demand from a
+    handle opened on first use; PyMuPDF documents are not thread-safe, so those reads are
+    serialized. Pages are rendered by the render workers, which open the file themselves. Other formats have no pages: they are hashed as one page and loaded by their
+    LangChain loader.
+    """
+
+    def __init__(self, file_path: str, file_hash: str, pages: List[ParsedPage], is_pdf: bool = True):
+        self.file_path = file_path
+        self.file_hash = file_hash
+        self.pages = pages
+        self.is_pdf = is_pdf
+        self.lock = threading.Lock()
+        self._doc = None
+
+    @classmethod
+    def load(cls, file_path: str) -> "ParsedDocument":
+        """
+        Parses a document.
+
+        Args:
+            file_path (str): Path to the document.
+
+        Returns:
+            ParsedDocument: The parsed document; close it once ingestion is done.
+        """
+        if not file_path.lower().endswith(".pdf"):
+            return cls(file_path, hash_file(file_path), [], is_pdf=False)
+        # Imported here so that parse workers, which import this module, stay light to spawn
+        from src.executor import get_process_pool
+
+        file_hash, pages = get_process_pool().submit(parse_pdf, file_path).result()
+        return cls(file_path, file_hash, pages)
+
+    @property
+    def page_count(self) -> int:
+        return len(self.pages) if self.is_pdf else 1
+
+    @property
+    def page_hashes(self) -> List[str]:
+        """
+        One content hash per page, as computed by manifest.hash_pages.
+        """
+        return [page.content_hash for page in self.pages] if self.is_pdf else [self.file_hash]
+
+    def select(self, pages: List[int] = None) -> List[ParsedPage]:
+        """
+        Returns the parsed pages among `pages` (1-based), or every page when None.
+        """
+        if pages is None:
+            return list(self.pages)
+        pages = set(pages)
+        return [page for page in self.pages if page.number in pages]
+
+    def text(self, pages: List[int] = None) -> str:
+        return "".join(page.text for page in self.select(pages))
+
+    def documents(self, pages: List[int] = None) -> List[Any]:
+        """
+        Returns one LangChain Document per page, with the metadata PyPDFLoader gives (0-based "page").
+        """
+        from langchain_core.documents import Document
+
+        return [
+            Document(page_content=page.text, metadata={"source": self.file_path, "page": page.number - 1})
+            for page in self.select(pages)
+        ]
+
+    def _open(self) -> fitz.Document:
+        if self._doc is None:
+            self._doc = fitz.open(self.file_path)
+        return self._doc
+
+    def extract_image(self, xref: int) -> Optional[Dict[str, Any]]:
+        """
+        Returns an embedded image as given by fitz.Document.extract_image: its bytes under "image", with its format and size.
+        """
+        with self.lock:
+            return self._open().extract_image(xref)
+
+    def close(self) -> None:
+        with self.lock:
+            if self._doc is not None:
+                self._doc.close()
+                self._doc = None
+
+    def __enter__(self) -> "ParsedDocument":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
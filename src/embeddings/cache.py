@@ -0,0 +1,277 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from src.config import settings
+from src.file_lock import file_lock
+
+# Each index row holds the sha256 digest of the key and the last time the row was read or written
+INDEX_DTYPE = np.dtype([("digest", "u1", (32,)), ("last_used", "f8")])
+INITIAL_ROWS = 1024
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes text before hashing so that whitespace and unicode variants share a cache entry.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def make_key(model_name: str, text: str) -> bytes:
+    """
+    Returns the cache key (a sha256 digest) of a text embedded with the given model.
+    """
+    return hashlib.sha256(f"{model_name}\0{normalize_text(text)}".encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed on-disk embedding cache for a single embeddings model.
+
+    Vectors live in a memory-mapped float32 matrix (`<model>.f32`) and are located through a
+    compact index of sha256 digests (`<model>.index.npy`). When the matrix reaches the size
+    budget, the least recently used rows are overwritten.
+
+    Several processes can share a cache directory (the app and batch ingestion). New embeddings
+    are buffered in memory and written by flush under an exclusive lock on `<model>.lock`, after
+    reloading the index another process may have written. Reads hold a shared lock and reload the
+    index whenever it changed on disk, so a row is never read under a key another process replaced.
+    """
+
+    def __init__(self, model_name: str, directory: str = None, max_bytes: int = None):
+        """
+        Open (or create) the cache for a model.
+
+        Args:
+            model_name (str): Name of the embeddings model; part of every key.
+            directory (str, optional): Cache directory. Defaults to settings.EMBEDDING_CACHE_DIR.
+            max_bytes (int, optional): Size budget of the vector matrix. Defaults to settings.EMBEDDING_CACHE_MAX_MB.
+        """
+        self.model_name = model_name
+        self.directory = directory or settings.EMBEDDING_CACHE_DIR
+        self.max_bytes = max_bytes or settings.EMBEDDING_CACHE_MAX_MB * 1024 * 1024
+        os.makedirs(self.directory, exist_ok=True)
+
+        base_name = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+        self.vectors_path = os.path.join(self.directory, f"{base_name}.f32")
+        self.index_path = os.path.join(self.directory, f"{base_name}.index.npy")
+        self.meta_path = os.path.join(self.directory, f"{base_name}.meta.json")
+        self.lock_path = os.path.join(self.directory, f"{base_name}.lock")
+
+        self.lock = threading.RLock()
+        self.dim = None
+        self.vectors = None
+        self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        self.rows: Dict[bytes, int] = {}
+        self.size = 0
+        self.loaded_version = None
+        # Not yet on disk: new embeddings, and when cached ones were last read
+        self.pending: Dict[bytes, List[float]] = {}
+        self.touched: Dict[bytes, float] = {}
+        self.flushed_at = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with file_lock(self.lock_path, shared=True):
+            self._load()
+
+    def _version(self) -> Optional[tuple]:
+        """
+        Identifies the index file on disk; it changes whenever a flush replaces it.
+        """
+        try:
+            stat = os.stat(self.index_path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        """
+        Reloads the index, and remaps the matrix, if another process flushed since they were read.
+        Must be called under the file lock.
+        """
+        version = self._version()
+        if version is None or version == self.loaded_version:
+            return
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            index = np.load(self.index_path)
+            if self.vectors is None or self.vectors.shape != (len(index), meta["dim"]):
+                if self.vectors is not None:
+                    self.vectors.flush()
+                self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(len(index), meta["dim"]))
+            self.dim = meta["dim"]
+            self.size = meta["size"]
+            self.index = index
+            self.rows = {index["digest"][row].tobytes(): row for row in range(self.size)}
+            self.loaded_version = version
+        except (OSError, ValueError, KeyError) as e:
+            # A cache that cannot be read is simply rebuilt
+            print(f"Error loading embedding cache {self.vectors_path}: {e}")
+            self.dim, self.vectors, self.size, self.rows = None, None, 0, {}
+            self.index = np.zeros(0, dtype=INDEX_DTYPE)
+            self.loaded_version = None
+
+    @property
+    def max_rows(self) -> int:
+        return max(1, self.max_bytes // (self.dim * 4 + INDEX_DTYPE.itemsize))
+
+    def _grow(self, needed_rows: int):
+        """
+        Grows the matrix and the index so they can hold `needed_rows` rows (capped at max_rows).
+        """
+        capacity = len(self.index)
+        if needed_rows <= capacity or capacity >= self.max_rows:
+            return
+        new_capacity = min(self.max_rows, max(INITIAL_ROWS, capacity * 2, needed_rows))
+        if self.vectors is not None:
+            self.vectors.flush()
+            del self.vectors
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(new_capacity, self.dim))
+        index = np.zeros(new_capacity, dtype=INDEX_DTYPE)
+        index[:capacity] = self.index
+        self.index = index
+
+    def _free_rows(self, count: int) -> List[int]:
+        """
+        Returns `count` writable rows, appending while there is room and evicting the least recently used rows otherwise.
+        """
+        used = self.size
+        self._grow(used + count)
+        rows = list(range(used, min(used + count, len(self.index))))
+        self.size += len(rows)
+
+        missing = count - len(rows)
+        if missing > 0:
+            candidates = np.argpartition(self.index["last_used"][:used], missing - 1)[:missing]
+            for row in candidates:
+                self.rows.pop(self.index["digest"][row].tobytes(), None)
+            rows.extend(int(row) for row in candidates)
+            self.evictions += missing
+        return rows
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Look up cached embeddings.
+
+        Args:
+            texts (List[str]): The texts to look up.
+
+        Returns:
+            List[Optional[List[float]]]: The cached embedding of each text, or None on a miss.
+        """
+        keys = [make_key(self.model_name, text) for text in texts]
+        now = time.time()
+        results = []
+        with self.lock, file_lock(self.lock_path, shared=True):
+            self._load()
+            for key in keys:
+                vector = self.pending.get(key)
+                row = self.rows.get(key) if vector is None else None
+                if vector is None and row is None:
+                    self.misses += 1
+                    results.append(None)
+                    continue
+                self.hits += 1
+                if row is not None:
+                    vector = self.vectors[row].tolist()
+                    self.touched[key] = now
+                results.append(vector)
+        return results
+
+    def put_many(self, texts: List[str], vectors: List[List[float]]) -> None:
+        """
+        Add embeddings to the cache. They are written to disk once settings.EMBEDDING_CACHE_FLUSH_ROWS
+        are buffered or settings.EMBEDDING_CACHE_FLUSH_SECONDS after the last flush.
+
+        Args:
+            texts (List[str]): The embedded texts.
+            vectors (List[List[float]]): Their embeddings, in the same order.
+        """
+        if not texts:
+            return
+        with self.lock:
+            # Later duplicates overwrite earlier ones
+            self.pending.update(zip((make_key(self.model_name, text) for text in texts), vectors))
+            if (len(self.pending) >= settings.EMBEDDING_CACHE_FLUSH_ROWS
+                    or time.time() - self.flushed_at >= settings.EMBEDDING_CACHE_FLUSH_SECONDS):
+                self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the buffered embeddings and the read times to disk, merged into the index as another
+        process may have left it.
+        """
+        with self.lock:
+            if not self.pending and not self.touched:
+                return
+            with file_lock(self.lock_path):
+                self._load()
+                for key, used in self.touched.items():
+                    row = self.rows.get(key)
+                    if row is not None:
+                        self.index["last_used"][row] = max(self.index["last_used"][row], used)
+                if self.pending:
+                    self._write(self.pending)
+                if self.vectors is not None:
+                    self.vectors.flush()
+                    tmp_index = self.index_path + ".tmp"
+                    with open(tmp_index, "wb") as f:
+                        np.save(f, self.index)
+                    os.replace(tmp_index, self.index_path)
+                    tmp_meta = self.meta_path + ".tmp"
+                    with open(tmp_meta, "w") as f:
+                        json.dump({"model": self.model_name, "dim": self.dim, "size": self.size}, f)
+                    os.replace(tmp_meta, self.meta_path)
+                    self.loaded_version = self._version()
+            self.pending = {}
+            self.touched = {}
+            self.flushed_at = time.time()
+
+    def _write(self, entries: Dict[bytes, List[float]]) -> None:
+        """
+        Writes embeddings into the matrix, reusing the rows of keys already cached. Must be called under the file lock.
+        """
+        if self.dim is None:
+            self.dim = len(next(iter(entries.values())))
+        now = time.time()
+        new_keys = []
+        # Refresh existing rows first, they must not be evicted by this batch
+        for key, vector in entries.items():
+            row = self.rows.get(key)
+            if row is None:
+                new_keys.append(key)
+            else:
+                self.vectors[row] = vector
+                self.index["last_used"][row] = now
+        # A batch larger than the whole cache only keeps its tail
+        room = self.max_rows - (len(entries) - len(new_keys))
+        new_keys = new_keys[max(0, len(new_keys) - room):] if room > 0 else []
+        for key, row in zip(new_keys, self._free_rows(len(new_keys))):
+            self.rows[key] = row
+            self.index["digest"][row] = np.frombuffer(key, dtype=np.uint8)
+            self.vectors[row] = entries[key]
+            self.index["last_used"][row] = now
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns hit/miss counters and occupancy of the cache.
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.rows) + sum(key not in self.rows for key in self.pending),
+                "capacity": len(self.index),
+            }
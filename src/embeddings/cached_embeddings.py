@@ -0,0 +1,97 @@
+import atexit
+import threading
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+from src.clients import get_http_client
+from src.config import settings
+from src.embeddings.cache import EmbeddingCache
+from src.executor import call_with_retries
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that sends every call through call_with_retries, under the EMBEDDINGS_* rate limits.
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        """
+        Args:
+            embeddings (Embeddings): The model, built without retries of its own.
+        """
+        self.embeddings = embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Roughly four characters per token is enough for rate limiting
+        return call_with_retries(
+            self.embeddings.embed_documents, texts,
+            model_name=settings.EMBEDDINGS_MODEL, tokens=sum(len(text) for text in texts) // 4,
+        )
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves repeated texts from an EmbeddingCache and only sends misses to the underlying model.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        """
+        Args:
+            embeddings (Embeddings): The model used for cache misses, rate-limited and retried.
+            cache (EmbeddingCache): The cache for that model.
+        """
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts, calling the underlying model once for all texts missing from the cache.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: One embedding per text.
+        """
+        vectors = self.cache.get_many(texts)
+        # Deduplicate misses so a text repeated in the batch is embedded once
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            computed = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            self.cache.put_many(missing, [computed[text] for text in missing])
+            vectors = [computed[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+
+def get_embeddings() -> Embeddings:
+    """
+    Returns the process-wide embeddings model: rate-limited and retried, and wrapped in the on-disk
+    cache when settings.EMBEDDING_CACHE_ENABLED is set.
+    """
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            embeddings = RateLimitedEmbeddings(OpenAIEmbeddings(
+                model=settings.EMBEDDINGS_MODEL,
+                openai_api_key=settings.OPENAI_API_KEY,
+                http_client=get_http_client(),
+                max_retries=0,
+            ))
+            if settings.EMBEDDING_CACHE_ENABLED:
+                cache = EmbeddingCache(settings.EMBEDDINGS_MODEL)
+                atexit.register(cache.flush)
+                embeddings = CachedEmbeddings(embeddings, cache)
+            _embeddings = embeddings
+        return _embeddings
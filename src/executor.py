@@ -0,0 +1,281 @@
+import asyncio
+import random
+import threading
+import time
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+import httpx
+import openai
+
+from src.config import settings
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter enforcing both a requests-per-minute and a tokens-per-minute budget.
+
+    Each bucket holds at most one minute of budget and refills continuously, so callers can use
+    the whole rate limit without going over it.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.available_requests = float(requests_per_minute)
+        self.available_tokens = float(tokens_per_minute)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _reserve(self, tokens: int) -> float:
+        """
+        Takes one request and `tokens` tokens from the buckets if they are available.
+
+        Returns:
+            float: 0 when the reservation was made, otherwise the seconds to wait before retrying.
+        """
+        # A call larger than the whole budget waits for a full bucket instead of forever
+        tokens = min(tokens, self.tokens_per_minute)
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.updated_at
+            self.updated_at = now
+            self.available_requests = min(self.requests_per_minute, self.available_requests + elapsed * self.requests_per_minute / 60)
+            self.available_tokens = min(self.tokens_per_minute, self.available_tokens + elapsed * self.tokens_per_minute / 60)
+
+            if self.available_requests >= 1 and self.available_tokens >= tokens:
+                self.available_requests -= 1
+                self.available_tokens -= tokens
+                return 0.0
+            request_wait = max(0.0, 1 - self.available_requests) * 60 / self.requests_per_minute
+            token_wait = max(0.0, tokens - self.available_tokens) * 60 / self.tokens_per_minute
+            return max(request_wait, token_wait)
+
+    def acquire(self, tokens: int = 0) -> None:
+        """
+        Blocks until one request using `tokens` tokens fits in the rate limit.
+        """
+        while (wait := self._reserve(tokens)) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int = 0) -> None:
+        """
+        Async variant of acquire; waits without blocking the event loop.
+        """
+        while (wait := self._reserve(tokens)) > 0:
+            await asyncio.sleep(wait)
+
+
+_rate_limiters: Dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(model_name: str) -> RateLimiter:
+    """
+    Returns the process-wide rate limiter of a model (OpenAI limits are per model).
+    """
+    with _rate_limiters_lock:
+        if model_name not in _rate_limiters:
+            if model_name == settings.EMBEDDINGS_MODEL:
+                limits = (settings.EMBEDDINGS_REQUESTS_PER_MINUTE, settings.EMBEDDINGS_TOKENS_PER_MINUTE)
+            else:
+                limits = (settings.CHAT_REQUESTS_PER_MINUTE, settings.CHAT_TOKENS_PER_MINUTE)
+            _rate_limiters[model_name] = RateLimiter(*limits)
+        return _rate_limiters[model_name]
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Returns True for errors worth retrying: rate limits, server errors, timeouts and connection errors.
+    """
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, (httpx.TimeoutException, httpx.NetworkError))
+
+
+def backoff_delay(attempt: int, error: Exception = None) -> float:
+    """
+    Returns the delay before retry number `attempt` (from 0): the server's Retry-After when given,
+    otherwise exponential backoff with full jitter.
+    """
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), settings.RETRY_MAX_DELAY)
+        except ValueError:
+            pass
+    return random.uniform(0, min(settings.RETRY_MAX_DELAY, settings.RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def call_with_retries(func: Callable, *args, model_name: str = None, tokens: int = 0, **kwargs) -> Any:
+    """
+    Calls an OpenAI API function within the model's rate limit, retrying retryable errors with jittered backoff.
+
+    Args:
+        func (Callable): The function to call.
+        model_name (str, optional): Model whose rate limit applies. Defaults to settings.CHAT_MODEL.
+        tokens (int, optional): Estimated tokens used by the call. Default is 0.
+
+    Returns:
+        Any: The function's result.
+    """
+    limiter = get_rate_limiter(model_name or settings.CHAT_MODEL)
+    for attempt in range(settings.MAX_RETRIES + 1):
+        limiter.acquire(tokens)
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt == settings.MAX_RETRIES or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, e)
+            print(f"Retrying after {type(e).__name__} in {delay:.1f}s (attempt {attempt + 1}/{settings.MAX_RETRIES})")
+            time.sleep(delay)
+
+
+async def call_with_retries_async(func: Callable, *args, model_name: str = None, tokens: int = 0, **kwargs) -> Any:
+    """
+    Async variant of call_with_retries for coroutine functions.
+    """
+    limiter = get_rate_limiter(model_name or settings.CHAT_MODEL)
+    for attempt in range(settings.MAX_RETRIES + 1):
+        await limiter.acquire_async(tokens)
+        try:
+            return await func(*args, **kwargs)
+        except Exception as e:
+            if attempt == settings.MAX_RETRIES or not is_retryable(e):
+                raise
+            delay = backoff_delay(attempt, e)
+            print(f"Retrying after {type(e).__name__} in {delay:.1f}s (attempt {attempt + 1}/{settings.MAX_RETRIES})")
+            await asyncio.sleep(delay)
+
+
+class ItemFailure(NamedTuple):
+    """
+    An item of execute_parallel whose call raised.
+    """
+    index: int
+    item: Any
+    error: Exception
+
+
+_executor = None
+_process_pool = None
+_pipeline_pool = None
+_table_pool = None
+_executor_lock = threading.Lock()
+_worker_state = threading.local()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Returns the process-wide bounded worker pool (settings.MAX_WORKERS threads).
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.MAX_WORKERS, thread_name_prefix="rag-worker")
+        return _executor
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process-wide pool for CPU-bound work such as page rendering (settings.RENDER_WORKERS processes).
+
+    Workers are spawned rather than forked since the parent process runs threads and open HTTP connections.
+    """
+    global _process_pool
+    with _executor_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=settings.RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+
+
+def get_pipeline_pool() -> ThreadPoolExecutor:
+    """
+    Returns the process-wide pool running ingestion pipeline stages (settings.PIPELINE_WORKERS threads).
+
+    Stages wait on work they hand to the worker and process pools, so they get their own threads
+    instead of taking the slots of that work.
+    """
+    global _pipeline_pool
+    with _executor_lock:
+        if _pipeline_pool is None:
+            _pipeline_pool = ThreadPoolExecutor(max_workers=settings.PIPELINE_WORKERS, thread_name_prefix="rag-pipeline")
+        return _pipeline_pool
+
+
+def get_table_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process-wide pool extracting tables with tabula (settings.TABLE_WORKERS processes).
+
+    tabula-py starts one JVM per process, so long-lived workers pay JVM startup and class loading
+    once rather than per document. The pool is small since every worker holds a JVM heap.
+    """
+    global _table_pool
+    with _executor_lock:
+        if _table_pool is None:
+            _table_pool = ProcessPoolExecutor(
+                max_workers=settings.TABLE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _table_pool
+
+
+def _run_item(func: Callable, item: Any, args: tuple, kwargs: dict) -> Any:
+    _worker_state.active = True
+    try:
+        return func(item, *args, **kwargs)
+    finally:
+        _worker_state.active = False
+
+
+def run_parallel(func: Callable, data_list: List[Any], *args, **kwargs) -> Tuple[List[Any], List[ItemFailure]]:
+    """
+    Calls `func(item, *args, **kwargs)` for every item on the shared worker pool.
+
+    Items are submitted as `data_list` yields them, so it can be a generator producing work
+    progressively. Calls made from inside a pool worker run inline, so nested parallel sections
+    cannot exhaust the bounded pool and deadlock.
+
+    Args:
+        func (Callable): The function to call for each item.
+        data_list (Iterable[Any]): The items.
+
+    Returns:
+        Tuple[List[Any], List[ItemFailure]]: Results of the successful calls in item order, and the failures.
+    """
+    items = []
+    outcomes = []
+    if getattr(_worker_state, "active", False):
+        for item in data_list:
+            items.append(item)
+            try:
+                outcomes.append((func(item, *args, **kwargs), None))
+            except Exception as e:
+                outcomes.append((None, e))
+    else:
+        futures = []
+        for item in data_list:
+            items.append(item)
+            futures.append(get_executor().submit(_run_item, func, item, args, kwargs))
+        outcomes = [(None, future.exception()) if future.exception() else (future.result(), None) for future in futures]
+    data_list = items
+
+    results = []
+    failures = []
+    for index, (item, (result, error)) in enumerate(zip(data_list, outcomes)):
+        if error is None:
+            results.append(result)
+        else:
+            failures.append(ItemFailure(index, item, error))
+            print(f"Error processing item {index} with {getattr(func, '__name__', func)}: {error!r}")
+            traceback.print_exception(type(error), error, error.__traceback__)
+    if failures:
+        print(f"{len(failures)} of {len(data_list)} items failed")
+    return results, failures
@@ -0,0 +1,38 @@
+import contextlib
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextlib.contextmanager
+def file_lock(path: str, shared: bool = False):
+    """
+    Holds an advisory lock on a lock file (created if needed) for the duration of the block, so that
+    processes sharing files on disk do not interleave their writes.
+
+    Shared locks are held by several readers at once and exclude writers. msvcrt only has exclusive
+    locks, so on Windows shared locks are exclusive too.
+
+    Args:
+        path (str): Path of the lock file.
+        shared (bool, optional): Take a shared (read) lock instead of an exclusive one. Default is False.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
@@ -1,11 +1,15 @@
 from src.vectordbs.base import VectorDatabaseInterface
-from typing import Any, Dict, List, Tuple
-from src.utils import describe_image, convert_image_to_base64,execute_parallel, clean_text
+from typing import Any, Dict, Iterable, List, Tuple
+from src.utils import describe_image, clean_text
+from src.executor import run_parallel
+from src.image_mode.pdf2img import PAGE_FILE_PATTERN, page_number_from_path
+from src.image_mode.payload_store import get_payload_store, load_page_payload
+from src.chunk_stats import with_chunk_stats
 import os
 
 class ImageDataIngestor:
 
-    def __init__(self, db_client: VectorDatabaseInterface ,folder_path:str , initial_data: str = None  ):
+    def __init__(self, db_client: VectorDatabaseInterface ,folder_path:str , initial_data: str = None, file_name: str = None, pages: List[int] = None):
         """
         Initialize the TextDataIngestor with the specified database client and optional initial data.
 
@@ -13,9 +17,13 @@ class ImageDataIngestor:
             db_client (Any): The client or instance of the vector database to use (e.g., a MongoDB client, a Weaviate client).
             initial_data (str, optional): Initial text data to ingest and process. Default is None.
             user_id (str, must) : Storing of data under this user_id index. Default is None.
+            file_name (str, optional): Name of the PDF the page images belong to. Default is None.
+            pages (List[int], optional): 1-based pages to ingest. Default is None, which ingests every page image in the folder.
         """
         self.database = db_client
         self.folder = folder_path
+        self.file_name = file_name
+        self.pages = pages
 
     def data_extractor(self, file_path: str) -> Any:
         """
@@ -25,10 +33,10 @@ class ImageDataIngestor:
             file_path (str): Path to the PDF file.
 
         Returns:
-            Any: Image data in base64 format.
+            Any: Image data prepared for the vision model.
         """
-        image_data = convert_image_to_base64(file_path)
-        return image_data
+        # Also keeps the payload ready for the queries that will retrieve this page; main flushes the store
+        return load_page_payload(file_path, flush=False)
 
     def transform_data(self, data: Any, file_path: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
         """
@@ -49,7 +57,7 @@ class ImageDataIngestor:
         summary = description+" "+extracted_text
 
         content = {"content":summary}
-        metadata = {'file_path': file_path}
+        metadata = {'file_path': file_path, 'file_name': self.file_name or os.path.basename(self.folder), 'page': page_number_from_path(file_path)}
 
         return content, metadata
 
@@ -62,21 +70,46 @@ class ImageDataIngestor:
             file_path (str): Path of the file being ingested.
         """
         print("Ingesting image data")
-        
-        image_data = self.data_extractor(file_path)
-        content, metadata = self.transform_data(image_data, file_path)
+
+        content, metadata = self.prepare_data(file_path)
 
         self.database.store_vector(content , metadata)
 
-    def main(self) -> None:
+    def prepare_data(self, file_path: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Extract and describe a page image, returning a record ready to be stored.
+
+        Args:
+            file_path (str): Path of the page image.
+
+        Returns:
+            Tuple[Dict[str, Any], Dict[str, Any]]: Data dictionary and metadata.
+        """
+        image_data = self.data_extractor(file_path)
+        return self.transform_data(image_data, file_path)
+
+    def main(self, file_paths: Iterable[str] = None) -> List[int]:
         """
         Execute the ingestion pipeline for image data.
 
         Args:
-            file_path (str): Path to the PDF file.
+            file_paths (Iterable[str], optional): Page images to ingest, possibly yielded while they are
+                being rendered; each one is described as soon as it arrives. Default is None, which
+                ingests the page images found in the folder.
+
+        Returns:
+            List[int]: 1-based pages that could not be described, and were not stored.
         """
         print("Extracting image data")
-        file_paths = [os.path.join(self.folder, f) for f in os.listdir(self.folder) if os.path.isfile(os.path.join(self.folder, f))]
-        
-        if len(file_paths) > 0:
-            execute_parallel(self.ingest_data, file_paths)
+        if file_paths is None:
+            # The folder also holds the page payload store, only page images are ingested
+            file_paths = [os.path.join(self.folder, f) for f in os.listdir(self.folder) if PAGE_FILE_PATTERN.search(f)]
+            if self.pages is not None:
+                file_paths = [path for path in file_paths if page_number_from_path(path) in self.pages]
+
+        records, failures = run_parallel(self.prepare_data, file_paths)
+        get_payload_store(self.folder).flush()
+        if len(records) > 0:
+            metadata_list = with_chunk_stats([data["content"] for data, _ in records], [metadata for _, metadata in records], "image")
+            self.database.store_vectors([data for data, _ in records], metadata_list)
+        return sorted({page_number_from_path(failure.item) for failure in failures})
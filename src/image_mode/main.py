@@ -1,26 +1,38 @@
 from src.config import settings
 from src.vectordbs.base import VectorDatabaseInterface
 from src.image_mode.image_ingestor import ImageDataIngestor
-from src.image_mode.pdf2img import convert_pdf_to_images
+from src.image_mode.pdf2img import get_image_folder, iter_pdf_pages
+from src.document import ParsedDocument
+from src.manifest import document_name
+from typing import List, Tuple
 
-def load_images(vector_db_client: VectorDatabaseInterface , file_path : str ) -> str:
+def load_images(vector_db_client: VectorDatabaseInterface , file_path : str, pages: List[int] = None, document: ParsedDocument = None) -> Tuple[str, List[int]]:
     """
     Main function to load embeddings into the vector database using OpenAI embeddings.
 
     Args:
         data_directory (str): Path to the directory containing BidX folders.
         vector_database (str): The name of the vector database (e.g., "chromadb").
+        pages (List[int], optional): 1-based pages to ingest. Default is None, which ingests every page.
+        document (ParsedDocument, optional): The document already parsed. Default is None.
 
     Returns:
-        str: A message indicating success or failure.
+        Tuple[str, List[int]]: A message indicating success or failure, and the 1-based pages that failed.
     """
     
-    target_folder = convert_pdf_to_images(file_path)
+    target_folder = get_image_folder(file_path)
+    failed_pages = []
     
     if 'image' in target_folder.lower():
-        ImageDataIngestor(folder_path=target_folder, db_client=vector_db_client).main()
-        
-    return "Success: All image data ingested successfully."
+        # Pages are described as soon as they are rendered
+        # Render workers open the PDF themselves: a PyMuPDF document cannot be shared across processes
+        page_count = document.page_count if document is not None else None
+        page_images = (image_path for _, image_path in iter_pdf_pages(file_path, pages=pages, page_count=page_count))
+        failed_pages = ImageDataIngestor(folder_path=target_folder, db_client=vector_db_client, file_name=document_name(file_path), pages=pages).main(page_images)
+
+    if failed_pages:
+        return f"Error: pages {failed_pages} could not be ingested.", failed_pages
+    return "Success: All image data ingested successfully.", failed_pages
 
 if __name__ == "__main__":
     vector_database = "chromadb"
@@ -0,0 +1,270 @@
+import json
+import mmap
+import os
+import threading
+from typing import Dict, Optional
+
+from src.config import settings
+from src.file_lock import file_lock
+from src.image_preparation import ImagePayload, prepare_image, settings_signature
+
+BLOB_FILE = "payloads.bin"
+INDEX_FILE = "payloads.index.json"
+LOCK_FILE = "payloads.lock"
+
+
+class PagePayloadStore:
+    """
+    Ready-to-send payloads of the page images of one document.
+
+    The Base64 payloads are appended to a single blob file (`payloads.bin`) that is memory-mapped
+    for reading, and located through an offset index keyed by page image file name
+    (`payloads.index.json`). A query slices its pages out of the mapping instead of reading and
+    encoding the PNG files.
+
+    Several processes can share a store (the app and batch ingestion). Puts are buffered in memory
+    and appended, with one atomic rewrite of the index, by each flush under a lock file; readers
+    reload the index whenever it changed on disk.
+    Compaction never rewrites the blob in place: it writes the live payloads to a new blob file
+    that the new index names, so offsets are always applied to the blob they were written in.
+    """
+
+    def __init__(self, folder: str):
+        """
+        Open (or create) the payload store of a page image folder.
+
+        Args:
+            folder (str): The folder holding the page images, as returned by get_image_folder.
+        """
+        self.folder = folder
+        self.index_path = os.path.join(folder, INDEX_FILE)
+        self.lock_path = os.path.join(folder, LOCK_FILE)
+        self.lock = threading.RLock()
+        self.entries: Dict[str, dict] = {}
+        # Payloads put since the last flush: file name -> (entry without its offset and length, data)
+        self.pending: Dict[str, tuple] = {}
+        self.blob_name = BLOB_FILE
+        self.generation = 0
+        self.dead_bytes = 0
+        self.index_stamp = None
+        self.mapping = None
+        self.mapped_blob = None  # (file name, inode) of the mapped blob
+        self._load()
+
+    @property
+    def blob_path(self) -> str:
+        return os.path.join(self.folder, self.blob_name)
+
+    @staticmethod
+    def _file_stamp(path: str) -> Optional[tuple]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        """
+        Reloads the index if it was rewritten since it was read, by this process or another.
+        """
+        stamp = self._file_stamp(self.index_path)
+        if stamp is None or stamp == self.index_stamp:
+            return
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+            self.entries = index["entries"]
+            self.dead_bytes = index.get("dead_bytes", 0)
+            self.blob_name = index.get("blob", BLOB_FILE)
+            self.generation = index.get("generation", 0)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable payload index {self.index_path}: {e!r}")
+            self.entries = {}
+        self.index_stamp = stamp
+
+    def _write_index(self):
+        """
+        Atomically replaces the index. Must be called under the lock file.
+        """
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"entries": self.entries, "dead_bytes": self.dead_bytes, "blob": self.blob_name,
+                       "generation": self.generation}, f)
+        os.replace(tmp_path, self.index_path)
+        self.index_stamp = self._file_stamp(self.index_path)
+
+    @staticmethod
+    def _source_stamp(image_path: str) -> list:
+        stat = os.stat(image_path)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def _map(self, end: int) -> Optional[mmap.mmap]:
+        """
+        Returns the mapping of the index's blob, renewed when the blob was replaced or an entry lies past its end.
+        """
+        stamp = self._file_stamp(self.blob_path)
+        if stamp is None:
+            return None
+        blob = (self.blob_name, stamp[0])
+        if self.mapping is None or self.mapped_blob != blob or len(self.mapping) < end:
+            if self.mapping is not None:
+                self.mapping.close()
+                self.mapping = None
+            with open(self.blob_path, "rb") as f:
+                self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.mapped_blob = (self.blob_name, os.fstat(f.fileno()).st_ino)
+        return self.mapping if len(self.mapping) >= end else None
+
+    def get(self, image_path: str) -> Optional[ImagePayload]:
+        """
+        Returns the stored payload of a page image, or None if it is missing or stale.
+
+        Args:
+            image_path (str): Path of the page image.
+
+        Returns:
+            Optional[ImagePayload]: The payload, ready to be sent to the vision model.
+        """
+        name = os.path.basename(image_path)
+        with self.lock:
+            if name in self.pending:
+                entry, data = self.pending[name]
+            else:
+                self._load()
+                entry, data = self.entries.get(name), None
+            if entry is None or entry["settings"] != settings_signature():
+                return None
+            try:
+                if entry["source"] != self._source_stamp(image_path):
+                    return None
+                if data is not None:
+                    return ImagePayload(data.decode("ascii"), entry["mime_type"], entry["detail"])
+                offset, length = entry["offset"], entry["length"]
+                mapping = self._map(offset + length)
+            except (OSError, ValueError):
+                # The blob was compacted away by another process since the index was read
+                return None
+            if mapping is None:
+                return None
+            data = mapping[offset:offset + length]
+        return ImagePayload(data.decode("ascii"), entry["mime_type"], entry["detail"])
+
+    def put(self, image_path: str, payload: ImagePayload) -> None:
+        """
+        Buffers the payload of a page image, replacing any previous one; it is written by the next flush.
+
+        Args:
+            image_path (str): Path of the page image.
+            payload (ImagePayload): The prepared image.
+        """
+        entry = {
+            "mime_type": payload.mime_type,
+            "detail": payload.detail,
+            "settings": settings_signature(),
+            "source": self._source_stamp(image_path),
+        }
+        with self.lock:
+            self.pending[os.path.basename(image_path)] = (entry, payload.data.encode("ascii"))
+            full = len(self.pending) >= settings.PAYLOAD_STORE_FLUSH_PAGES
+        if full:
+            self.flush()
+
+    def _compact(self) -> None:
+        """
+        Copies the live payloads to a new blob file, points the index to it and removes the old blob.
+        Must hold the lock file, with the index loaded.
+        """
+        old_path = self.blob_path
+        new_name = f"payloads.{self.generation + 1}.bin"
+        entries = {}
+        with open(os.path.join(self.folder, new_name), "wb") as f:
+            for name, entry in sorted(self.entries.items(), key=lambda item: item[1]["offset"]):
+                offset, length = entry["offset"], entry["length"]
+                mapping = self._map(offset + length)
+                if mapping is None:
+                    continue
+                entries[name] = dict(entry, offset=f.tell())
+                f.write(mapping[offset:offset + length])
+        self.entries = entries
+        self.blob_name = new_name
+        self.generation += 1
+        self.dead_bytes = 0
+        self._write_index()
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+        try:
+            # Readers that mapped the old blob keep reading it; on Windows it stays until they let go
+            os.remove(old_path)
+        except OSError:
+            pass
+
+    def compact(self) -> None:
+        """
+        Copies the live payloads to a new blob file, points the index to it and removes the old blob.
+        """
+        with self.lock, file_lock(self.lock_path):
+            self._load()
+            self._compact()
+
+    def flush(self) -> None:
+        """
+        Appends the buffered payloads to the blob and writes the index once, then compacts the blob
+        when most of it is replaced payloads.
+        """
+        with self.lock:
+            if not self.pending:
+                return
+            with file_lock(self.lock_path):
+                self._load()
+                with open(self.blob_path, "ab") as f:
+                    for name, (entry, data) in self.pending.items():
+                        previous = self.entries.get(name)
+                        if previous is not None:
+                            self.dead_bytes += previous["length"]
+                        self.entries[name] = dict(entry, offset=f.tell(), length=len(data))
+                        f.write(data)
+                self.pending = {}
+                live_bytes = sum(entry["length"] for entry in self.entries.values())
+                if self.dead_bytes > live_bytes:
+                    self._compact()
+                else:
+                    self._write_index()
+
+
+_stores: Dict[str, PagePayloadStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_payload_store(folder: str) -> PagePayloadStore:
+    """
+    Returns the process-wide payload store of a page image folder, so its mapping stays open between queries.
+    """
+    folder = os.path.abspath(folder)
+    with _stores_lock:
+        if folder not in _stores:
+            _stores[folder] = PagePayloadStore(folder)
+        return _stores[folder]
+
+
+def load_page_payload(image_path: str, flush: bool = True) -> ImagePayload:
+    """
+    Returns the payload of a page image from its document's store, preparing and storing it on a miss.
+
+    Args:
+        image_path (str): Path of the page image.
+        flush (bool, optional): Write a new payload to disk right away. Default is True; ingestion
+            flushes the store once all of a document's pages are prepared.
+
+    Returns:
+        ImagePayload: The payload, ready to be sent to the vision model.
+    """
+    store = get_payload_store(os.path.dirname(image_path))
+    payload = store.get(image_path)
+    if payload is None:
+        # The store is the only cache of page payloads
+        payload = prepare_image(image_path, cache=False)
+        store.put(image_path, payload)
+        if flush:
+            store.flush()
+    return payload
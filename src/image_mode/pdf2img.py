@@ -1,34 +1,106 @@
-from pdf2image import convert_from_path
+import fitz  # PyMUPDF
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Iterator, List, Tuple
+from src.config import settings
 import os
+import re
 
-def convert_pdf_to_images(pdf_path: str):
+PAGE_FILE_PATTERN = re.compile(r"page_(\d+)\.png$")
+
+def page_number_from_path(image_path: str) -> int:
     """
-    Converts each page of a PDF into images and saves them in a dynamically created folder
-    with the format 'images-<pdf_name>'.
+    Returns the 1-based page number of a page image saved by convert_pdf_to_images.
+    """
+    match = PAGE_FILE_PATTERN.search(os.path.basename(image_path))
+    return int(match.group(1)) if match else 1
+
+def get_image_folder(pdf_path: str) -> str:
+    """
+    Returns the folder holding the page images of a PDF, with the format 'images-<pdf_name>'.
+    """
+    directory, file_name = os.path.split(pdf_path)
+    return os.path.join(directory, f'images-{os.path.splitext(file_name)[0]}')
+
+def render_pages(pdf_path: str, pages: List[int], output_dir: str, dpi: int) -> List[Tuple[int, str]]:
+    """
+    Renders some pages of a PDF to PNG files. Runs in a worker process, one page in memory at a time.
+
+    Returns:
+        List[Tuple[int, str]]: (page number, image path) of each rendered page.
+    """
+    rendered = []
+    with fitz.open(pdf_path) as doc:
+        for page_number in pages:
+            pixmap = doc[page_number - 1].get_pixmap(dpi=dpi)
+            image_path = os.path.join(output_dir, f'page_{page_number}.png')
+            pixmap.save(image_path)
+            rendered.append((page_number, image_path))
+            del pixmap
+    return rendered
+
+def iter_pdf_pages(pdf_path: str, pages: List[int] = None, page_count: int = None) -> Iterator[Tuple[int, str]]:
+    """
+    Renders the pages of a PDF across the shared process pool and yields them as they finish,
+    so that they can be processed while later pages are still rendering.
+
+    Pages are sent to the workers in groups of settings.RENDER_PAGES_PER_TASK and at most two
+    groups per worker are in flight, so memory is bounded by the worker count, not the page count.
 
     Args:
         pdf_path (str): The file path of the PDF to be converted.
+        pages (List[int], optional): 1-based pages to render. Default is None, which renders every page.
+        page_count (int, optional): Number of pages of the PDF when already known. Default is None, which reads it.
+
+    Yields:
+        Tuple[int, str]: (page number, image path), in completion order.
     """
-    # Extract the directory and file name from the given path
-    directory, file_name = os.path.split(pdf_path)
-    # Create an output folder with the format 'images-<pdf_name_without_extension>'
-    output_dir = os.path.join(directory, f'images-{os.path.splitext(file_name)[0]}')
+    # Imported here so that render workers, which import this module, stay light to spawn
+    from src.executor import get_process_pool
+
+    output_dir = get_image_folder(pdf_path)
     os.makedirs(output_dir, exist_ok=True)
 
-    # Convert each page of the PDF into an image
-    images = convert_from_path(pdf_path)
+    if page_count is None:
+        with fitz.open(pdf_path) as doc:
+            page_count = doc.page_count
+    if pages is None:
+        pages = list(range(1, page_count + 1))
+        # Drop images left over from a longer previous version of the document
+        for name in os.listdir(output_dir):
+            if page_number_from_path(name) > page_count:
+                os.remove(os.path.join(output_dir, name))
+
+    pages = sorted(pages)
+    step = settings.RENDER_PAGES_PER_TASK
+    tasks = [pages[i:i + step] for i in range(0, len(pages), step)]
+    max_in_flight = 2 * settings.RENDER_WORKERS
+
+    pool = get_process_pool()
+    pending = set()
+    while tasks or pending:
+        while tasks and len(pending) < max_in_flight:
+            pending.add(pool.submit(render_pages, pdf_path, tasks.pop(0), output_dir, settings.RENDER_DPI))
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            for page_number, image_path in future.result():
+                print(f'Saved: {image_path}')
+                yield page_number, image_path
+
+def convert_pdf_to_images(pdf_path: str, pages: List[int] = None):
+    """
+    Converts each page of a PDF into images and saves them in a dynamically created folder
+    with the format 'images-<pdf_name>'.
 
-    # Save each page as an image in the output folder
-    for i, page in enumerate(images):
-        image_path = os.path.join(output_dir, f'page_{i + 1}.png')
-        page.save(image_path, 'PNG')
-        print(f'Saved: {image_path}')
+    Args:
+        pdf_path (str): The file path of the PDF to be converted.
+        pages (List[int], optional): 1-based pages to convert. Default is None, which converts every page.
+    """
+    for _ in iter_pdf_pages(pdf_path, pages):
+        pass
+    return str(get_image_folder(pdf_path))
 
-    return str(output_dir)
 
-        
 
 if __name__ == "__main__":
     pdf_path = r'data/JA-207652.pdf'
     convert_pdf_to_images(pdf_path)
-
@@ -0,0 +1,118 @@
+import base64
+import hashlib
+import io
+import json
+import os
+from typing import NamedTuple, Union
+
+from PIL import Image, ImageStat
+
+from src.config import settings
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+# Images whose longest side fits in one 512px tile lose nothing at low detail
+LOW_DETAIL_MAX_DIM = 512
+
+
+class ImagePayload(NamedTuple):
+    """
+    An image ready to be sent to the vision model.
+    """
+    data: str  # Base64 encoded image
+    mime_type: str
+    detail: str
+
+
+def is_text_only(image: Image.Image) -> bool:
+    """
+    Returns True when an image is (nearly) colourless, as scanned or rendered text pages are.
+    """
+    thumbnail = image.convert("RGB").resize((64, 64))
+    saturation = ImageStat.Stat(thumbnail.convert("HSV").getchannel("S")).mean[0]
+    return saturation < settings.IMAGE_GRAYSCALE_MAX_SATURATION
+
+
+def settings_signature() -> str:
+    """
+    Returns a string identifying the IMAGE_* settings that change the encoded payload.
+    """
+    return (f"{settings.IMAGE_MAX_DIM}:{settings.IMAGE_FORMAT}:{settings.IMAGE_QUALITY}:"
+            f"{settings.IMAGE_GRAYSCALE_TEXT_PAGES}:{settings.IMAGE_GRAYSCALE_MAX_SATURATION}:{settings.IMAGE_DETAIL}")
+
+
+def encode_image(image: Image.Image) -> ImagePayload:
+    """
+    Downscales, optionally converts to grayscale, and re-encodes an image according to the IMAGE_* settings.
+
+    Args:
+        image (Image.Image): The image to prepare.
+
+    Returns:
+        ImagePayload: The encoded image with its MIME type and detail level.
+    """
+    image_format = settings.IMAGE_FORMAT.upper()
+    if image.mode not in ("RGB", "L"):
+        # JPEG has no alpha channel: flatten transparent images on white, before any grayscale
+        # conversion, which would otherwise turn transparent areas black
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        image = background
+    if settings.IMAGE_GRAYSCALE_TEXT_PAGES and is_text_only(image):
+        image = image.convert("L")
+
+    if max(image.size) > settings.IMAGE_MAX_DIM:
+        image = image.copy()
+        image.thumbnail((settings.IMAGE_MAX_DIM, settings.IMAGE_MAX_DIM), Image.LANCZOS)
+
+    buffered = io.BytesIO()
+    if image_format == "PNG":
+        image.save(buffered, format="PNG", optimize=True)
+    else:
+        image.save(buffered, format=image_format, quality=settings.IMAGE_QUALITY)
+
+    detail = settings.IMAGE_DETAIL
+    if detail == "auto":
+        detail = "low" if max(image.size) <= LOW_DETAIL_MAX_DIM else "high"
+
+    return ImagePayload(base64.b64encode(buffered.getvalue()).decode("utf-8"), MIME_TYPES[image_format], detail)
+
+
+def prepare_image(image: Union[str, bytes, Image.Image], cache: bool = True) -> ImagePayload:
+    """
+    Prepares an image for a vision call, reusing the payload cached on disk for the same image and settings.
+
+    Args:
+        image (Union[str, bytes, Image.Image]): An image file path, encoded image bytes, or a PIL image.
+        cache (bool, optional): Use the cache in settings.IMAGE_CACHE_DIR. Default is True; page images
+            are kept in their document's payload store instead.
+
+    Returns:
+        ImagePayload: The encoded image with its MIME type and detail level.
+    """
+    if isinstance(image, Image.Image):
+        # In-memory images are not cached, hashing their pixels costs about as much as encoding them
+        return encode_image(image)
+
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            image = f.read()
+    if not cache:
+        return encode_image(Image.open(io.BytesIO(image)))
+
+    key = hashlib.sha256(image + settings_signature().encode("utf-8")).hexdigest()
+    cache_path = os.path.join(settings.IMAGE_CACHE_DIR, key[:2], f"{key}.json")
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path) as f:
+                return ImagePayload(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            pass
+
+    payload = encode_image(Image.open(io.BytesIO(image)))
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(payload._asdict(), f)
+    os.replace(tmp_path, cache_path)
+    return payload
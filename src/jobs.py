@@ -0,0 +1,122 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from src.config import settings
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    """
+    Checkpointed queue of ingestion jobs, one per file, in an SQLite table.
+
+    A job is claimed (pending -> running) before its file is ingested and marked done or failed
+    after, so a crashed run is resumed by putting its running jobs back to pending. A done job is
+    queued again when its file's size or modification time changes.
+    """
+
+    def __init__(self, path: str = None):
+        """
+        Args:
+            path (str, optional): Location of the SQLite database. Defaults to settings.JOBS_DB_PATH.
+        """
+        self.path = path or settings.JOBS_DB_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                file_path TEXT PRIMARY KEY, status TEXT NOT NULL, file_size INTEGER, file_mtime REAL,
+                pages INTEGER, attempts INTEGER NOT NULL DEFAULT 0, error TEXT,
+                started_at REAL, finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+        """)
+
+    def enqueue(self, file_paths: Iterable[str]) -> int:
+        """
+        Adds files to the queue; files already done are queued again only if they changed.
+
+        Returns:
+            int: Number of files queued (new or changed).
+        """
+        queued = 0
+        with self.lock:
+            for file_path in file_paths:
+                stat = os.stat(file_path)
+                row = self.connection.execute("SELECT status, file_size, file_mtime FROM jobs WHERE file_path = ?", (file_path,)).fetchone()
+                if row is None:
+                    self.connection.execute("INSERT INTO jobs (file_path, status, file_size, file_mtime) VALUES (?, ?, ?, ?)",
+                                            (file_path, PENDING, stat.st_size, stat.st_mtime))
+                    queued += 1
+                elif row[1:] != (stat.st_size, stat.st_mtime):
+                    self.connection.execute("UPDATE jobs SET status = ?, file_size = ?, file_mtime = ?, attempts = 0, error = NULL WHERE file_path = ?",
+                                            (PENDING, stat.st_size, stat.st_mtime, file_path))
+                    queued += 1
+                elif row[0] == PENDING:
+                    queued += 1
+            self.connection.commit()
+        return queued
+
+    def recover(self, retry_failed: bool = False) -> int:
+        """
+        Puts the jobs left running by an interrupted run, and optionally the failed ones, back to pending.
+
+        Returns:
+            int: Number of jobs put back.
+        """
+        statuses = (RUNNING, FAILED) if retry_failed else (RUNNING,)
+        with self.lock:
+            cursor = self.connection.execute(
+                f"UPDATE jobs SET status = ? WHERE status IN ({', '.join('?' * len(statuses))})", (PENDING, *statuses)
+            )
+            self.connection.commit()
+            return cursor.rowcount
+
+    def claim(self) -> Optional[str]:
+        """
+        Marks the next pending job as running.
+
+        Returns:
+            Optional[str]: Its file path, or None when no job is pending.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT file_path FROM jobs WHERE status = ? ORDER BY file_path LIMIT 1", (PENDING,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute("UPDATE jobs SET status = ?, attempts = attempts + 1, started_at = ? WHERE file_path = ?",
+                                    (RUNNING, time.time(), row[0]))
+            self.connection.commit()
+            return row[0]
+
+    def complete(self, file_path: str, pages: int) -> None:
+        with self.lock:
+            self.connection.execute("UPDATE jobs SET status = ?, pages = ?, error = NULL, finished_at = ? WHERE file_path = ?",
+                                    (DONE, pages, time.time(), file_path))
+            self.connection.commit()
+
+    def fail(self, file_path: str, error: str) -> None:
+        with self.lock:
+            self.connection.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE file_path = ?",
+                                    (FAILED, error, time.time(), file_path))
+            self.connection.commit()
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Returns the number of jobs in each status.
+        """
+        with self.lock:
+            return dict(self.connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+
+    def failures(self) -> List[tuple]:
+        """
+        Returns (file path, error) of the failed jobs.
+        """
+        with self.lock:
+            return self.connection.execute("SELECT file_path, error FROM jobs WHERE status = ?", (FAILED,)).fetchall()
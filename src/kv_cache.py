@@ -0,0 +1,79 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from src.config import settings
+
+
+class KVCache:
+    """
+    Persistent cache of JSON values by key, in an SQLite file shared by every namespace.
+
+    Used for results that are expensive to recompute and stable for a given input, such as the
+    model's description of an image, so that they carry over across documents and runs.
+    """
+
+    def __init__(self, namespace: str, path: str = None):
+        """
+        Args:
+            namespace (str): Keeps the keys of different kinds of values apart.
+            path (str, optional): Location of the SQLite database. Defaults to settings.KV_CACHE_PATH.
+        """
+        self.namespace = namespace
+        self.path = path or settings.KV_CACHE_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, updated_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        """)
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Returns the value stored under a key, or None.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM entries WHERE namespace = ? AND key = ?", (self.namespace, key)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key: str, value: Any) -> None:
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                (self.namespace, key, json.dumps(value), time.time()),
+            )
+            self.connection.commit()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM entries WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+
+
+_caches: Dict[str, KVCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_kv_cache(namespace: str) -> KVCache:
+    """
+    Returns the process-wide cache of a namespace.
+    """
+    with _caches_lock:
+        if namespace not in _caches:
+            _caches[namespace] = KVCache(namespace)
+        return _caches[namespace]
@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import fitz  # PyMUPDF
+
+from src.config import settings
+from src.file_lock import file_lock
+
+
+def document_name(file_path: str) -> str:
+    """
+    Returns the name a document is stored under, in the manifest and in the "file_name" metadata of
+    its vectors: its path relative to settings.DATA_STORAGE, or its absolute path if it lies
+    outside, with "/" separators. Files with the same base name in different folders stay apart.
+    """
+    path = os.path.abspath(file_path)
+    root = os.path.abspath(settings.DATA_STORAGE)
+    try:
+        if os.path.commonpath([path, root]) == root:
+            path = os.path.relpath(path, root)
+    except ValueError:
+        # On another Windows drive
+        pass
+    return path.replace(os.sep, "/")
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Returns the sha256 hex digest of a file's bytes.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def hash_pages(file_path: str) -> List[str]:
+    """
+    Returns one content hash per page of a PDF.
+
+    A page hash covers the page's content stream, geometry and the raw streams of the images it
+    draws, so it changes whenever what the page renders changes. Documents that are not PDFs are
+    treated as a single page hashed by their bytes.
+
+    Args:
+        file_path (str): Path to the document.
+
+    Returns:
+        List[str]: sha256 hex digests, page 1 first.
+    """
+    if not file_path.lower().endswith(".pdf"):
+        return [hash_file(file_path)]
+
+    with fitz.open(file_path) as doc:
+        return [hash_page(doc, page) for page in doc]
+
+
+def hash_page(doc: fitz.Document, page: fitz.Page) -> str:
+    """
+    Returns the content hash of one page of an open PDF, as described in hash_pages.
+    """
+    digest = hashlib.sha256(page.read_contents())
+    digest.update(f"{tuple(page.rect)}:{page.rotation}".encode("utf-8"))
+    for image in page.get_images(full=True):
+        digest.update(doc.xref_stream_raw(image[0]) or b"")
+    return digest.hexdigest()
+
+
+def default_manifest_path() -> str:
+    """
+    Returns the manifest location of the vector database selected by settings.VECTOR_DB, which lives next to its data.
+    """
+    if settings.VECTOR_DB.lower() == "local":
+        return os.path.join(settings.LOCAL_DB_PATH, "manifest.json")
+    return settings.MANIFEST_PATH
+
+
+class DocumentManifest:
+    """
+    Record of the documents ingested into each collection, stored as JSON next to the vector database.
+
+    For every (collection, file name) it keeps the file hash and one hash per page, which is enough
+    to tell whether a re-uploaded document can be skipped or which of its pages must be rebuilt.
+    """
+
+    def __init__(self, path: str = None):
+        """
+        Args:
+            path (str, optional): Location of the manifest file. Defaults to the selected vector database's manifest.
+        """
+        self.path = path or default_manifest_path()
+        self.lock = threading.Lock()
+        self.lock_path = self.path + ".lock"
+        self.entries: Dict[str, Dict[str, Dict]] = {}
+        self.loaded_stamp = None
+        self.refresh()
+
+    def _stamp(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load(self) -> None:
+        stamp = self._stamp()
+        if stamp is not None and stamp != self.loaded_stamp:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+            self.loaded_stamp = stamp
+
+    def refresh(self) -> None:
+        """
+        Reloads the manifest if the file was rewritten since it was last read, e.g. by another process.
+        """
+        with self.lock:
+            self._load()
+
+    def version(self, collection_name: str) -> str:
+        """
+        Returns an identifier of the set of documents ingested into a collection, which changes whenever
+        a document is added, re-ingested or modified.
+
+        Args:
+            collection_name (str): The collection.
+
+        Returns:
+            str: A short hash of the collection's file names, file hashes and page hashes.
+        """
+        self.refresh()
+        with self.lock:
+            # Page hashes change when pages that failed are ingested again, without the file changing
+            documents = sorted((name, entry["file_hash"], entry["page_hashes"])
+                               for name, entry in self.entries.get(collection_name, {}).items())
+        return hashlib.sha256(json.dumps(documents).encode("utf-8")).hexdigest()[:16]
+
+    def get(self, collection_name: str, file_name: str) -> Optional[Dict]:
+        """
+        Returns the manifest entry of a document, or None if it was never ingested into the collection.
+        """
+        with self.lock:
+            return self.entries.get(collection_name, {}).get(file_name)
+
+    def diff(self, collection_name: str, file_name: str, file_hash: str, page_hashes: List[str]) -> Optional[Tuple[Optional[List[int]], List[int]]]:
+        """
+        Compare a document against what was last ingested into a collection.
+
+        Args:
+            collection_name (str): The collection the document is ingested into.
+            file_name (str): Name of the document.
+            file_hash (str): Hash of the document's bytes.
+            page_hashes (List[str]): Hash of each page.
+
+        Returns:
+            Optional[Tuple[Optional[List[int]], List[int]]]: None when the document is unchanged and
+            none of its pages failed last time. Otherwise (pages to ingest, pages to remove), 1-based. Pages to ingest is None when the
+            whole document has to be ingested.
+        """
+        self.refresh()
+        entry = self.get(collection_name, file_name)
+        if entry is None:
+            return None, []
+        previous = entry["page_hashes"]
+        if entry["file_hash"] == file_hash and previous == page_hashes:
+            return None
+
+        # Pages that failed last time were recorded without a hash, so they always come back here
+        changed = [page for page, page_hash in enumerate(page_hashes, start=1)
+                   if page > len(previous) or previous[page - 1] != page_hash]
+        removed = list(range(len(page_hashes) + 1, len(previous) + 1))
+        return changed, removed
+
+    def update(self, collection_name: str, file_name: str, file_hash: str, page_hashes: List[str], failed_pages: List[int] = None) -> None:
+        """
+        Record that a document is now ingested into a collection and persist the manifest.
+
+        Args:
+            collection_name (str): The collection the document was ingested into.
+            file_name (str): Name of the document.
+            file_hash (str): Hash of the document's bytes.
+            page_hashes (List[str]): Hash of each page.
+            failed_pages (List[int], optional): 1-based pages that could not be ingested. They are recorded
+                without a hash, so that the next diff returns them. Default is None.
+        """
+        failed = set(failed_pages or ())
+        page_hashes = [None if page in failed else page_hash for page, page_hash in enumerate(page_hashes, start=1)]
+        # Other processes (the app, batch ingestion) update the same file: reload it, change one
+        # entry and write it back under the lock file, so that no entry is lost
+        with self.lock, file_lock(self.lock_path):
+            self._load()
+            self.entries.setdefault(collection_name, {})[file_name] = {
+                "file_hash": file_hash,
+                "page_hashes": page_hashes,
+                "updated_at": time.time(),
+            }
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.path)
+            self.loaded_stamp = self._stamp()
+
+
+_manifests: Dict[str, DocumentManifest] = {}
+_manifests_lock = threading.Lock()
+
+
+def get_manifest(path: str = None) -> DocumentManifest:
+    """
+    Returns the process-wide manifest of a location, so that concurrent ingestions update the same entries.
+    """
+    path = path or default_manifest_path()
+    with _manifests_lock:
+        if path not in _manifests:
+            _manifests[path] = DocumentManifest(path)
+        return _manifests[path]
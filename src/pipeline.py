@@ -0,0 +1,124 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+from src.executor import get_pipeline_pool
+
+
+class Stage(NamedTuple):
+    name: str
+    func: Callable
+    depends_on: Tuple[str, ...]
+
+
+class StageTiming(NamedTuple):
+    """
+    When a stage ran, in seconds from the start of the pipeline.
+    """
+    name: str
+    start: float
+    end: float
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+
+class Pipeline:
+    """
+    Dependency graph of ingestion stages.
+
+    Each stage is called with the results of the stages it depends on, in the order they are listed,
+    and starts as soon as they are all done, so independent stages run concurrently on the pipeline pool.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stages: Dict[str, Stage] = {}
+        self.timings: Dict[str, StageTiming] = {}
+        # Results of the last run, also of the stages that finished before a failure
+        self.results: Dict[str, Any] = {}
+
+    def add_stage(self, name: str, func: Callable, depends_on: Tuple[str, ...] = ()) -> None:
+        """
+        Args:
+            name (str): Unique name of the stage.
+            func (Callable): Called with the results of `depends_on`.
+            depends_on (Tuple[str, ...], optional): Stages that must finish first; they must be added before.
+        """
+        if name in self.stages:
+            raise ValueError(f"Stage '{name}' is already in pipeline '{self.name}'")
+        missing = [dependency for dependency in depends_on if dependency not in self.stages]
+        if missing:
+            raise ValueError(f"Stage '{name}' depends on unknown stages {missing}")
+        self.stages[name] = Stage(name, func, tuple(depends_on))
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Runs every stage once its dependencies are done.
+
+        When a stage raises, no further stage is started; the stages already running are waited for
+        and the error is raised.
+
+        Returns:
+            Dict[str, Any]: The result of every stage by name.
+        """
+        pool = get_pipeline_pool()
+        results = self.results = {}
+        remaining = dict(self.stages)
+        running = {}
+        error = None
+        self.timings = {}
+        pipeline_start = time.perf_counter()
+
+        def run_stage(stage: Stage) -> Any:
+            start = time.perf_counter() - pipeline_start
+            try:
+                return stage.func(*(results[dependency] for dependency in stage.depends_on))
+            finally:
+                self.timings[stage.name] = StageTiming(stage.name, start, time.perf_counter() - pipeline_start)
+
+        while remaining or running:
+            if error is None:
+                for stage in [stage for stage in remaining.values() if all(d in results for d in stage.depends_on)]:
+                    running[pool.submit(run_stage, stage)] = stage.name
+                    del remaining[stage.name]
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    error = error or e
+        if error is not None:
+            raise error
+        return results
+
+    def critical_path(self) -> List[StageTiming]:
+        """
+        Returns the chain of stages that set the wall-clock time of the last run: from the stage that
+        finished last, back through the dependency each stage waited for longest.
+        """
+        if not self.timings:
+            return []
+        path = [max(self.timings.values(), key=lambda timing: timing.end)]
+        while True:
+            dependencies = [self.timings[d] for d in self.stages[path[-1].name].depends_on if d in self.timings]
+            if not dependencies:
+                break
+            path.append(max(dependencies, key=lambda timing: timing.end))
+        return path[::-1]
+
+    def report(self) -> str:
+        """
+        Returns the timings of the last run, one line per stage, with the critical path marked by '*'.
+        """
+        critical = {timing.name for timing in self.critical_path()}
+        total = max((timing.end for timing in self.timings.values()), default=0.0)
+        lines = [f"Pipeline {self.name}: {total:.2f}s"]
+        for timing in sorted(self.timings.values(), key=lambda timing: timing.start):
+            marker = "*" if timing.name in critical else " "
+            lines.append(f" {marker} {timing.name:<20} {timing.start:8.2f}s -> {timing.end:8.2f}s  ({timing.duration:.2f}s)")
+        return "\n".join(lines)
@@ -29,6 +29,18 @@ class PredefinedPrompts:
 
     """
     
+    table_batch_summary_template = """For each of the given tables, generate a summary.
+    The summaries that are generated will be crucial in answering questions that are asked on the source text
+    Keep each summary precise and relevant, donot try to create summary outside of context.
+    Tables are given as CSV, each one after a line "Table <id>:".
+
+    Respond with a JSON object in the following format, with one entry per table:
+    {{"summaries": [{{"id": <table id>, "summary": "<summary of the table>"}}]}}
+
+    {tables}
+
+    """
+
     image_description_template = """For the given image, which is a part of a PDF, extract every visible text element on the image and provide a detailed text description. Ensure that every bit of information is included verbatim, without summarization. Separate the content into relevant sections, such as headers, dates, various factual details, terms, and specific instructions. 
 
     Output should be in the following format:
@@ -1,14 +1,18 @@
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_experimental.text_splitter import SemanticChunker
 from src.config import settings
-from langchain_openai import OpenAIEmbeddings
+from src.embeddings.cached_embeddings import get_embeddings
+from src.text_mode.local_chunker import LocalChunker
 
 
 class ChunkingStrategy:
-    def __init__(self, documents):
-        self.chunk_type = settings.CHUNK_TYPE
+    def __init__(self, documents, parsed_document=None, chunk_type=None, embeddings=None):
+        self.chunk_type = chunk_type or settings.CHUNK_TYPE
         self.documents = documents[0]
-        self.embeddings = OpenAIEmbeddings(openai_api_key = settings.OPENAI_API_KEY)
+        # Only the semantic chunker needs embeddings; they are built when it runs unless given here
+        self.embeddings = embeddings
+        # Layout of the PDF, used by the local chunker to find headings
+        self.parsed_document = parsed_document
         
     def split_texts(self):
         if self.chunk_type == "recursive":
@@ -19,10 +23,16 @@ class ChunkingStrategy:
             return texts
         
         elif self.chunk_type == "semantic":
-            texts = [doc.page_content for doc in self.documents if doc.page_content]
-            text_splitter = SemanticChunker(self.embeddings)
-            processed_texts = text_splitter.create_documents(texts)
+            documents = [doc for doc in self.documents if doc.page_content]
+            text_splitter = SemanticChunker(self.embeddings or get_embeddings())
+            # Chunks never span documents, so each one keeps its page metadata
+            processed_texts = text_splitter.create_documents(
+                [doc.page_content for doc in documents], [doc.metadata for doc in documents]
+            )
             return processed_texts
         
+        elif self.chunk_type == "local":
+            return LocalChunker(self.parsed_document).split_documents(self.documents)
+
         else:
             raise NotImplementedError("Chunking method not implemented")
@@ -0,0 +1,78 @@
+from typing import List, Set
+
+from langchain_core.documents import Document
+
+from src.config import settings
+from src.chunk_stats import content_hash
+from src.embeddings.cache import normalize_text
+from src.utils import count_tokens
+
+# Chunks sharing at least this fraction of their word 8-grams with already packed chunks are
+# duplicates: the same text retrieved twice, or the CHUNK_OVERLAP region of a neighbouring chunk.
+SHINGLE_SIZE = 8
+
+
+def relevance(document: Document, rank: int) -> float:
+    """
+    Returns a sort key of a retrieved document, lower is more relevant: its fused score when hybrid
+    retrieval ran, else its vector distance, else its retrieval rank.
+    """
+    metadata = document.metadata
+    if "rrf_score" in metadata:
+        return -metadata["rrf_score"]
+    if "score" in metadata:
+        return metadata["score"]
+    return rank
+
+
+def document_tokens(document: Document) -> int:
+    """
+    Returns the token count of a chunk, as stored in its metadata at ingestion, or counted now for older chunks.
+    """
+    token_count = document.metadata.get("token_count")
+    if token_count is None:
+        token_count = count_tokens(document.page_content, settings.CHAT_MODEL)
+    return token_count
+
+
+def shingles(text: str) -> Set[str]:
+    words = text.split()
+    if len(words) <= SHINGLE_SIZE:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def pack_context(documents: List[Document], budget: int) -> List[Document]:
+    """
+    Selects the retrieved chunks that go into the prompt: most relevant first, skipping exact and
+    overlapping duplicates, until the token budget is used.
+
+    Args:
+        documents (List[Document]): Retrieved chunks.
+        budget (int): Tokens available for the context.
+
+    Returns:
+        List[Document]: The packed chunks, most relevant first.
+    """
+    ranked = sorted(enumerate(documents), key=lambda item: relevance(item[1], item[0]))
+    packed = []
+    seen_hashes = set()
+    seen_shingles: Set[str] = set()
+    separator_tokens = 1
+    for _, document in ranked:
+        text = normalize_text(document.page_content).lower()
+        chunk_hash = document.metadata.get("content_hash") or content_hash(document.page_content)
+        if chunk_hash in seen_hashes or not text:
+            continue
+        document_shingles = shingles(text)
+        if len(document_shingles & seen_shingles) >= settings.CONTEXT_DEDUP_OVERLAP * len(document_shingles):
+            continue
+        tokens = document_tokens(document) + separator_tokens
+        # A chunk too large for what is left may be followed by smaller ones that fit
+        if tokens > budget:
+            continue
+        budget -= tokens
+        packed.append(document)
+        seen_hashes.add(chunk_hash)
+        seen_shingles |= document_shingles
+    return packed
@@ -2,9 +2,9 @@ import glob
 import os
 import warnings
 warnings.filterwarnings("ignore")
-from multiprocessing import Pool
 from typing import List
 from src.text_mode.chunking import ChunkingStrategy
+from src.executor import get_process_pool
 from langchain.docstore.document import Document
 from langchain_community.document_loaders import (
     CSVLoader,
@@ -81,7 +81,7 @@ def load_single_document(file_path: str) -> Document:
 def load_documents(
     source_directory: str, ignored_files: List[str] = []
 ) -> List[Document]:
-    if '.' in source_directory.split('\\')[-1]:
+    if os.path.isfile(source_directory):
         return [load_single_document(source_directory)]
     all_files = []
     for ext in LOADER_MAPPING:
@@ -92,13 +92,7 @@ def load_documents(
         file_path for file_path in all_files if file_path not in ignored_files
     ]
 
-    with Pool(processes=os.cpu_count()) as pool:
-        results = []
-        for i, doc in enumerate(
-            pool.imap_unordered(load_single_document, filtered_files)
-        ):
-            results.append(doc)
-    return results
+    return list(get_process_pool().map(load_single_document, filtered_files))
 
 
 def process_documents(
@@ -1,36 +1,121 @@
 # import comtypes.client
-import fitz  # PyMUPDF
 import io
+from typing import Any, Dict, List, NamedTuple, Optional
 from PIL import Image
-from src.utils import execute_parallel, describe_image, convert_pil_to_base64
-
-def extract_images_and_text_from_pdf(file_path):
-    pdf_path = file_path
-    doc = fitz.open(pdf_path)
-    images = []
-    text = ""
-    print("Opened PDF file:", pdf_path)
-
-    for page_index, page in enumerate(doc, start=1):
-        image_list = page.get_images(full=True)
-        print(f"Found {len(image_list)} images on page {page_index}.")
-
-        for img in image_list:
-            xref = img[0]
-            base_image = doc.extract_image(xref)
-            if base_image:
-                image_bytes = base_image["image"]
-                image = Image.open(io.BytesIO(image_bytes))
-                base64_image = convert_pil_to_base64(image)
-                images.append(base64_image)
-
-        text += page.get_text()
-
-    doc.close()
-    return images, text
-
-
-def process_images(file_path):
-    images, text = extract_images_and_text_from_pdf(file_path)
-    image_descriptions = execute_parallel(describe_image,images)
-    return image_descriptions
+from src.config import settings
+from src.utils import describe_image
+from src.image_preparation import prepare_image, settings_signature
+from src.document import ParsedDocument
+from src.kv_cache import get_kv_cache
+
+class EmbeddedImage(NamedTuple):
+    """
+    A unique image of a document, attributed to the first page it appears on.
+    """
+    page: int
+    xref: int
+    digest: str
+    dhash: int
+    description: Optional[Any]  # cached description, None if the image still has to be described
+
+def dhash(image: Image.Image) -> int:
+    """
+    Returns the 64-bit difference hash of an image: whether each pixel of a 9x8 grayscale
+    thumbnail is brighter than its right neighbour. Re-encoded or rescaled copies of an image get
+    hashes a few bits apart.
+    """
+    pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            value = (value << 1) | (pixels[row * 9 + column] > pixels[row * 9 + column + 1])
+    return value
+
+
+def description_key(image_key: str) -> str:
+    """
+    Returns the cache key of an image description, which depends on the model and on how images are prepared for it.
+    """
+    return f"{settings.CHAT_MODEL}:{settings_signature()}:{image_key}"
+
+
+def is_decorative(width: int, height: int) -> bool:
+    return min(width, height) < settings.EMBEDDED_IMAGE_MIN_DIM or width * height < settings.EMBEDDED_IMAGE_MIN_AREA
+
+
+def extract_unique_images(document: ParsedDocument, stored: Dict[str, int] = None) -> List[EmbeddedImage]:
+    """
+    Returns the images of a document that need to be stored, once each.
+
+    Images under the EMBEDDED_IMAGE_MIN_* sizes are dropped as decorative. The others are
+    deduplicated over the whole document, first by content digest (logos and letterheads repeated
+    on every page), then by dHash (the same picture re-encoded or rescaled).
+
+    `stored` lists the images of the document still in the vector database, after the vectors of
+    the pages being re-ingested were deleted. They are not returned again, and the other images are
+    deduplicated against them first, so an image stays stored once whichever pages change. An image
+    whose stored copy belonged to a deleted page is returned again, attributed to the first page
+    it now appears on, even if that page is not being re-ingested.
+
+    dHashes are cached by digest, so an image is decoded once, and descriptions are looked up by
+    digest and by dHash, so that images described in other documents are not described again.
+
+    Args:
+        document (ParsedDocument): The parsed document.
+        stored (Dict[str, int], optional): Digest -> page of the images of the document already stored.
+            Default is None, when nothing is.
+
+    Returns:
+        List[EmbeddedImage]: The images to store, in page order.
+    """
+    stored = stored or {}
+    first_occurrences = {}
+    for page in document.pages:
+        for image in page.images:
+            if image.digest not in first_occurrences and not is_decorative(image.width, image.height):
+                first_occurrences[image.digest] = (page.number, image)
+
+    hashes_cache = get_kv_cache("image_dhashes")
+    descriptions = get_kv_cache("image_descriptions")
+    unique = []
+    hashes = []
+    # Stored images come first: the images near-duplicating them are the ones left out
+    for digest in sorted(first_occurrences, key=lambda digest: digest not in stored):
+        number, image = first_occurrences[digest]
+        image_hash = hashes_cache.get(image.digest)
+        if image_hash is None:
+            base_image = document.extract_image(image.xref)
+            if not base_image:
+                continue
+            image_hash = dhash(Image.open(io.BytesIO(base_image["image"])))
+            hashes_cache.put(image.digest, image_hash)
+        if digest in stored:
+            hashes.append(image_hash)
+            continue
+        if any(bin(image_hash ^ other).count("1") <= settings.EMBEDDED_IMAGE_DHASH_DISTANCE for other in hashes):
+            continue
+        hashes.append(image_hash)
+        description = descriptions.get(description_key(image.digest))
+        if description is None:
+            description = descriptions.get(description_key(f"dhash:{image_hash:016x}"))
+        unique.append(EmbeddedImage(number, image.xref, image.digest, image_hash, description))
+
+    unique.sort(key=lambda image: image.page)
+    total = sum(len(page.images) for page in document.pages)
+    print(f"{len(unique)} images to store out of {total} in the document ({len(stored)} already stored), "
+          f"{sum(image.description is None for image in unique)} to describe")
+    return unique
+
+
+def describe_embedded_image(document: ParsedDocument, image: EmbeddedImage) -> Any:
+    """
+    Returns the description of a unique image, from the cache or from the vision model, caching it
+    by content digest and dHash for the next documents.
+    """
+    if image.description is not None:
+        return image.description
+    description = describe_image(prepare_image(document.extract_image(image.xref)["image"]))
+    cache = get_kv_cache("image_descriptions")
+    cache.put(description_key(image.digest), description)
+    cache.put(description_key(f"dhash:{image.dhash:016x}"), description)
+    return description
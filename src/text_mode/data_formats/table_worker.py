@@ -0,0 +1,82 @@
+from typing import Any, Dict, List, Tuple
+
+import fitz  # PyMUPDF
+import pdfplumber
+import tabula
+
+from src.config import settings
+from src.document import ParsedDocument
+
+
+def extract_page_tables(file_path: str, pages: List[int]) -> List[Tuple[int, List[Any]]]:
+    """
+    Extracts the tables of some pages with tabula. Runs in a table worker process, whose JVM is
+    reused by every call.
+
+    A page tabula fails on falls back to pdfplumber, without affecting the other pages.
+
+    Returns:
+        List[Tuple[int, List[Any]]]: (page number, tables) of each page.
+    """
+    results = []
+    plumber = None
+    try:
+        for page in pages:
+            try:
+                tables = tabula.read_pdf(file_path, pages=page)
+            except Exception as e:
+                print(f"tabula failed on page {page} of {file_path} ({type(e).__name__}), using pdfplumber")
+                if plumber is None:
+                    plumber = pdfplumber.open(file_path)
+                tables = plumber.pages[page - 1].extract_tables()
+            results.append((page, tables))
+    finally:
+        if plumber is not None:
+            plumber.close()
+    return results
+
+
+def table_pages(pages: List[int], document: ParsedDocument = None) -> List[int]:
+    """
+    Returns the pages worth sending to tabula: with settings.TABLE_PRECHECK, only those where
+    parsing found ruling lines or column-aligned text.
+    """
+    if not settings.TABLE_PRECHECK or document is None or not document.is_pdf:
+        return pages
+    return [page.number for page in document.select(pages) if page.table_candidates]
+
+
+def extract_tables(file_path: str, pages: List[int] = None, document: ParsedDocument = None) -> List[Dict[str, Any]]:
+    """
+    Extracts the tables of a PDF across the table worker pool, settings.TABLE_PAGES_PER_TASK pages per task.
+
+    Args:
+        file_path (str): Path to the PDF file.
+        pages (List[int], optional): 1-based pages to extract. Default is None, which extracts every page.
+        document (ParsedDocument, optional): The document already parsed, used to skip pages without tables. Default is None.
+
+    Returns:
+        List[Dict[str, Any]]: {"page": <page number>, "table": <table>} dictionaries, in page order.
+    """
+    # Imported here so that table workers, which import this module, stay light to spawn
+    from src.executor import get_table_pool
+
+    if pages is None:
+        if document is not None:
+            pages = list(range(1, document.page_count + 1))
+        else:
+            with fitz.open(file_path) as doc:
+                pages = list(range(1, doc.page_count + 1))
+    candidates = table_pages(sorted(pages), document)
+    if len(candidates) < len(pages):
+        print(f"Skipping {len(pages) - len(candidates)} pages without table candidates in {file_path}")
+
+    step = settings.TABLE_PAGES_PER_TASK
+    pool = get_table_pool()
+    futures = [pool.submit(extract_page_tables, file_path, candidates[i:i + step]) for i in range(0, len(candidates), step)]
+    return [
+        {"page": page, "table": table}
+        for future in futures
+        for page, tables in future.result()
+        for table in tables
+    ]
@@ -2,16 +2,23 @@ from abc import ABC, abstractmethod
 from typing import Any, Dict, List, Tuple
 from langchain_core.documents import Document
 from src.vectordbs.base import VectorDatabaseInterface
-from src.vectordbs.chromadb import ChromaDB  
-import tabula
-import pdfplumber
+from src.vectordbs.registry import get_vector_db
 import os
-from src.utils import execute_parallel, describe_image, get_summary
+from src.utils import get_summary
+from src.executor import get_process_pool, run_parallel
+from src.document import ParsedDocument
+from src.manifest import document_name
+from src.chunk_stats import with_chunk_stats
 from src.text_mode.data_formats.doc_loader import load_single_document
 from src.text_mode.chunking import ChunkingStrategy
-from src.text_mode.data_formats.image_data_extractor import extract_images_and_text_from_pdf
+from src.text_mode.data_formats.image_data_extractor import extract_unique_images, describe_embedded_image
+from src.text_mode.data_formats.table_worker import extract_tables
+from src.text_mode.table_summarizer import serialize_table, summarize_tables
 
 class DataIngestorBase(ABC):
+    # Recorded as the "source_type" metadata of the stored chunks
+    source_type = "text"
+
     def __init__(self, db_client: VectorDatabaseInterface):
         """
         Initialize the base data ingestor class with a specified database client.
@@ -20,9 +27,7 @@ class DataIngestorBase(ABC):
             db_client (VectorDatabaseInterface): The vector database client to use for data storage.
         """
         if db_client is None:
-            self.database = ChromaDB(
-                collection_name="temp" 
-            )
+            self.database = get_vector_db("temp")
         else:
             self.database = db_client
 
@@ -71,6 +76,32 @@ class DataIngestorBase(ABC):
         """
         self.database.store_vector(data, metadata)
 
+    def store_vectors(self, records: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> None:
+        """
+        Store many (data, metadata) records in the database with batched writes.
+
+        Args:
+            records (List[Tuple[Dict[str, Any], Dict[str, Any]]]): Records as returned by prepare_data.
+        """
+        if len(records) > 0:
+            # Stats are computed once here so that queries pack, dedup and filter on stored numbers
+            texts = [data["content"] for data, _ in records]
+            metadata_list = with_chunk_stats(texts, [metadata for _, metadata in records], self.source_type)
+            self.database.store_vectors([data for data, _ in records], metadata_list)
+
+    def prepare_data(self, data: Any, file_name: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Turn one extracted item into a (data, metadata) record ready to be stored.
+
+        Args:
+            data (Any): Data extracted from the file.
+            file_name (str): Name of the file being ingested.
+
+        Returns:
+            Tuple[Dict[str, Any], Dict[str, Any]]: Data dictionary and metadata.
+        """
+        return self.transform_data(data, file_name)
+
     @abstractmethod
     def ingest_data(self, data: Any, file_name: str) -> None:
         """
@@ -83,15 +114,28 @@ class DataIngestorBase(ABC):
         pass
 
     @abstractmethod
-    def main(self, file_path: str) -> None:
+    def main(self, file_path: str, pages: List[int] = None) -> List[int]:
         """
         Abstract method to execute the ingestion pipeline.
 
         Args:
             file_path (str): Path to the file to be ingested.
+            pages (List[int], optional): 1-based pages to ingest. Default is None, which ingests every page.
+
+        Returns:
+            List[int]: 1-based pages with items that could not be ingested.
         """
         pass
 
+def page_number(metadata: Dict[str, Any]) -> int:
+    """
+    Returns the 1-based page number recorded by a document loader, or 1 for documents without pages.
+    """
+    if 'page' in metadata:
+        # PyPDFLoader numbers pages from 0
+        return int(metadata['page']) + 1
+    return int(metadata.get('page_number', 1))
+
 class TextDataIngestor(DataIngestorBase):
     def __init__(self, db_client, initial_data: str = None  ):
         """
@@ -104,19 +148,30 @@ class TextDataIngestor(DataIngestorBase):
         """
         super().__init__(db_client)
 
-    def data_extractor(self, file_path: str) -> List[Document]:
+    def data_extractor(self, file_path: str, pages: List[int] = None, document: ParsedDocument = None) -> List[Document]:
         """
         Extract text data from a document file.
 
         Args:
             file_path (str): Path to the document file.
+            pages (List[int], optional): 1-based pages to extract. Default is None, which extracts every page.
+            document (ParsedDocument, optional): The document already parsed. Default is None, which parses it.
 
         Returns:
             List[Document]: List of extracted document texts.
         """
         super().data_extractor(file_path)
-        docs = [load_single_document(file_path)]
-        texts = ChunkingStrategy(docs).split_texts()
+        if document is None:
+            document = ParsedDocument.load(file_path)
+        if document.is_pdf:
+            documents = document.documents(pages)
+        else:
+            # Parsing is CPU-bound: run it in a worker process so concurrent ingestions do not hold the GIL
+            documents = get_process_pool().submit(load_single_document, file_path).result()
+            if pages is not None:
+                documents = [doc for doc in documents if page_number(doc.metadata) in pages]
+        docs = [documents]
+        texts = ChunkingStrategy(docs, document).split_texts()
         return texts
 
     def transform_data(self, data: Dict[str, Any], file_name: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
@@ -134,7 +189,7 @@ class TextDataIngestor(DataIngestorBase):
             'content': str(data['page_content']),
             'transformed_content': data['page_content']
         }
-        metadata = {'file_name': file_name}
+        metadata = {'file_name': file_name, 'page': page_number(data.get('metadata', {}))}
         return data_dict, metadata
 
     def ingest_data(self, data: Any, file_name: str) -> None:
@@ -149,22 +204,30 @@ class TextDataIngestor(DataIngestorBase):
         data, metadata = self.transform_data(data, file_name)
         self.store_vector(data, metadata)
 
-    def main(self, file_path: str) -> None:
+    def main(self, file_path: str, pages: List[int] = None, document: ParsedDocument = None) -> List[int]:
         """
         Execute the ingestion pipeline for text data.
 
         Args:
             file_path (str): Path to the document file.
+            pages (List[int], optional): 1-based pages to ingest. Default is None, which ingests every page.
+            document (ParsedDocument, optional): The document already parsed. Default is None, which parses it.
+
+        Returns:
+            List[int]: Always empty: text is stored as a whole, and a failure raises.
         """
-        docs = self.data_extractor(file_path)
-        file_name = os.path.basename(file_path)
+        docs = self.data_extractor(file_path, pages, document)
+        file_name = document_name(file_path)
         
         data = [doc.dict() for doc in docs]
-        
-        if len(docs) > 0:
-            execute_parallel(self.ingest_data, data, file_name)
+
+        records = [self.prepare_data(item, file_name) for item in data]
+        self.store_vectors(records)
+        return []
 
 class TableDataIngestor(DataIngestorBase):
+    source_type = "table"
+
 
     def __init__(self, db_client: Any = None, initial_data: str = None):
         """
@@ -177,57 +240,43 @@ class TableDataIngestor(DataIngestorBase):
         """
         super().__init__(db_client )
 
-    def convert_keys_to_strings(self,dictionary):
-        """
-        Recursively converts all numeric keys to strings in a dictionary.
-        """
-        if isinstance(dictionary, dict):
-            return {str(key): self.convert_keys_to_strings(value) for key, value in dictionary.items()}
-        elif isinstance(dictionary, list):
-            return [self.convert_keys_to_strings(item) for item in dictionary if item != "" and item is not None]
-        else:
-            return dictionary
-        
-    def data_extractor(self, file_path: str) -> Any:
+    def data_extractor(self, file_path: str, pages: List[int] = None, document: ParsedDocument = None) -> Any:
         """
         Extract table data from a PDF file using Tabula.
 
         Args:
             file_path (str): Path to the PDF file.
+            pages (List[int], optional): 1-based pages to extract. Default is None, which extracts every page.
+            document (ParsedDocument, optional): The document already parsed, used to skip pages without tables. Default is None.
 
         Returns:
-            Any: Extracted table data.
+            Any: Extracted tables, as {"page": <page number>, "table": <table>} dictionaries.
         """
         super().data_extractor(file_path)
-        try:
-            df_tables = tabula.read_pdf(file_path, pages="all")
-        except:
-            df_tables = []
-            with pdfplumber.open(file_path) as pdf:
-                for page in pdf.pages:
-                    # Extract tables from the current page
-                    tables = page.extract_tables()
-                    df_tables.extend(tables)
+        df_tables = extract_tables(file_path, pages, document)
         print(f"{len(df_tables)} tables were extracted from {file_path}")
         return df_tables
 
-    def transform_data(self, data: Any, file_name: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    def transform_data(self, data: Any, file_name: str, summary: str = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
         """
         Transform table data into the required format for ingestion.
 
         Args:
             data (Any): Extracted table data.
             file_name (str): Name of the file being ingested.
+            summary (str, optional): The table's summary. Default is None, which summarizes it.
 
         Returns:
             Tuple[Dict[str, Any], Dict[str, Any]]: Data dictionary and metadata.
         """
-        response = super().summariser(data)
+        table = data["table"]
+        if summary is None:
+            summary = summarize_tables([table])[0]
         data_dict = {
-            'content': str(self.convert_keys_to_strings(data)),
-            'transformed_content': response
+            'content': serialize_table(table),
+            'transformed_content': summary
         }
-        metadata = {'file_name': file_name}
+        metadata = {'file_name': file_name, 'page': data["page"]}
         return data_dict, metadata
 
     def ingest_data(self, data: Any, file_name: str) -> None:
@@ -242,20 +291,35 @@ class TableDataIngestor(DataIngestorBase):
         data, metadata = self.transform_data(data, file_name)
         self.store_vector(data, metadata)
 
-    def main(self, file_path: str) -> None:
+    def main(self, file_path: str, pages: List[int] = None, document: ParsedDocument = None) -> List[int]:
         """
         Execute the ingestion pipeline for table data.
 
         Args:
             file_path (str): Path to the PDF file.
+            pages (List[int], optional): 1-based pages to ingest. Default is None, which ingests every page.
+            document (ParsedDocument, optional): The document already parsed. Default is None.
+
+        Returns:
+            List[int]: Always empty: a table is stored by its serialized content, whether or not its
+            summary succeeded, and a storage failure raises.
         """
-        data = self.data_extractor(file_path)
-        file_name = os.path.basename(file_path)
+        data = self.data_extractor(file_path, pages, document)
+        file_name = document_name(file_path)
         if len(data) > 0:
-            execute_parallel(self.ingest_data, data, file_name)
+            summaries = summarize_tables([item["table"] for item in data])
+            # summarize_tables answers "" for the tables it failed on; empty tables have nothing to summarize
+            unsummarized = sorted({item["page"] for item, summary in zip(data, summaries) if not summary and serialize_table(item["table"])})
+            if unsummarized:
+                print(f"Tables of pages {unsummarized} of {file_name} could not be summarized, storing them without a summary")
+            records = [self.transform_data(item, file_name, summary) for item, summary in zip(data, summaries)]
+            self.store_vectors(records)
+        return []
 
 
 class ImageDataIngestor(DataIngestorBase):
+    source_type = "image"
+
 
     def __init__(self, db_client: Any = None, initial_data: str = None  ):
         """
@@ -268,27 +332,40 @@ class ImageDataIngestor(DataIngestorBase):
         """
         super().__init__(db_client)
 
-    def data_extractor(self, file_path: str) -> Any:
+    def data_extractor(self, file_path: str, pages: List[int] = None, document: ParsedDocument = None) -> Any:
         """
         Extract image data from a PDF file.
 
+        Images are checked against those of the document still stored, rather than against `pages`:
+        an image shared with other pages may have to be stored again when the page that held it
+        changed, and must not be stored twice when it is added to a changed page.
+
         Args:
             file_path (str): Path to the PDF file.
+            pages (List[int], optional): 1-based pages being ingested, whose vectors are already deleted. Default is None.
+            document (ParsedDocument, optional): The document already parsed. Default is None, which parses it.
 
         Returns:
-            Any: Extracted image data.
+            Any: The unique images to store, as (document, EmbeddedImage) tuples.
         """
         super().data_extractor(file_path)
-        image_data, _ = extract_images_and_text_from_pdf(file_path)
-        return image_data
+        if document is None:
+            document = ParsedDocument.load(file_path)
+        stored = {}
+        if pages is not None:
+            where = {"file_name": document_name(file_path), "source_type": self.source_type}
+            stored = {metadata["image_digest"]: metadata["page"] for metadata in self.database.get_metadata(where) if "image_digest" in metadata}
+        return [(document, image) for image in extract_unique_images(document, stored)]
 
-    def transform_data(self, data: Any, file_name: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    def transform_data(self, data: Any, file_name: str, page: int = 1, digest: str = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
         """
         Transform image data into the required format for ingestion.
 
         Args:
             data (Any): Extracted image data.
             file_name (str): Name of the file being ingested.
+            page (int, optional): 1-based page the image was found on. Default is 1.
+            digest (str, optional): Content digest of the image, recorded to find it when pages are re-ingested. Default is None.
 
         Returns:
             Tuple[Dict[str, Any], Dict[str, Any]]: Data dictionary and metadata.
@@ -304,7 +381,9 @@ class ImageDataIngestor(DataIngestorBase):
                 'transformed_content': str(data)
             }
 
-        metadata = {'file_name': file_name}
+        metadata = {'file_name': file_name, 'page': page}
+        if digest is not None:
+            metadata['image_digest'] = digest
         return data_dict, metadata
 
     def ingest_data(self, image_data: Any, file_name: str) -> None:
@@ -316,19 +395,48 @@ class ImageDataIngestor(DataIngestorBase):
             file_name (str): Name of the file being ingested.
         """
         print("Ingesting image data")
-        image_descriptions = describe_image(image_data)
-        data, metadata = self.transform_data(image_descriptions, file_name)
+        data, metadata = self.prepare_data(image_data, file_name)
         self.store_vector(data, metadata)
 
-    def main(self, file_path: str) -> None:
+    def prepare_data(self, image_data: Any, file_name: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        Describe an image and transform the description into a record ready to be stored.
+
+        Args:
+            image_data (Any): (document, EmbeddedImage) tuple to describe.
+            file_name (str): Name of the file being ingested.
+
+        Returns:
+            Tuple[Dict[str, Any], Dict[str, Any]]: Data dictionary and metadata.
+        """
+        document, image = image_data
+        image_descriptions = describe_embedded_image(document, image)
+        return self.transform_data(image_descriptions, file_name, image.page, image.digest)
+
+    def main(self, file_path: str, pages: List[int] = None, document: ParsedDocument = None) -> List[int]:
         """
         Execute the ingestion pipeline for image data.
 
         Args:
             file_path (str): Path to the PDF file.
+            pages (List[int], optional): 1-based pages to ingest. Default is None, which ingests every page.
+            document (ParsedDocument, optional): The document already parsed. Default is None, which parses it.
+
+        Returns:
+            List[int]: 1-based pages of the images that could not be described, and were not stored.
         """
         print("Extracting image data")
-        image_data = self.data_extractor(file_path)
-        file_name = os.path.basename(file_path)
-        if len(image_data) > 0:
-            execute_parallel(self.ingest_data, image_data, file_name)
+        owned = document is None
+        if owned:
+            document = ParsedDocument.load(file_path)
+        try:
+            image_data = self.data_extractor(file_path, pages, document)
+            file_name = document_name(file_path)
+            failures = []
+            if len(image_data) > 0:
+                records, failures = run_parallel(self.prepare_data, image_data, file_name)
+                self.store_vectors(records)
+            return sorted({failure.item[1].page for failure in failures})
+        finally:
+            if owned:
+                document.close()
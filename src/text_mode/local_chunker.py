@@ -0,0 +1,240 @@
+import re
+import zlib
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+from src.config import settings
+from src.document import ParsedDocument
+
+# Hashed bag-of-words features: enough buckets that unrelated words rarely collide
+FEATURE_DIM = 1024
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with "
+    "shall may not any all such which be been being".split()
+)
+# Clause numbers ("12.", "12.3 Title", "(a)", "B)") and legal section markers at the start of a line
+CLAUSE_PATTERN = re.compile(
+    r"^\s*(?:(?P<number>\d+(?:\.\d+)*)(?:[.)]\s|\s(?=[A-Z]))|\([a-z0-9]{1,4}\)\s|[A-Z][.)]\s"
+    r"|(?i:article|section|clause|schedule|annex|appendix)\s+\w+)"
+)
+SENTENCE_END = re.compile(r"(?<=[.!?;])\s+")
+HEADING_MAX_WORDS = 12
+
+
+class Unit(NamedTuple):
+    """
+    The smallest piece of text a chunk boundary can fall around: a layout block, a paragraph or a clause.
+    """
+    text: str
+    heading: bool
+    clause_depth: int  # 1 for "12." clauses, 2 for "12.3", ...; 0 when the unit does not start a clause
+
+
+def clause_depth(text: str) -> int:
+    match = CLAUSE_PATTERN.match(text)
+    if match is None:
+        return 0
+    number = match.group("number")
+    return number.count(".") + 1 if number else 1
+
+
+def looks_like_heading(text: str) -> bool:
+    """
+    Text-only heading test, for pages without layout: a short line in title or upper case without final punctuation.
+    """
+    line = text.strip()
+    if "\n" in line or not line or len(line.split()) > HEADING_MAX_WORDS or line[-1] in ".,;:":
+        return False
+    return line.isupper() or line.istitle()
+
+
+def split_clauses(text: str) -> List[str]:
+    """
+    Splits a block before every line that starts a numbered clause.
+    """
+    parts = []
+    for line in text.split("\n"):
+        if parts and CLAUSE_PATTERN.match(line):
+            parts.append(line)
+        elif parts:
+            parts[-1] += "\n" + line
+        else:
+            parts.append(line)
+    return [part for part in parts if part.strip()]
+
+
+def split_long(text: str, max_size: int) -> List[str]:
+    """
+    Splits a unit longer than max_size characters at sentence ends, or anywhere as a last resort.
+    """
+    pieces = [""]
+    for sentence in SENTENCE_END.split(text):
+        while len(sentence) > max_size:
+            pieces.extend([sentence[:max_size], ""])
+            sentence = sentence[max_size:]
+        if pieces[-1] and len(pieces[-1]) + len(sentence) + 1 > max_size:
+            pieces.append(sentence)
+        else:
+            pieces[-1] = f"{pieces[-1]} {sentence}".strip()
+    return [piece for piece in pieces if piece]
+
+
+def features(units: List[Unit]) -> np.ndarray:
+    """
+    Returns the L2-normalized hashed bag-of-words vectors of units, with log-scaled term frequencies.
+    """
+    matrix = np.zeros((len(units), FEATURE_DIM), dtype=np.float32)
+    for row, unit in enumerate(units):
+        buckets = [zlib.crc32(word.encode("utf-8")) % FEATURE_DIM
+                   for word in WORD_PATTERN.findall(unit.text.lower()) if word not in STOPWORDS]
+        np.add.at(matrix[row], buckets, 1.0)
+    matrix = np.log1p(matrix)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def gap_dissimilarity(vectors: np.ndarray, window: int) -> np.ndarray:
+    """
+    Returns, for each gap between consecutive units, 1 - the cosine similarity of the `window`
+    units before it and the `window` units after it. All gaps are computed at once from cumulative sums.
+    """
+    count = len(vectors)
+    if count < 2:
+        return np.zeros(0, dtype=np.float32)
+    cumulative = np.vstack([np.zeros((1, vectors.shape[1]), dtype=np.float32), np.cumsum(vectors, axis=0)])
+    gaps = np.arange(1, count)
+    left = cumulative[gaps] - cumulative[np.maximum(gaps - window, 0)]
+    right = cumulative[np.minimum(gaps + window, count)] - cumulative[gaps]
+    norms = np.linalg.norm(left, axis=1) * np.linalg.norm(right, axis=1)
+    similarity = np.einsum("ij,ij->i", left, right) / np.where(norms == 0, 1, norms)
+    return 1.0 - similarity
+
+
+class LocalChunker:
+    """
+    Chunker that places boundaries without any model call.
+
+    Boundaries come from the structure of the page, headings (larger or bold text, or short title
+    case lines) and numbered clauses, and from topic shifts, found where the words of the units
+    before and after a gap differ most. Chunks never span pages and stay under settings.CHUNK_SIZE
+    characters.
+    """
+
+    def __init__(self, document: Optional[ParsedDocument] = None):
+        """
+        Args:
+            document (ParsedDocument, optional): The parsed PDF, whose layout blocks and font sizes
+                locate headings. Default is None, which finds units and headings from the text alone.
+        """
+        self.document = document if document is not None and document.is_pdf else None
+        self.max_size = settings.CHUNK_SIZE
+        self.min_size = settings.LOCAL_CHUNK_MIN_SIZE
+        self.body_font_size = self._body_font_size()
+
+    def _body_font_size(self) -> float:
+        """
+        Returns the font size of most of the document's text, which headings are compared to.
+        """
+        if self.document is None:
+            return 0.0
+        blocks = [block for page in self.document.pages for block in page.blocks]
+        if not blocks:
+            return 0.0
+        sizes = np.array([block.font_size for block in blocks])
+        weights = np.array([len(block.text) for block in blocks], dtype=np.float64)
+        order = np.argsort(sizes)
+        cumulative = np.cumsum(weights[order])
+        return float(sizes[order][np.searchsorted(cumulative, cumulative[-1] / 2)])
+
+    def units(self, document: Document) -> List[Unit]:
+        """
+        Cuts a page into units: its layout blocks when the PDF was parsed, its paragraphs otherwise,
+        split before numbered clauses and at sentence ends when too long.
+        """
+        blocks = None
+        if self.document is not None and "page" in document.metadata:
+            index = int(document.metadata["page"])
+            if 0 <= index < len(self.document.pages):
+                blocks = self.document.pages[index].blocks
+
+        units = []
+        if blocks:
+            for block in blocks:
+                words = len(block.text.split())
+                heading = words <= HEADING_MAX_WORDS and (
+                    block.font_size >= self.body_font_size * settings.LOCAL_CHUNK_HEADING_RATIO
+                    or block.bold and block.text.strip()[-1:] not in ".,;:"
+                )
+                texts = [block.text] if heading else split_clauses(block.text)
+                units.extend(Unit(text, heading, clause_depth(text)) for text in texts)
+        else:
+            for paragraph in re.split(r"\n\s*\n", document.page_content):
+                units.extend(Unit(text, looks_like_heading(text), clause_depth(text)) for text in split_clauses(paragraph))
+
+        sized = []
+        for unit in units:
+            if len(unit.text) <= self.max_size:
+                sized.append(unit)
+            else:
+                pieces = split_long(unit.text, self.max_size)
+                sized.append(Unit(pieces[0], unit.heading, unit.clause_depth))
+                sized.extend(Unit(piece, False, 0) for piece in pieces[1:])
+        return [unit for unit in sized if unit.text.strip()]
+
+    def boundaries(self, units: List[Unit]) -> List[int]:
+        """
+        Returns the indexes of the units that start a chunk.
+
+        A heading always starts a chunk (unless it follows another heading). Otherwise a chunk is cut
+        where the boundary score, the topic shift plus a bonus for clause starts, passes
+        settings.LOCAL_CHUNK_SPLIT_THRESHOLD, or, when the next unit would overflow the chunk, at the
+        best scoring gap that leaves the chunk at least settings.LOCAL_CHUNK_MIN_SIZE long.
+        """
+        if not units:
+            return []
+        shift = gap_dissimilarity(features(units), settings.LOCAL_CHUNK_WINDOW)
+        bonus = settings.LOCAL_CHUNK_CLAUSE_BONUS
+        # score[i]: how good a boundary right before unit i is
+        score = np.zeros(len(units), dtype=np.float32)
+        score[1:] = shift
+        score += np.array([bonus if unit.clause_depth == 1 else bonus / 2 if unit.clause_depth > 1 else 0.0 for unit in units])
+        lengths = [len(unit.text) + 1 for unit in units]
+
+        starts = [0]
+        size = lengths[0]
+        for i in range(1, len(units)):
+            if units[i].heading and not all(unit.heading for unit in units[starts[-1]:i]):
+                starts.append(i)
+                size = lengths[i]
+                continue
+            if size >= self.min_size and score[i] >= settings.LOCAL_CHUNK_SPLIT_THRESHOLD:
+                starts.append(i)
+                size = lengths[i]
+                continue
+            size += lengths[i]
+            while size > self.max_size and starts[-1] < i:
+                # Cut the overflowing chunk at its best gap, preferring ones that leave it min_size long
+                start = starts[-1]
+                candidates = list(range(start + 1, i + 1))
+                prefix = np.cumsum(lengths[start:i + 1])
+                long_enough = [g for g in candidates if prefix[g - start - 1] >= self.min_size] or candidates
+                cut = max(long_enough, key=lambda g: score[g])
+                starts.append(cut)
+                size = int(sum(lengths[cut:i + 1]))
+        return starts
+
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        """
+        Chunks pages; each chunk keeps the metadata of its page.
+        """
+        chunks = []
+        for document in documents:
+            units = self.units(document)
+            starts = self.boundaries(units)
+            for start, end in zip(starts, starts[1:] + [len(units)]):
+                text = "\n".join(unit.text for unit in units[start:end])
+                chunks.append(Document(page_content=text, metadata=dict(document.metadata)))
+        return chunks
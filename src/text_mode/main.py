@@ -1,25 +1,28 @@
 from typing import List
 from src.text_mode.ingestor import TextDataIngestor, TableDataIngestor ,ImageDataIngestor
 from src.config import settings
+from src.document import ParsedDocument
 from src.vectordbs.base import VectorDatabaseInterface
 
-def load_embeddings(vector_db_client: VectorDatabaseInterface, file_path : str) -> str:
+def load_embeddings(vector_db_client: VectorDatabaseInterface, file_path : str, pages: List[int] = None) -> str:
     """
     Main function to load embeddings into the vector database using OpenAI embeddings.
 
     Args:
         data_directory (str): Path to the directory containing BidX folders.
         vector_database (str): The name of the vector database (e.g., "chromadb").
+        pages (List[int], optional): 1-based pages to ingest. Default is None, which ingests every page.
 
     Returns:
         str: A message indicating success or failure.
     """
-    # Ingest data into ChromaDB based on file format
-    if file_path.endswith(('.pdf', '.docx', '.html')):
-        TextDataIngestor(db_client=vector_db_client).main(file_path)
-    if file_path.endswith(('.pdf', '.docx')):
-        TableDataIngestor(db_client=vector_db_client).main(file_path)
-        ImageDataIngestor(db_client=vector_db_client).main(file_path)
+    # Ingest data into ChromaDB based on file format, every ingestor reading the same parse
+    with ParsedDocument.load(file_path) as document:
+        if file_path.endswith(('.pdf', '.docx', '.html')):
+            TextDataIngestor(db_client=vector_db_client).main(file_path, pages, document)
+        if file_path.endswith(('.pdf', '.docx')):
+            TableDataIngestor(db_client=vector_db_client).main(file_path, pages, document)
+            ImageDataIngestor(db_client=vector_db_client).main(file_path, pages, document)
             
     return "Success: All data ingested successfully in text format."
 
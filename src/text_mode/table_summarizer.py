@@ -0,0 +1,128 @@
+import csv
+import hashlib
+import io
+import json
+from typing import Any, Dict, List
+
+import pandas as pd
+
+from src.config import settings
+from src.kv_cache import get_kv_cache
+from src.prompts import PredefinedPrompts
+from src.utils import ask_gpt, count_tokens, execute_parallel, get_summary
+
+
+def serialize_table(table: Any) -> str:
+    """
+    Serializes a table as CSV, the most compact form a model reads reliably: a header line, then
+    one line per row, without index, empty rows or empty columns.
+
+    Args:
+        table (Any): A DataFrame (tabula) or a list of rows (pdfplumber).
+
+    Returns:
+        str: The table as CSV.
+    """
+    if isinstance(table, pd.DataFrame):
+        frame = table.dropna(how="all").dropna(axis=1, how="all")
+        return frame.to_csv(index=False).strip()
+    rows = [["" if cell is None else str(cell) for cell in row] for row in table]
+    rows = [row for row in rows if any(cell.strip() for cell in row)]
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue().strip()
+
+
+def summary_key(text: str) -> str:
+    """
+    Returns the cache key of a table summary: the serialized table, the model and the prompt.
+    """
+    prompt = PredefinedPrompts.table_batch_summary_template
+    return hashlib.sha256(f"{settings.CHAT_MODEL}\0{prompt}\0{text}".encode("utf-8")).hexdigest()
+
+
+def pack_batches(tokens: List[int]) -> List[List[int]]:
+    """
+    Groups tables, by index, into prompts of at most settings.TABLE_SUMMARY_BATCH_TOKENS tokens and
+    settings.TABLE_SUMMARY_BATCH_SIZE tables. Tables are taken largest first, each into the first
+    batch it fits in; a table over the budget gets a batch of its own.
+    """
+    batches: List[List[int]] = []
+    used: List[int] = []
+    for index in sorted(range(len(tokens)), key=lambda i: -tokens[i]):
+        for position, batch in enumerate(batches):
+            if len(batch) < settings.TABLE_SUMMARY_BATCH_SIZE and used[position] + tokens[index] <= settings.TABLE_SUMMARY_BATCH_TOKENS:
+                batch.append(index)
+                used[position] += tokens[index]
+                break
+        else:
+            batches.append([index])
+            used.append(tokens[index])
+    return batches
+
+
+def summarize_batch(batch: Dict[int, str]) -> Dict[int, str]:
+    """
+    Summarizes several serialized tables, by id, in one JSON-mode call.
+
+    Returns:
+        Dict[int, str]: The summaries returned, by table id; tables the model skipped are missing.
+    """
+    tables = "\n\n".join(f"Table {table_id}:\n{text}" for table_id, text in batch.items())
+    response = ask_gpt(
+        PredefinedPrompts.table_batch_summary_template.format(tables=tables),
+        response_format={"type": "json_object"},
+    )
+    try:
+        entries = json.loads(response["response"])["summaries"]
+        return {int(entry["id"]): str(entry["summary"]) for entry in entries if int(entry["id"]) in batch}
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Could not parse the summaries of tables {list(batch)}: {e}")
+        return {}
+
+
+def summarize_tables(tables: List[Any]) -> List[str]:
+    """
+    Summarizes tables with as few calls as possible: summaries are reused from the cache by table
+    content, and the other tables are packed several per prompt, the prompts running in parallel.
+
+    A table missing from a batched answer is summarized alone.
+
+    Args:
+        tables (List[Any]): DataFrames or lists of rows.
+
+    Returns:
+        List[str]: One summary per table, in order.
+    """
+    texts = [serialize_table(table) for table in tables]
+    cache = get_kv_cache("table_summaries")
+    summaries: Dict[int, str] = {}
+    missing = []
+    hits = 0
+    for index, text in enumerate(texts):
+        if not text:
+            summaries[index] = ""
+            continue
+        cached = cache.get(summary_key(text))
+        if cached is not None:
+            summaries[index] = cached
+            hits += 1
+        else:
+            missing.append(index)
+
+    if missing:
+        tokens = [count_tokens(texts[index], settings.CHAT_MODEL) for index in missing]
+        batches = [{missing[i]: texts[missing[i]] for i in batch} for batch in pack_batches(tokens)]
+        print(f"Summarizing {len(missing)} tables in {len(batches)} prompts ({hits} cached)")
+        for batch_summaries in execute_parallel(summarize_batch, batches):
+            summaries.update(batch_summaries)
+
+        left_out = [index for index in missing if index not in summaries]
+        for index, summary in zip(left_out, execute_parallel(get_summary, [texts[index] for index in left_out])):
+            summaries[index] = summary
+        for index in missing:
+            # get_summary answers "" on failure, which is not worth keeping
+            if summaries.get(index):
+                cache.put(summary_key(texts[index]), summaries[index])
+
+    return [summaries.get(index, "") for index in range(len(tables))]
@@ -0,0 +1,75 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, List, Tuple
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory cache with least-recently-used eviction and a time to live per entry.
+    """
+
+    def __init__(self, max_entries: int, ttl: float = None):
+        """
+        Args:
+            max_entries (int): Number of entries kept before the least recently used one is evicted.
+            ttl (float, optional): Seconds an entry stays valid after it is written. Default is None, entries never expire.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def _expired(self, written_at: float, now: float) -> bool:
+        return self.ttl is not None and now - written_at > self.ttl
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Returns the value of a key and marks it as recently used, or `default` if it is missing or expired.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            if self._expired(entry[0], time.monotonic()):
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Stores a value, evicting the least recently used entries beyond max_entries.
+        """
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Removes a key and returns its value, or `default` if it is missing.
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """
+        Returns a snapshot of the live (key, value) pairs, dropping expired entries.
+        """
+        now = time.monotonic()
+        with self.lock:
+            for key in [key for key, (written_at, _) in self.entries.items() if self._expired(written_at, now)]:
+                del self.entries[key]
+            return [(key, value) for key, (_, value) in self.entries.items()]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -1,28 +1,50 @@
 import openai 
 from src.config import settings
-from concurrent.futures import ThreadPoolExecutor
-import concurrent.futures
 from src.prompts import PredefinedPrompts
+from src.embeddings.cached_embeddings import get_embeddings
+from src.clients import get_openai_client, get_async_openai_client
+from src.executor import call_with_retries, call_with_retries_async, run_parallel
+from src.image_preparation import ImagePayload
 from typing import List
-import base64
+from functools import lru_cache
+import tiktoken
 import re
 import time
-import io
-import base64
 
-def ask_gpt(prompt: str, base64_images: List[str] = None):
+# Tokens billed for a high-detail page image (4 tiles of 170 tokens + 85 base tokens) and a low-detail one
+IMAGE_TOKENS_ESTIMATE = 765
+LOW_DETAIL_IMAGE_TOKENS = 85
+
+def image_content(image) -> dict:
     """
-    Function to call ChatGPT's chat completion API with support for multiple images.
+    Builds the message content item of an image, given as an ImagePayload or a Base64 encoded PNG.
+    """
+    if isinstance(image, ImagePayload):
+        return {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{image.mime_type};base64,{image.data}",
+                "detail": image.detail
+            }
+        }
+    return {
+        "type": "image_url",
+        "image_url": {
+            "url": f"data:image/png;base64,{image}"
+        }
+    }
+
+def build_messages(prompt: str, base64_images: List[str] = None) -> List[dict]:
+    """
+    Builds the chat messages for a prompt and optional images.
 
     Args:
         prompt (str): The text prompt for the GPT model.
-        base64_images (List[str], optional): A list of Base64 encoded strings of images.
+        base64_images (List[str], optional): A list of Base64 encoded strings of images or ImagePayloads.
 
     Returns:
-        str: The response message from ChatGPT.
+        List[dict]: The messages to send to the chat completion API.
     """
-    client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
-
     # Construct messages without images
     messages = [
         {
@@ -35,28 +57,15 @@ def ask_gpt(prompt: str, base64_images: List[str] = None):
 
     # If there are images, append each as a separate content item
     if base64_images:
-        image_messages = [
-            {
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/png;base64,{image}"
-                }
-            }
-            for image in base64_images
-        ]
+        image_messages = [image_content(image) for image in base64_images]
         # Add images to the user message
         messages[0]["content"].extend(image_messages)
+    return messages
 
-    start_time = time.time()
-
-    # Call the chat completion API
-    response = client.chat.completions.create(
-        model=settings.CHAT_MODEL,
-        messages=messages,
-        max_tokens=4096
-    )
-
-    print(response)
+def parse_response(response, start_time: float) -> dict:
+    """
+    Extracts the answer, timing and token usage from a chat completion response.
+    """
     # Calculate the time taken
     time_taken = time.time() - start_time
 
@@ -74,22 +83,165 @@ def ask_gpt(prompt: str, base64_images: List[str] = None):
     return {
         "response": message_content,
         "time_taken": time_taken,
+        # Without streaming the first token arrives with the whole answer
+        "time_to_first_token": time_taken,
         "tokens_used": tokens_used,
         "prompt_tokens": prompt_tokens,
         "completion_tokens": completion_tokens,
         "estimated_cost": estimated_cost
     }
 
+class GPTStream:
+    """
+    Iterator over the tokens of a streamed chat completion.
+
+    Once the stream is exhausted, `result` holds the same dictionary as ask_gpt, including
+    the time to first token.
+    """
+
+    def __init__(self, chunks, start_time: float):
+        self.chunks = chunks
+        self.start_time = start_time
+        self.parts = []
+        self.usage = None
+        self.time_to_first_token = None
+        self.result = None
+        # Optional callable receiving the result once the stream is exhausted
+        self.on_finish = None
+
+    def _consume(self, chunk):
+        # The last chunk carries the token usage and no choices
+        if chunk.usage is not None:
+            self.usage = chunk.usage
+        token = chunk.choices[0].delta.content if chunk.choices else None
+        if token:
+            if self.time_to_first_token is None:
+                self.time_to_first_token = time.time() - self.start_time
+            self.parts.append(token)
+        return token
+
+    def _finish(self):
+        time_taken = time.time() - self.start_time
+        tokens_used = self.usage.total_tokens if self.usage else 0
+        self.result = {
+            "response": "".join(self.parts),
+            "time_taken": time_taken,
+            "time_to_first_token": self.time_to_first_token if self.time_to_first_token is not None else time_taken,
+            "tokens_used": tokens_used,
+            "prompt_tokens": self.usage.prompt_tokens if self.usage else 0,
+            "completion_tokens": self.usage.completion_tokens if self.usage else 0,
+            "estimated_cost": (tokens_used / 1000) * 0.002
+        }
+        if self.on_finish is not None:
+            self.on_finish(self.result)
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            token = self._consume(chunk)
+            if token:
+                yield token
+        self._finish()
+
+class AsyncGPTStream(GPTStream):
+    """
+    Async iterator over the tokens of a streamed chat completion.
+    """
+
+    async def __aiter__(self):
+        async for chunk in self.chunks:
+            token = self._consume(chunk)
+            if token:
+                yield token
+        self._finish()
+
+def ask_gpt(prompt: str, base64_images: List[str] = None, stream: bool = False, response_format: dict = None):
+    """
+    Function to call ChatGPT's chat completion API with support for multiple images.
+
+    Args:
+        prompt (str): The text prompt for the GPT model.
+        base64_images (List[str], optional): A list of Base64 encoded strings of images.
+        stream (bool, optional): Return a GPTStream yielding tokens as they arrive. Default is False.
+        response_format (dict, optional): Structured output format, e.g. {"type": "json_object"}. Default is None.
+
+    Returns:
+        str: The response message from ChatGPT.
+    """
+    client = get_openai_client()
+    messages = build_messages(prompt, base64_images)
+
+    start_time = time.time()
+
+    # Call the chat completion API
+    response = call_with_retries(
+        client.chat.completions.create,
+        model=settings.CHAT_MODEL,
+        messages=messages,
+        max_tokens=4096,
+        tokens=estimate_request_tokens(prompt, base64_images),
+        **_stream_arguments(stream),
+        **({"response_format": response_format} if response_format else {})
+    )
+    if stream:
+        return GPTStream(response, start_time)
+
+    print(response)
+    return parse_response(response, start_time)
+
+async def ask_gpt_async(prompt: str, base64_images: List[str] = None, stream: bool = False, response_format: dict = None):
+    """
+    Async variant of ask_gpt, sharing one pooled AsyncOpenAI client per event loop.
+
+    Args:
+        prompt (str): The text prompt for the GPT model.
+        base64_images (List[str], optional): A list of Base64 encoded strings of images.
+        stream (bool, optional): Return an AsyncGPTStream yielding tokens as they arrive. Default is False.
+        response_format (dict, optional): Structured output format, e.g. {"type": "json_object"}. Default is None.
+
+    Returns:
+        str: The response message from ChatGPT.
+    """
+    client = get_async_openai_client()
+    messages = build_messages(prompt, base64_images)
+
+    start_time = time.time()
+
+    # Call the chat completion API
+    response = await call_with_retries_async(
+        client.chat.completions.create,
+        model=settings.CHAT_MODEL,
+        messages=messages,
+        max_tokens=4096,
+        tokens=estimate_request_tokens(prompt, base64_images),
+        **_stream_arguments(stream),
+        **({"response_format": response_format} if response_format else {})
+    )
+    if stream:
+        return AsyncGPTStream(response, start_time)
+
+    return parse_response(response, start_time)
+
+def estimate_request_tokens(prompt: str, base64_images: List[str] = None) -> int:
+    """
+    Estimates the tokens a chat completion request counts against the rate limit:
+    the prompt, the images and the requested max_tokens.
+    """
+    image_tokens = sum(
+        LOW_DETAIL_IMAGE_TOKENS if getattr(image, "detail", None) == "low" else IMAGE_TOKENS_ESTIMATE
+        for image in base64_images or []
+    )
+    return count_tokens(prompt, settings.CHAT_MODEL) + image_tokens + 4096
+
+def _stream_arguments(stream: bool) -> dict:
+    # Ask for the token usage in the last chunk so streamed answers report it too
+    return {"stream": True, "stream_options": {"include_usage": True}} if stream else {}
+
 
 def create_embeddings(text):
     """
-    function to create text embeddings using openAI
+    function to create text embeddings using openAI, served from the embedding cache when possible
     """
-    response = openai.Embedding.create(
-            input=text,
-            model= settings.EMBEDDINGS_MODEL  
-        )
-    return response['data'][0]['embedding']
+    return get_embeddings().embed_query(text)
 
 
 def describe_image(b64_image):
@@ -123,46 +275,62 @@ def get_summary(data):
         print(e)
         return ""
 
-def convert_image_to_base64(image_path: str) -> str:
+def execute_parallel(func,data_list, *args, **kwargs):
     """
-    Converts an image file to its Base64 encoded string representation.
+    Calls `func(data, *args, **kwargs)` for every item on the shared, bounded worker pool.
 
-    Args:
-        image_path (str): The file path of the image to be encoded.
+    Failed items are reported (see src.executor.run_parallel) and left out of the results.
 
     Returns:
-        str: The Base64 encoded string of the image.
+        list: Results of the successful calls, in item order.
+    """
+    results, _ = run_parallel(func, data_list, *args, **kwargs)
+    return results
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name: str = None):
+    """
+    Returns the tiktoken encoding used by the given model, falling back to cl100k_base.
     """
     try:
-        # Open the image file in binary mode
-        with open(image_path, 'rb') as image_file:
-            # Read the image file and encode it to Base64
-            encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
-            return encoded_image
-    except FileNotFoundError:
-        print(f"Error: The file at {image_path} was not found.")
-        return ""
-    except Exception as e:
-        print(f"Error: {e}")
-        return ""
+        return tiktoken.encoding_for_model(model_name or settings.EMBEDDINGS_MODEL)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
 
-def execute_parallel(func,data_list, *args, **kwargs):
-    executor = ThreadPoolExecutor(max_workers=len(data_list))  # Adjust max_workers as needed
+def count_tokens(text: str, model_name: str = None) -> int:
+    """
+    Counts the tokens in a text for the given model (the embeddings model by default).
+    """
+    return len(get_encoding(model_name).encode(text, disallowed_special=()))
 
-    # Submit tasks for each dataframe
-    futures = [executor.submit(func, data, *args, **kwargs) for data in data_list]
+def make_batches(texts: List[str], max_items: int = None, max_tokens: int = None) -> List[List[int]]:
+    """
+    Groups texts into batches bounded by item count and total token count.
 
-    # Wait for all tasks to complete
-    concurrent.futures.wait(futures)
-    results = []
-    
-    # Close the executor to free resources
-    executor.shutdown()
+    Args:
+        texts (List[str]): The texts to group.
+        max_items (int, optional): Maximum number of texts per batch. Defaults to settings.EMBED_BATCH_SIZE.
+        max_tokens (int, optional): Maximum number of tokens per batch. Defaults to settings.EMBED_BATCH_MAX_TOKENS.
 
-    for future in futures:
-        if future.exception() is None:
-            results.append(future.result())
-    return results
+    Returns:
+        List[List[int]]: Batches of indices into `texts`, in the original order.
+    """
+    max_items = max_items or settings.EMBED_BATCH_SIZE
+    max_tokens = max_tokens or settings.EMBED_BATCH_MAX_TOKENS
+
+    batches = []
+    current, current_tokens = [], 0
+    for index, text in enumerate(texts):
+        tokens = count_tokens(text)
+        # A single oversized text still goes out on its own rather than being dropped
+        if current and (len(current) >= max_items or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(index)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
 
 def clean_text(text):
     # Remove newline characters and replace them with spaces
@@ -174,9 +342,3 @@ def clean_text(text):
     text = re.sub(r'-\s*\d+\s*Points', '', text)  # Removes points scoring if not needed
 
     return text
-
-def convert_pil_to_base64(pil_image):
-    buffered = io.BytesIO()
-    pil_image.save(buffered, format="PNG") 
-    b64_image = base64.b64encode(buffered.getvalue()).decode("utf-8")
-    return b64_image
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+import asyncio
 from typing import Any, Dict, List, Tuple
 
 class VectorDatabaseInterface(ABC):
@@ -14,6 +15,41 @@ class VectorDatabaseInterface(ABC):
         """
         pass
 
+    @abstractmethod
+    def store_vectors(self, data_list: List[Dict[str, Any]], metadata_list: List[Dict[str, Any]] = None) -> None:
+        """
+        Store many vectors in the database, batching embedding requests and writes.
+
+        Args:
+            data_list (List[Dict[str, Any]]): One {"content" :   ,"transformed_content": } dictionary per vector.
+            metadata_list (List[Dict[str, Any]], optional): Metadata for each vector, in the same order. Default is None.
+        """
+        pass
+
+    @abstractmethod
+    def delete_vectors(self, file_name: str, pages: List[int] = None) -> None:
+        """
+        Delete the vectors of a document, or only those of some of its pages.
+
+        Args:
+            file_name (str): Name of the document whose vectors are deleted.
+            pages (List[int], optional): 1-based page numbers to delete. Default is None, which deletes the whole document.
+        """
+        pass
+
+    @abstractmethod
+    def get_metadata(self, where: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Return the metadata of the stored vectors matching a filter, without searching.
+
+        Args:
+            where (Dict[str, Any]): Chroma-style metadata filter, e.g. {"file_name": "a.pdf"}.
+
+        Returns:
+            List[Dict[str, Any]]: The metadata of each matching vector.
+        """
+        pass
+
     @abstractmethod
     def query_vector(self, query: Any, *kwargs) -> List[Any]:
         """
@@ -27,6 +63,18 @@ class VectorDatabaseInterface(ABC):
         """
         pass
 
+    async def query_vector_async(self, query: Any, *args, **kwargs) -> List[Any]:
+        """
+        Async variant of query_vector. By default the synchronous query runs in a worker thread so it does not block the event loop.
+
+        Args:
+            query (Any): The query to search for in the vector database.
+
+        Returns:
+            List[Any]: A list of matching vectors.
+        """
+        return await asyncio.to_thread(self.query_vector, query, *args, **kwargs)
+
     @abstractmethod
     def set_memory(self, history: List[Dict[str, Any]]) -> Any:
         """
@@ -1,65 +1,81 @@
-from chromadb import PersistentClient
 from langchain_chroma import Chroma
-from chromadb.config import DEFAULT_TENANT, DEFAULT_DATABASE, Settings
 from typing import Any, Dict, List, Tuple, Optional
 from src.vectordbs.base import VectorDatabaseInterface
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from src.vectordbs.lexical import get_lexical_index, hybrid_search
+from src.vectordbs.registry import VectorEngine, get_engine
 from src.config import settings
 from langchain_core.documents import Document
 from langchain.retrievers.self_query.base import SelfQueryRetriever
-from langchain.chains.query_constructor.base import AttributeInfo
+from src.vectordbs.query_router import METADATA_FIELD_INFO, has_filter_intent
+from src.utils import make_batches
+import numpy as np
+import hashlib
+import json
+import threading
+import uuid
 
 
 class ChromaDB(VectorDatabaseInterface):
-    def __init__(self, collection_name: str):
+    def __init__(self, collection_name: str, engine: VectorEngine = None):
         """
-        Initialize ChromaDB client and create a collection.
+        Initialize a handle on a ChromaDB collection, creating the collection if needed.
 
         Args:
             collection_name (str): Name of the ChromaDB collection to use.
+            engine (VectorEngine, optional): Engine providing the shared client and models. Defaults to the process-wide engine.
         """
-        self.client = PersistentClient(
-                        path=settings.DB_NAME,
-                        settings=Settings(),
-                        tenant=DEFAULT_TENANT,
-                        database=DEFAULT_DATABASE,
-                    )
+        self.engine = engine or get_engine()
+        self.client = self.engine.client
         self.collection_name = collection_name
-        self.client.get_or_create_collection(name=collection_name)
-        self.embeddings_model = OpenAIEmbeddings(openai_api_key = settings.OPENAI_API_KEY)
-        self.LLM = ChatOpenAI(temperature=settings.TEMPERATURE, model=settings.CHAT_MODEL, openai_api_key = settings.OPENAI_API_KEY)
-
-        self.vector_store = Chroma(
-                                    client=self.client,
-                                    collection_name=self.collection_name,
-                                    embedding_function=self.embeddings_model,
-                                )
-        
-        document_content_description = "contents and summary of a pdf page"
-        metadata_field_info = [
-                                AttributeInfo(
-                                    name="image_path",
-                                    description="Path to where the base image is stored",
-                                    type="string",
-                                )
-                                ]
-        self.retriever = SelfQueryRetriever.from_llm(
-                        self.LLM, self.vector_store, document_content_description, metadata_field_info, verbose=True,k=settings.NUM_DOCS
-                    )
+        self.collection = self.client.get_or_create_collection(name=collection_name)
+        self.embeddings_model = self.engine.embeddings_model
+        self.LLM = self.engine.LLM
+
+        self.vector_store = self._make_vector_store()
+        self._retriever = None
+        self._retriever_lock = threading.Lock()
+        self.lexical_index = get_lexical_index(collection_name)
+
+    def _make_vector_store(self) -> Chroma:
+        return Chroma(
+                    client=self.client,
+                    collection_name=self.collection_name,
+                    embedding_function=self.embeddings_model,
+                )
+
+    @property
+    def retriever(self) -> SelfQueryRetriever:
+        """
+        The self-query retriever of the collection, built on first use.
+        """
+        with self._retriever_lock:
+            if self._retriever is None:
+                document_content_description = "contents and summary of a pdf page"
+                self._retriever = SelfQueryRetriever.from_llm(
+                                self.LLM, self.vector_store, document_content_description, METADATA_FIELD_INFO, verbose=True,k=settings.NUM_DOCS
+                            )
+            return self._retriever
         
     def reset_database(self):
         self.client.delete_collection(name=self.collection_name)
-        self.client.get_or_create_collection(name=self.collection_name)
-
-    def compute_embedding(self, text: str) -> List[float]:
+        self.collection = self.client.get_or_create_collection(name=self.collection_name)
+        # The langchain store and the retriever built on it still point to the deleted collection
+        with self._retriever_lock:
+            self.vector_store = self._make_vector_store()
+            self._retriever = None
+        if self.lexical_index is not None:
+            self.lexical_index.reset()
+        self.engine.bump_generation(self.collection_name)
+
+    def compute_embedding(self, text: List[str]) -> List[List[float]]:
         """
-        Compute embeddings for the provided text using OpenAIEmbeddings from Langchain.
+        Compute embeddings for the provided texts using OpenAIEmbeddings from Langchain.
 
         Args:
-            text (str): The input text to compute the embedding.
+            text (List[str]): The input texts to compute the embeddings for.
 
         Returns:
-            List[float]: The computed embedding as a list of floats.
+            List[List[float]]: The computed embeddings, one list of floats per text.
         """
         # Generate embeddings using OpenAIEmbeddings
         return self.embeddings_model.embed_documents(text)
@@ -75,22 +91,125 @@ class ChromaDB(VectorDatabaseInterface):
         Returns:
             str: Success message upon successful insertion.
         """
-        print("Inserting a document into ChromaDB")
-        
-        # Extract content and transformed content
-        content = data["content"]
-    
-        doc = Document(
-                        page_content=content,
-                        metadata = metadata,
-                    )
-        self.vector_store.add_documents(documents=[doc])
+        return self.store_vectors([data], [metadata])
+
+    def store_vectors(self, data_list: List[Dict[str, Any]], metadata_list: List[Dict[str, Any]] = None) -> str:
+        """
+        Store many vectors in the ChromaDB collection.
+
+        Contents are grouped into batches bounded by settings.EMBED_BATCH_SIZE and
+        settings.EMBED_BATCH_MAX_TOKENS; each batch is embedded with one request and
+        written with one upsert.
+
+        Args:
+            data_list (List[Dict[str, Any]]): One {"content": <original_text>, "transformed_content": <optional altered text>} per vector.
+            metadata_list (List[Dict[str, Any]], optional): Metadata for each vector, in the same order.
+
+        Returns:
+            str: Success message upon successful insertion.
+        """
+        if metadata_list is None:
+            metadata_list = [None] * len(data_list)
+
+        texts = [data["content"] for data in data_list]
+        batches = make_batches(texts)
+        print(f"Inserting {len(texts)} documents into ChromaDB in {len(batches)} batches")
+
+        for batch in batches:
+            batch_texts = [texts[i] for i in batch]
+            self.collection.upsert(
+                ids=[str(uuid.uuid4()) for _ in batch],
+                embeddings=self.compute_embedding(batch_texts),
+                documents=batch_texts,
+                # Chroma rejects empty metadata dictionaries
+                metadatas=[metadata_list[i] or None for i in batch],
+            )
+        if self.lexical_index is not None:
+            self.lexical_index.add(texts, metadata_list)
+        self.engine.bump_generation(self.collection_name)
         return "Success"
 
+    def delete_vectors(self, file_name: str, pages: List[int] = None) -> str:
+        """
+        Delete the vectors of a document from the ChromaDB collection.
+
+        Args:
+            file_name (str): Name of the document, as stored in the "file_name" metadata.
+            pages (List[int], optional): 1-based page numbers to delete. Default is None, which deletes the whole document.
+
+        Returns:
+            str: Success message upon successful deletion.
+        """
+        if pages is None:
+            where = {"file_name": file_name}
+        elif len(pages) == 0:
+            return "Success"
+        else:
+            where = {"$and": [{"file_name": file_name}, {"page": {"$in": list(pages)}}]}
+        print(f"Deleting vectors of {file_name} (pages: {pages or 'all'}) from ChromaDB")
+        self.collection.delete(where=where)
+        if self.lexical_index is not None:
+            self.lexical_index.delete(file_name, pages)
+        self.engine.bump_generation(self.collection_name)
+        return "Success"
+
+    def get_metadata(self, where: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Return the metadata of the stored vectors matching a Chroma metadata filter.
+        """
+        if len(where) > 1:
+            where = {"$and": [{key: value} for key, value in where.items()]}
+        return [metadata or {} for metadata in self.collection.get(where=where, include=["metadatas"])["metadatas"]]
+
+    def search(self, query: str, k: int = None, where: Dict[str, Any] = None) -> List[Document]:
+        """
+        Embed a query and return its nearest documents, with their distance in the "score" metadata.
+
+        Results are memoized in the engine's retrieval cache under (query embedding, k, filter) and
+        the collection's write generation, so repeated and paraphrased queries that embed the same
+        skip the kNN search and the document fetch until the collection is written to.
+
+        Args:
+            query (str): The query string.
+            k (int, optional): Number of documents to return. Defaults to settings.NUM_DOCS.
+            where (Dict[str, Any], optional): Chroma metadata filter. Default is None.
+
+        Returns:
+            List[Document]: The matching documents, nearest first.
+        """
+        k = k or settings.NUM_DOCS
+        embedding = self.embeddings_model.embed_query(query)
+        key = (
+            self.collection_name,
+            self.engine.generation(self.collection_name),
+            hashlib.sha256(np.asarray(embedding, dtype=np.float32).tobytes()).hexdigest(),
+            k,
+            json.dumps(where, sort_keys=True),
+        )
+        results = self.engine.retrieval_cache.get(key)
+        if results is None:
+            response = self.collection.query(
+                query_embeddings=[embedding], n_results=k, where=where,
+                include=["documents", "metadatas", "distances"],
+            )
+            results = list(zip(response["ids"][0], response["distances"][0], response["documents"][0], response["metadatas"][0]))
+            self.engine.retrieval_cache.put(key, results)
+
+        # Fresh documents every time, callers may modify them
+        return [
+            Document(page_content=document, metadata={**(metadata or {}), "id": doc_id, "score": distance})
+            for doc_id, distance, document, metadata in results
+        ]
+
     def query_vector(self, query: str, *args: Tuple[Any, ...], **kwargs: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
         Query the ChromaDB collection and return matching vectors for a given query string.
 
+        settings.RETRIEVAL_MODE selects how: "direct" embeds the query and runs a kNN search,
+        "self_query" lets the LLM build a structured (filtered) query first, and "auto" only
+        uses the self-query retriever when the query looks like it filters on pages or documents.
+        In collections with a lexical index, direct searches are fused with a BM25 search.
+
         Args:
             query (str): The query string to search for in the vector database.
             top_k (int): Number of results to return. Default is 5.
@@ -98,8 +217,15 @@ class ChromaDB(VectorDatabaseInterface):
         Returns:
             List[Dict[str, Any]]: A list of dictionaries containing matched vectors' content and metadata.
         """
-        docs = self.retriever.invoke(query)
-        return docs
+        retrieval_mode = settings.RETRIEVAL_MODE.lower()
+        if retrieval_mode not in ("direct", "self_query", "auto"):
+            raise ValueError(f"Unsupported retrieval mode '{settings.RETRIEVAL_MODE}'")
+
+        if retrieval_mode == "self_query" or (retrieval_mode == "auto" and has_filter_intent(query)):
+            return self.retriever.invoke(query)
+        if self.lexical_index is not None:
+            return hybrid_search(query, lambda k: self.search(query, k=k), self.lexical_index)
+        return self.search(query)
 
     def set_memory(self, history: List[Dict[str, Any]]) -> str:
         """
@@ -111,8 +237,9 @@ class ChromaDB(VectorDatabaseInterface):
         Returns:
             str: Success message upon successful insertion.
         """
-        # Iterate over chat history and store each message as a separate document in ChromaDB
-        for item in history:
-            self.store_vector(data={"content": item['message'], "transformed_content": item.get('embedding')}, 
-                              metadata={"timestamp": item['timestamp']})
+        # Store each message as a separate document in ChromaDB
+        self.store_vectors(
+            data_list=[{"content": item['message'], "transformed_content": item.get('embedding')} for item in history],
+            metadata_list=[{"timestamp": item['timestamp']} for item in history],
+        )
         return "Memory set successfully"
@@ -0,0 +1,491 @@
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+from src.config import settings
+from src.file_lock import file_lock
+
+# Identifiers such as "12.3", "2024-01-05" or "a/b" stay whole; their parts are indexed too
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[./-][a-z0-9]+)*")
+PART_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with".split()
+)
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Segments whose postings counts fall in the same power of MERGE_FACTOR are merged once there are MERGE_FACTOR of them
+MERGE_FACTOR = 4
+# Live segments and next document and segment numbers, shared by the processes using an index
+STATE_FILE = "segments.json"
+SEGMENT_PATTERN = re.compile(r"segment_\d+\.npz")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits text into lowercase index terms, keeping compound identifiers and their parts.
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        parts = PART_PATTERN.findall(token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part not in STOPWORDS)
+    return tokens
+
+
+class Segment:
+    """
+    Immutable slice of the inverted index: sorted terms, and for each term a run of (document, term
+    frequency) postings in two flat arrays.
+    """
+
+    def __init__(self, terms: np.ndarray, offsets: np.ndarray, docs: np.ndarray, frequencies: np.ndarray):
+        self.terms = terms
+        self.offsets = offsets
+        self.docs = docs
+        self.frequencies = frequencies
+        self.term_ids = {term: i for i, term in enumerate(terms.tolist())}
+
+    @classmethod
+    def build(cls, documents: Dict[int, Counter]) -> "Segment":
+        postings: Dict[str, List[tuple]] = {}
+        for doc, counts in documents.items():
+            for term, frequency in counts.items():
+                postings.setdefault(term, []).append((doc, frequency))
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+        pairs = [pair for term in terms for pair in postings[term]]
+        docs = np.array([doc for doc, _ in pairs], dtype=np.int64)
+        frequencies = np.array([min(frequency, 65535) for _, frequency in pairs], dtype=np.uint16)
+        return cls(np.array(terms, dtype=str), offsets, docs, frequencies)
+
+    @classmethod
+    def merge(cls, segments: List["Segment"], alive: np.ndarray) -> "Segment":
+        """
+        Merges segments into one with array operations, dropping the postings of documents that are not alive.
+        """
+        terms, term_ids = np.unique(np.concatenate([segment.terms for segment in segments]), return_inverse=True)
+        posting_terms = []
+        base = 0
+        for segment in segments:
+            local = np.repeat(np.arange(len(segment.terms)), np.diff(segment.offsets))
+            posting_terms.append(term_ids.reshape(-1)[base + local])
+            base += len(segment.terms)
+        posting_terms = np.concatenate(posting_terms)
+        docs = np.concatenate([segment.docs for segment in segments])
+        frequencies = np.concatenate([segment.frequencies for segment in segments])
+
+        keep = alive[docs]
+        posting_terms, docs, frequencies = posting_terms[keep], docs[keep], frequencies[keep]
+        order = np.lexsort((docs, posting_terms))
+        counts = np.bincount(posting_terms, minlength=len(terms))
+        used = counts > 0
+        offsets = np.zeros(int(used.sum()) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts[used])
+        return cls(terms[used], offsets, docs[order], frequencies[order])
+
+    @property
+    def size(self) -> int:
+        return len(self.docs)
+
+    @property
+    def tier(self) -> int:
+        return int(math.log(max(self.size, 1), MERGE_FACTOR))
+
+    @classmethod
+    def load(cls, path: str) -> "Segment":
+        with np.load(path) as data:
+            return cls(data["terms"], data["offsets"], data["docs"], data["frequencies"])
+
+    def save(self, path: str) -> None:
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, terms=self.terms, offsets=self.offsets, docs=self.docs, frequencies=self.frequencies)
+        os.replace(tmp_path, path)
+
+    def postings(self, term: str):
+        i = self.term_ids.get(term)
+        if i is None:
+            return None
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.docs[start:end], self.frequencies[start:end]
+
+
+class LexicalIndex:
+    """
+    BM25 index of the contents of a collection, stored next to it under settings.LEXICAL_INDEX_PATH.
+
+    Each batch of stored contents becomes a segment of the inverted index (an .npz of arrays);
+    contents and metadata are kept in SQLite so that lexical results can be returned on their own.
+    Segments of similar sizes are merged together, so each posting is rewritten a logarithmic
+    number of times as the index grows. Deleted documents are tombstoned and dropped when their
+    segments are merged.
+
+    Several processes can share an index (the app and batch ingestion). The live segments and the
+    next document and segment numbers are kept in a state file; every write holds a lock file,
+    reloads the state if another process changed it, and rewrites it atomically.
+    """
+
+    def __init__(self, collection_name: str, path: str = None):
+        """
+        Args:
+            collection_name (str): Name of the collection.
+            path (str, optional): Root directory of the lexical indexes. Defaults to settings.LEXICAL_INDEX_PATH.
+        """
+        self.collection_name = collection_name
+        self.directory = os.path.join(path or settings.LEXICAL_INDEX_PATH, collection_name)
+        self.database_path = os.path.join(self.directory, "documents.sqlite")
+        self.state_path = os.path.join(self.directory, STATE_FILE)
+        # Outside the directory, which reset removes
+        self.lock_path = f"{self.directory}.lock"
+        self.lock = threading.RLock()
+        # Merges are built outside self.lock, one at a time
+        self.merge_lock = threading.Lock()
+        self.connection = None
+        self.database_inode = None
+        self.segments: Dict[str, Segment] = {}  # by file name, oldest first
+        self.state_stamp = None
+        with file_lock(self.lock_path):
+            self._open()
+
+    def _open(self):
+        """
+        Opens the index, creating its state file from the segments on disk if it has none. Must hold the lock file.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self._connect()
+        if not os.path.exists(self.state_path):
+            names = sorted(name for name in os.listdir(self.directory) if SEGMENT_PATTERN.fullmatch(name))
+            next_doc, = self.connection.execute("SELECT COALESCE(MAX(doc), -1) + 1 FROM documents").fetchone()
+            next_segment = int(names[-1][8:-4]) + 1 if names else 0
+            self._write_state(names, next_doc, next_segment)
+        self.state_stamp = None
+        self._load()
+
+    def _connect(self):
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = sqlite3.connect(self.database_path, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                doc INTEGER PRIMARY KEY, content TEXT, metadata TEXT, file_name TEXT, page INTEGER,
+                length INTEGER, deleted INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS documents_file ON documents (file_name, page);
+        """)
+        self.database_inode = os.stat(self.database_path).st_ino
+
+    def _state_stamp(self) -> Optional[tuple]:
+        try:
+            stat = os.stat(self.state_path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        """
+        Reloads the segments, document lengths and tombstones if the state file changed since this
+        process last read or wrote it. Must hold the lock file.
+        """
+        stamp = self._state_stamp()
+        if stamp is None or stamp == self.state_stamp:
+            return
+        with open(self.state_path) as f:
+            state = json.load(f)
+        if os.stat(self.database_path).st_ino != self.database_inode:
+            # Another process reset the index
+            self._connect()
+            self.segments = {}
+        rows = self.connection.execute("SELECT doc, length, deleted FROM documents").fetchall()
+        # Documents committed by a process that stopped before writing the state must keep their ids
+        self.next_doc = max(state["next_doc"], max((doc for doc, _, _ in rows), default=-1) + 1)
+        self.next_segment = state["next_segment"]
+        self.lengths = np.zeros(self.next_doc, dtype=np.float32)
+        self.alive = np.zeros(self.next_doc, dtype=bool)
+        for doc, length, deleted in rows:
+            self.lengths[doc] = length
+            self.alive[doc] = not deleted
+        self.segments = {
+            name: self.segments.get(name) or Segment.load(os.path.join(self.directory, name))
+            for name in state["segments"]
+        }
+        self.state_stamp = stamp
+
+    def _refresh(self):
+        """
+        Reloads the index if another process changed it. Must hold self.lock but not the lock file.
+        """
+        if self._state_stamp() != self.state_stamp:
+            with file_lock(self.lock_path, shared=True):
+                self._load()
+
+    def _write_state(self, names: List[str] = None, next_doc: int = None, next_segment: int = None):
+        """
+        Atomically replaces the state file, by default with the in-memory state. Must hold the lock file.
+        """
+        state = {
+            "segments": list(self.segments) if names is None else names,
+            "next_doc": self.next_doc if next_doc is None else next_doc,
+            "next_segment": self.next_segment if next_segment is None else next_segment,
+        }
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+        self.state_stamp = self._state_stamp()
+
+    def _segment_name(self) -> str:
+        name = f"segment_{self.next_segment:06d}.npz"
+        self.next_segment += 1
+        return name
+
+    def add(self, texts: List[str], metadata_list: List[Optional[Dict[str, Any]]] = None) -> None:
+        """
+        Indexes contents as a new segment.
+
+        Args:
+            texts (List[str]): Contents to index.
+            metadata_list (List[Dict[str, Any]], optional): Metadata of each content, in the same order.
+        """
+        if not texts:
+            return
+        metadata_list = metadata_list or [None] * len(texts)
+        counts = [Counter(tokenize(text)) for text in texts]
+        with self.lock, file_lock(self.lock_path):
+            self._load()
+            start = self.next_doc
+            self.connection.executemany(
+                "INSERT INTO documents (doc, content, metadata, file_name, page, length) VALUES (?, ?, ?, ?, ?, ?)",
+                [(start + i, text, json.dumps(metadata or {}), (metadata or {}).get("file_name"), (metadata or {}).get("page"),
+                  sum(counts[i].values())) for i, (text, metadata) in enumerate(zip(texts, metadata_list))]
+            )
+            segment = Segment.build({start + i: count for i, count in enumerate(counts)})
+            name = self._segment_name()
+            segment.save(os.path.join(self.directory, name))
+            # The segment is only visible once its documents are committed
+            self.connection.commit()
+            self.segments[name] = segment
+            self.next_doc = start + len(texts)
+            self.lengths = np.concatenate([self.lengths, np.array([sum(count.values()) for count in counts], dtype=np.float32)])
+            self.alive = np.concatenate([self.alive, np.ones(len(texts), dtype=bool)])
+            self._write_state()
+        self.maintain()
+
+    def delete(self, file_name: str, pages: List[int] = None) -> None:
+        """
+        Removes the contents of a document, or of some of its pages.
+        """
+        with self.lock, file_lock(self.lock_path):
+            self._load()
+            if pages is None:
+                where, params = "file_name = ?", [file_name]
+            else:
+                where, params = f"file_name = ? AND page IN ({', '.join('?' * len(pages))})", [file_name, *pages]
+            docs = [doc for doc, in self.connection.execute(f"SELECT doc FROM documents WHERE {where}", params)]
+            self.connection.execute(f"UPDATE documents SET deleted = 1 WHERE {where}", params)
+            self.connection.commit()
+            self.alive[docs] = False
+            # Tells the other processes to reload the tombstones
+            self._write_state()
+            deleted, total = self.connection.execute("SELECT COALESCE(SUM(deleted), 0), COUNT(*) FROM documents").fetchone()
+        # Reclaim the space once most of the indexed documents are deleted
+        if deleted > total - deleted:
+            self.merge()
+
+    def maintain(self) -> None:
+        """
+        Merges segments by size tier: whenever MERGE_FACTOR segments have postings counts in the
+        same power of MERGE_FACTOR, they are merged into one of a higher tier, smallest tier first.
+        """
+        while True:
+            with self.lock:
+                self._refresh()
+                tiers: Dict[int, List[str]] = {}
+                for name, segment in self.segments.items():
+                    tiers.setdefault(segment.tier, []).append(name)
+                full = [group for _, group in sorted(tiers.items()) if len(group) >= MERGE_FACTOR]
+            if not full or not self.merge(full[0]):
+                return
+
+    def merge(self, names: List[str] = None) -> bool:
+        """
+        Merges segments into one, dropping the postings of deleted documents.
+
+        The merged segment is built without holding the locks, from a snapshot of the deleted
+        documents, so searches and writes go on meanwhile; it then replaces the merged segments at
+        once, unless another process merged some of them first.
+
+        Args:
+            names (List[str], optional): File names of the segments to merge. Default is None, which merges every segment.
+
+        Returns:
+            bool: True if the merged segment replaced the segments.
+        """
+        with self.merge_lock:
+            with self.lock, file_lock(self.lock_path):
+                self._load()
+                names = list(self.segments) if names is None else [name for name in names if name in self.segments]
+                if not names:
+                    return False
+                segments = [self.segments[name] for name in names]
+                alive = self.alive.copy()
+                merged_name = self._segment_name()
+                # Reserves the merged segment's name
+                self._write_state()
+
+            merged = Segment.merge(segments, alive)
+            merged_path = os.path.join(self.directory, merged_name)
+            merged.save(merged_path)
+
+            with self.lock, file_lock(self.lock_path):
+                self._load()
+                if any(name not in self.segments for name in names):
+                    os.remove(merged_path)
+                    return False
+                complete = len(names) == len(self.segments)
+                self.segments = {name: segment for name, segment in self.segments.items() if name not in names}
+                self.segments[merged_name] = merged
+                self._write_state()
+                for name in names:
+                    os.remove(os.path.join(self.directory, name))
+                if complete:
+                    # No segment holds postings of the documents deleted before the snapshot any more
+                    dead = [(doc,) for doc in np.flatnonzero(~alive).tolist()]
+                    self.connection.executemany("DELETE FROM documents WHERE doc = ? AND deleted = 1", dead)
+                    self.connection.commit()
+            return True
+
+    def search(self, query: str, k: int = None) -> List[Document]:
+        """
+        Returns the k documents with the best BM25 score for a query, with the score in the "lexical_score" metadata.
+        """
+        k = k or settings.NUM_DOCS
+        terms = set(tokenize(query))
+        with self.lock:
+            self._refresh()
+            alive = self.alive
+            count = int(alive.sum())
+            if count == 0 or not terms:
+                return []
+            average_length = float(self.lengths[alive].mean()) or 1.0
+            scores = np.zeros(len(alive), dtype=np.float32)
+            for term in terms:
+                postings = [p for p in (segment.postings(term) for segment in self.segments.values()) if p is not None]
+                if not postings:
+                    continue
+                docs = np.concatenate([docs for docs, _ in postings])
+                frequencies = np.concatenate([frequencies for _, frequencies in postings]).astype(np.float32)
+                frequency = int(alive[docs].sum())
+                idf = np.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[docs] / average_length)
+                np.add.at(scores, docs, idf * frequencies * (BM25_K1 + 1) / (frequencies + norm))
+            scores[~alive] = 0
+            best = np.flatnonzero(scores)
+            best = best[np.argsort(-scores[best], kind="stable")[:k]]
+            if len(best) == 0:
+                return []
+            records = {doc: (content, metadata) for doc, content, metadata in self.connection.execute(
+                f"SELECT doc, content, metadata FROM documents WHERE doc IN ({', '.join('?' * len(best))})", best.tolist()
+            )}
+        return [Document(page_content=records[doc][0], metadata={**json.loads(records[doc][1]), "lexical_score": float(scores[doc])})
+                for doc in best.tolist()]
+
+    def reset(self) -> None:
+        with self.lock, file_lock(self.lock_path):
+            self.connection.close()
+            self.connection = None
+            shutil.rmtree(self.directory)
+            self.segments = {}
+            self._open()
+
+
+_indexes: Dict[str, LexicalIndex] = {}
+_indexes_lock = threading.Lock()
+_dense_pool = None
+
+
+def get_lexical_index(collection_name: str) -> Optional[LexicalIndex]:
+    """
+    Returns the lexical index of a collection, or None if the collection is not in settings.LEXICAL_COLLECTIONS.
+    """
+    if collection_name not in settings.LEXICAL_COLLECTIONS:
+        return None
+    with _indexes_lock:
+        if collection_name not in _indexes:
+            _indexes[collection_name] = LexicalIndex(collection_name)
+        return _indexes[collection_name]
+
+
+def document_key(document: Document) -> str:
+    """
+    Identifies a document across the dense and lexical results: same document, page and content.
+    """
+    metadata = document.metadata
+    return hashlib.sha1(f"{metadata.get('file_name')}\0{metadata.get('page')}\0{document.page_content}".encode("utf-8")).hexdigest()
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Document]], k: int) -> List[Document]:
+    """
+    Fuses ranked lists of documents by reciprocal rank (sum of 1 / (settings.RRF_K + rank))
+    and returns the k best, with their fused score in the "rrf_score" metadata.
+    """
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for results in result_lists:
+        for rank, document in enumerate(results, start=1):
+            key = document_key(document)
+            scores[key] = scores.get(key, 0.0) + 1 / (settings.RRF_K + rank)
+            # The first list's copy wins, dense results carry the vector id and distance
+            documents.setdefault(key, document)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    for key in best:
+        documents[key].metadata["rrf_score"] = scores[key]
+    return [documents[key] for key in best]
+
+
+def hybrid_search(query: str, dense_search: Callable[[int], List[Document]], lexical_index: LexicalIndex, k: int = None) -> List[Document]:
+    """
+    Runs a dense search and a BM25 search for a query and fuses them with reciprocal rank fusion.
+
+    The lexical leg needs no API call. If the dense leg fails or takes longer than
+    settings.DENSE_TIMEOUT seconds (e.g. a slow embedding service), the lexical results are returned alone.
+
+    Args:
+        query (str): The user query.
+        dense_search (Callable[[int], List[Document]]): Returns the n nearest documents of the query.
+        lexical_index (LexicalIndex): The collection's lexical index.
+        k (int, optional): Number of documents to return. Defaults to settings.NUM_DOCS.
+
+    Returns:
+        List[Document]: The fused results.
+    """
+    global _dense_pool
+    k = k or settings.NUM_DOCS
+    with _indexes_lock:
+        if _dense_pool is None:
+            # Dense legs wait on the network; a dedicated pool keeps them off the shared worker pool
+            _dense_pool = ThreadPoolExecutor(max_workers=settings.MAX_WORKERS, thread_name_prefix="rag-dense")
+    dense_future = _dense_pool.submit(dense_search, settings.HYBRID_CANDIDATES)
+    lexical_results = lexical_index.search(query, settings.HYBRID_CANDIDATES)
+    try:
+        dense_results = dense_future.result(timeout=settings.DENSE_TIMEOUT)
+    except TimeoutError:
+        print(f"Dense retrieval took over {settings.DENSE_TIMEOUT}s, answering from the lexical index")
+        return lexical_results[:k]
+    except Exception as e:
+        print(f"Dense retrieval failed ({e!r}), answering from the lexical index")
+        return lexical_results[:k]
+    return reciprocal_rank_fusion([dense_results, lexical_results], k)
@@ -0,0 +1,329 @@
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import uuid
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from src.config import settings
+from src.embeddings.cached_embeddings import get_embeddings
+from src.utils import make_batches
+from src.vectordbs.ann_index import SCAN_CHUNK_ROWS, VectorMatrix, create_index, top_k
+from src.vectordbs.base import VectorDatabaseInterface
+from src.vectordbs.lexical import get_lexical_index, hybrid_search
+
+# Metadata fields with their own indexed column, the others are read from the JSON metadata
+METADATA_COLUMNS = {"file_name": "file_name", "page": "page"}
+SQL_OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def where_to_sql(where: Dict[str, Any]) -> Tuple[str, list]:
+    """
+    Translates a Chroma-style metadata filter ({"file_name": "a.pdf"}, {"page": {"$in": [1, 2]}},
+    {"$and": [...]}, {"$or": [...]}) into an SQL condition on the records table.
+
+    Returns:
+        Tuple[str, list]: The condition and its parameters.
+    """
+    if len(where) != 1:
+        return where_to_sql({"$and": [{key: value} for key, value in where.items()]})
+    (key, value), = where.items()
+    if key in ("$and", "$or"):
+        parts = [where_to_sql(condition) for condition in value]
+        return f" {key[1:].upper()} ".join(f"({sql})" for sql, _ in parts), [param for _, params in parts for param in params]
+
+    column = METADATA_COLUMNS.get(key, f"json_extract(metadata, '$.{key}')")
+    if not isinstance(value, dict):
+        value = {"$eq": value}
+    (operator, operand), = value.items()
+    if operator in ("$in", "$nin"):
+        placeholders = ", ".join("?" * len(operand))
+        return f"{column} {'NOT ' if operator == '$nin' else ''}IN ({placeholders})", list(operand)
+    if operator not in SQL_OPERATORS:
+        raise ValueError(f"Unsupported filter operator '{operator}'")
+    return f"{column} {SQL_OPERATORS[operator]} ?", [operand]
+
+
+class LocalVectorDB(VectorDatabaseInterface):
+    """
+    File-backed vector database: one directory per collection holding a memory-mapped vector matrix,
+    its nearest-neighbour index and an SQLite table of contents and metadata.
+
+    Opening a collection only maps the matrix and reads the list of deleted rows, so cold starts
+    are near instant. Vectors are appended; deleted rows are masked and reclaimed by compaction.
+    The index is selected by settings.LOCAL_DB_INDEX and the storage precision by
+    settings.LOCAL_DB_DTYPE when the collection is created.
+    """
+
+    def __init__(self, collection_name: str, path: str = None):
+        """
+        Open (or create) a collection.
+
+        Args:
+            collection_name (str): Name of the collection.
+            path (str, optional): Root directory of the database. Defaults to settings.LOCAL_DB_PATH.
+        """
+        self.collection_name = collection_name
+        self.directory = os.path.join(path or settings.LOCAL_DB_PATH, collection_name)
+        self.embeddings_model = get_embeddings()
+        self.lexical_index = get_lexical_index(collection_name)
+        self.lock = threading.RLock()
+        self._open()
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(self.directory, "metadata.sqlite"), check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS records (
+                row INTEGER PRIMARY KEY, id TEXT, content TEXT, metadata TEXT,
+                file_name TEXT, page INTEGER, deleted INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS records_document ON records (file_name, page);
+        """)
+        info = dict(self.connection.execute("SELECT key, value FROM info"))
+        self.dtype = info.get("dtype", settings.LOCAL_DB_DTYPE)
+        count = self.connection.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM records").fetchone()[0]
+        self.alive = np.ones(count, dtype=bool)
+        deleted = [row for row, in self.connection.execute("SELECT row FROM records WHERE deleted = 1")]
+        self.alive[deleted] = False
+
+        self.matrix = None
+        self.index = None
+        if "dim" in info:
+            self._open_matrix(int(info["dim"]), count)
+
+    def _open_matrix(self, dim: int, count: int):
+        self.matrix = VectorMatrix(self.directory, dim, self.dtype, count)
+        self.index = create_index(settings.LOCAL_DB_INDEX, self.directory, self.matrix)
+
+    def compute_embedding(self, text: List[str]) -> np.ndarray:
+        """
+        Compute unit-norm embeddings for the provided texts.
+
+        Args:
+            text (List[str]): The input texts to compute the embeddings for.
+
+        Returns:
+            np.ndarray: float32 array with one row per text.
+        """
+        vectors = np.asarray(self.embeddings_model.embed_documents(text), dtype=np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def store_vector(self, data: Dict[str, Any] = None, metadata: Dict[str, Any] = None) -> str:
+        """
+        Store the vector and metadata in the collection.
+
+        Args:
+            data (Dict[str, Any]): Contains {"content": <original_text>, "transformed_content": <optional altered text>}.
+            metadata (Dict[str, Any]): Additional metadata to store with the vector.
+
+        Returns:
+            str: Success message upon successful insertion.
+        """
+        return self.store_vectors([data], [metadata])
+
+    def store_vectors(self, data_list: List[Dict[str, Any]], metadata_list: List[Dict[str, Any]] = None) -> str:
+        """
+        Store many vectors in the collection, one embedding request and one append per batch.
+
+        Args:
+            data_list (List[Dict[str, Any]]): One {"content": <original_text>, "transformed_content": <optional altered text>} per vector.
+            metadata_list (List[Dict[str, Any]], optional): Metadata for each vector, in the same order.
+
+        Returns:
+            str: Success message upon successful insertion.
+        """
+        if metadata_list is None:
+            metadata_list = [None] * len(data_list)
+
+        texts = [data["content"] for data in data_list]
+        batches = make_batches(texts)
+        print(f"Inserting {len(texts)} documents into the local vector database in {len(batches)} batches")
+
+        for batch in batches:
+            vectors = self.compute_embedding([texts[i] for i in batch])
+            with self.lock:
+                if self.matrix is None:
+                    self.connection.executemany("INSERT OR REPLACE INTO info VALUES (?, ?)",
+                                                [("dim", str(vectors.shape[1])), ("dtype", self.dtype)])
+                    self._open_matrix(vectors.shape[1], 0)
+                # The vectors are written first: rows past the last committed record are ignored on open
+                start = self.matrix.append(vectors)
+                self.index.add(start, vectors)
+                self.alive = np.concatenate([self.alive, np.ones(len(batch), dtype=bool)])
+                records = []
+                for row, i in enumerate(batch, start=start):
+                    metadata = metadata_list[i] or {}
+                    records.append((row, str(uuid.uuid4()), texts[i], json.dumps(metadata),
+                                    metadata.get("file_name"), metadata.get("page")))
+                self.connection.executemany(
+                    "INSERT INTO records (row, id, content, metadata, file_name, page) VALUES (?, ?, ?, ?, ?, ?)", records
+                )
+                self.connection.commit()
+        with self.lock:
+            if self.index is not None:
+                self.index.save()
+        if self.lexical_index is not None:
+            self.lexical_index.add(texts, metadata_list)
+        return "Success"
+
+    def delete_vectors(self, file_name: str, pages: List[int] = None) -> str:
+        """
+        Delete the vectors of a document from the collection.
+
+        Args:
+            file_name (str): Name of the document, as stored in the "file_name" metadata.
+            pages (List[int], optional): 1-based page numbers to delete. Default is None, which deletes the whole document.
+
+        Returns:
+            str: Success message upon successful deletion.
+        """
+        if pages is not None and len(pages) == 0:
+            return "Success"
+        sql, params = where_to_sql({"file_name": file_name} if pages is None else {"file_name": file_name, "page": {"$in": list(pages)}})
+        print(f"Deleting vectors of {file_name} (pages: {pages or 'all'}) from the local vector database")
+        if self.lexical_index is not None:
+            self.lexical_index.delete(file_name, pages)
+        with self.lock:
+            rows = np.array([row for row, in self.connection.execute(f"SELECT row FROM records WHERE deleted = 0 AND {sql}", params)], dtype=np.int64)
+            if len(rows) == 0:
+                return "Success"
+            self.connection.execute(f"UPDATE records SET deleted = 1 WHERE {sql}", params)
+            self.connection.commit()
+            self.alive[rows] = False
+            self.index.remove(rows)
+            # Reclaim the space once most of the matrix is deleted rows
+            if (~self.alive).sum() > self.alive.sum():
+                self.compact()
+            else:
+                self.index.save()
+        return "Success"
+
+    def get_metadata(self, where: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Return the metadata of the stored vectors matching a Chroma-style filter.
+        """
+        sql, params = where_to_sql(where)
+        with self.lock:
+            return [json.loads(metadata) for metadata, in self.connection.execute(
+                f"SELECT metadata FROM records WHERE deleted = 0 AND {sql}", params
+            )]
+
+    def compact(self) -> None:
+        """
+        Rewrites the matrix without its deleted rows, renumbers the records and rebuilds the index.
+        """
+        with self.lock:
+            if self.matrix is None:
+                return
+            rows = np.flatnonzero(self.alive)
+            print(f"Compacting {self.collection_name}: keeping {len(rows)} of {len(self.alive)} vectors")
+            matrix = self.matrix
+            for path, codes in [(matrix.path, matrix.codes), (matrix.scales_path, matrix.scales)]:
+                if codes is None:
+                    continue
+                with open(f"{path}.tmp", "wb") as f:
+                    for start in range(0, len(rows), SCAN_CHUNK_ROWS):
+                        f.write(np.ascontiguousarray(codes[rows[start:start + SCAN_CHUNK_ROWS]]).tobytes())
+            matrix.codes = matrix.scales = None
+            for path in (matrix.path, matrix.scales_path):
+                if os.path.exists(f"{path}.tmp"):
+                    os.replace(f"{path}.tmp", path)
+
+            self.connection.execute("DELETE FROM records WHERE deleted = 1")
+            # Rows only move down, so renumbering in ascending order never collides
+            self.connection.executemany("UPDATE records SET row = ? WHERE row = ?",
+                                        [(new, int(old)) for new, old in enumerate(rows) if new != old])
+            self.connection.commit()
+
+            self.index.drop()
+            self.alive = np.ones(len(rows), dtype=bool)
+            self._open_matrix(matrix.dim, len(rows))
+            self.index.save()
+
+    def search(self, query: str, k: int = None, where: Dict[str, Any] = None) -> List[Document]:
+        """
+        Embed a query and return its nearest documents, with their cosine distance in the "score" metadata.
+
+        Unfiltered queries use the collection's index; filtered queries score exactly the rows matching the filter.
+
+        Args:
+            query (str): The query string.
+            k (int, optional): Number of documents to return. Defaults to settings.NUM_DOCS.
+            where (Dict[str, Any], optional): Chroma-style metadata filter. Default is None.
+
+        Returns:
+            List[Document]: The matching documents, nearest first.
+        """
+        k = k or settings.NUM_DOCS
+        embedding = np.asarray(self.embeddings_model.embed_query(query), dtype=np.float32)
+        embedding /= max(float(np.linalg.norm(embedding)), 1e-12)
+
+        with self.lock:
+            if self.matrix is None:
+                return []
+            if where:
+                sql, params = where_to_sql(where)
+                rows = np.array([row for row, in self.connection.execute(f"SELECT row FROM records WHERE deleted = 0 AND {sql}", params)], dtype=np.int64)
+                rows, scores = top_k(rows, self.matrix.scores(embedding, rows), k) if len(rows) else (rows, rows)
+            else:
+                rows, scores = self.index.search(embedding, k, self.alive)
+            return self._documents(rows, scores)
+
+    def _documents(self, rows: np.ndarray, scores: np.ndarray) -> List[Document]:
+        if len(rows) == 0:
+            return []
+        records = {row: (doc_id, content, metadata) for row, doc_id, content, metadata in self.connection.execute(
+            f"SELECT row, id, content, metadata FROM records WHERE row IN ({', '.join('?' * len(rows))})", [int(row) for row in rows]
+        )}
+        documents = []
+        for row, score in zip(rows, scores):
+            doc_id, content, metadata = records[int(row)]
+            documents.append(Document(page_content=content, metadata={**json.loads(metadata), "id": doc_id, "score": 1 - float(score)}))
+        return documents
+
+    def query_vector(self, query: str, *args: Tuple[Any, ...], **kwargs: Dict[str, Any]) -> List[Document]:
+        """
+        Query the collection and return the settings.NUM_DOCS documents nearest to a query string.
+
+        The local database has no self-query retriever, so every query runs as a direct search
+        whatever settings.RETRIEVAL_MODE says. In collections with a lexical index, it is fused with a BM25 search.
+
+        Args:
+            query (str): The query string to search for in the vector database.
+
+        Returns:
+            List[Document]: The matching documents with their metadata.
+        """
+        if self.lexical_index is not None:
+            return hybrid_search(query, lambda k: self.search(query, k=k), self.lexical_index)
+        return self.search(query)
+
+    def reset_database(self):
+        with self.lock:
+            self.connection.close()
+            shutil.rmtree(self.directory)
+            self._open()
+        if self.lexical_index is not None:
+            self.lexical_index.reset()
+
+    def set_memory(self, history: List[Dict[str, Any]]) -> str:
+        """
+        Store chat history in the collection.
+
+        Args:
+            history (List[Dict[str, Any]]): A list of chat messages or history items to store.
+
+        Returns:
+            str: Success message upon successful insertion.
+        """
+        self.store_vectors(
+            data_list=[{"content": item['message'], "transformed_content": item.get('embedding')} for item in history],
+            metadata_list=[{"timestamp": item['timestamp']} for item in history],
+        )
+        return "Memory set successfully"
@@ -0,0 +1,270 @@
+import argparse
+import os
+import time
+from typing import Dict, Tuple
+
+import numpy as np
+
+from src.config import settings
+from src.vectordbs.ann_index import SCAN_CHUNK_ROWS, ExactIndex, VectorIndex, VectorMatrix, top_k
+
+
+def kmeans(data: np.ndarray, clusters: int, iterations: int = 8, seed: int = 0) -> np.ndarray:
+    """
+    Clusters vectors by euclidean distance.
+
+    Returns:
+        np.ndarray: Centroids of shape (clusters, dim).
+    """
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = nearest_centroids(data, centroids)
+        counts = np.bincount(assignments, minlength=clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, data)
+        # Empty clusters keep their previous centroid
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+def nearest_centroids(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # argmin ||x - c||² = argmin (||c||² - 2 x.c)
+    return np.argmin((centroids ** 2).sum(axis=1) - 2 * data @ centroids.T, axis=1)
+
+
+class ScalarQuantizer:
+    """
+    8-bit scalar quantization (sq8): each dimension is mapped linearly onto 0..255 between its
+    minimum and maximum over the training sample. 4x smaller than float32.
+    """
+    name = "sq8"
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.code_size = dim
+        self.low = None
+        self.step = None
+
+    def train(self, data: np.ndarray) -> None:
+        self.low = data.min(axis=0)
+        self.step = (data.max(axis=0) - self.low) / 255
+        self.step[self.step == 0] = 1
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.round((vectors - self.low) / self.step), 0, 255).astype(np.uint8)
+
+    def scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # <low + code * step, q> = <code, step * q> + <low, q>
+        return codes.astype(np.float32) @ (self.step * query) + self.low @ query
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"low": self.low, "step": self.step}
+
+    def load(self, state: Dict[str, np.ndarray]) -> None:
+        self.low, self.step = state["low"], state["step"]
+
+
+class ProductQuantizer:
+    """
+    Product quantization (pq): the vector is split into `subvectors` slices and each slice is
+    replaced by the index of its nearest of 256 centroids learnt for that slice, one byte per
+    slice. With dim / 4 slices the codes are 16x smaller than float32.
+    """
+    name = "pq"
+
+    def __init__(self, dim: int, subvectors: int = None):
+        subvectors = subvectors or settings.PQ_SUBVECTORS or dim // 4
+        if dim % subvectors:
+            raise ValueError(f"The dimension {dim} is not divisible into {subvectors} subvectors")
+        self.dim = dim
+        self.subvectors = subvectors
+        self.code_size = subvectors
+        self.codebooks = None
+
+    def _slices(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors.reshape(len(vectors), self.subvectors, self.dim // self.subvectors)
+
+    def train(self, data: np.ndarray) -> None:
+        clusters = min(256, len(data))
+        slices = self._slices(data)
+        self.codebooks = np.stack([kmeans(np.ascontiguousarray(slices[:, m]), clusters) for m in range(self.subvectors)])
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        slices = self._slices(vectors)
+        return np.stack([nearest_centroids(slices[:, m], self.codebooks[m]) for m in range(self.subvectors)], axis=1).astype(np.uint8)
+
+    def scores(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        # Asymmetric distance: one table of <centroid, query slice> per slice, then table lookups
+        tables = np.einsum("mkd,md->mk", self.codebooks, self._slices(query[None])[0])
+        scores = np.zeros(len(codes), dtype=np.float32)
+        for m in range(self.subvectors):
+            scores += tables[m][codes[:, m]]
+        return scores
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"codebooks": self.codebooks}
+
+    def load(self, state: Dict[str, np.ndarray]) -> None:
+        self.codebooks = state["codebooks"]
+        self.subvectors = self.code_size = len(self.codebooks)
+
+
+QUANTIZERS = {"sq8": ScalarQuantizer, "pq": ProductQuantizer}
+
+
+class QuantizedIndex(VectorIndex):
+    """
+    Two-stage search: a scan of compact quantized codes selects settings.RERANK_CANDIDATES rows,
+    which are re-scored exactly against the vectors of the matrix on disk.
+
+    Only the codes need to stay in memory, so memory per vector drops from 4 bytes per dimension
+    to 1 (sq8) or 1 per slice (pq). Collections smaller than settings.QUANTIZATION_MIN_VECTORS
+    are scanned exactly; the quantizer is retrained when the collection has grown fourfold.
+    """
+
+    def __init__(self, directory: str, matrix: VectorMatrix, quantizer_type: str):
+        super().__init__(directory, matrix)
+        self.quantizer = QUANTIZERS[quantizer_type](matrix.dim)
+        self.codebook_path = os.path.join(directory, f"{quantizer_type}.codebook.npz")
+        self.codes_path = os.path.join(directory, f"{quantizer_type}.codes")
+        self.codes = np.zeros((0, self.quantizer.code_size), dtype=np.uint8)
+        self.trained_on = 0
+        if os.path.exists(self.codebook_path) and os.path.exists(self.codes_path):
+            with np.load(self.codebook_path) as state:
+                self.quantizer.load(dict(state))
+                self.trained_on = int(state["trained_on"])
+            count = min(len(matrix), os.path.getsize(self.codes_path) // self.quantizer.code_size)
+            self._map(count)
+        elif len(matrix) >= settings.QUANTIZATION_MIN_VECTORS:
+            self.train()
+
+    @property
+    def trained(self) -> bool:
+        return self.trained_on > 0
+
+    def _map(self, count: int):
+        self.codes = (np.memmap(self.codes_path, dtype=np.uint8, mode="r", shape=(count, self.quantizer.code_size))
+                      if count else np.zeros((0, self.quantizer.code_size), dtype=np.uint8))
+
+    def _append_codes(self, start: int, end: int):
+        with open(self.codes_path, "r+b" if os.path.exists(self.codes_path) else "wb") as f:
+            f.seek(start * self.quantizer.code_size)
+            for chunk in range(start, end, SCAN_CHUNK_ROWS):
+                rows = np.arange(chunk, min(chunk + SCAN_CHUNK_ROWS, end))
+                f.write(self.quantizer.encode(self.matrix.get(rows)).tobytes())
+            f.truncate()
+        self._map(end)
+
+    def train(self) -> None:
+        """
+        Trains the quantizer on a sample of the matrix and encodes every row.
+        """
+        count = len(self.matrix)
+        sample = np.sort(np.random.default_rng(0).choice(count, min(count, settings.QUANTIZATION_TRAIN_SAMPLE), replace=False))
+        print(f"Training {self.quantizer.name} quantizer on {len(sample)} of {count} vectors")
+        self.quantizer.train(self.matrix.get(sample))
+        self.trained_on = count
+        self.codes = None
+        self._append_codes(0, count)
+        self.save()
+
+    def add(self, start: int, vectors: np.ndarray) -> None:
+        count = len(self.matrix)
+        if count < settings.QUANTIZATION_MIN_VECTORS:
+            return
+        if not self.trained or count > 4 * self.trained_on:
+            self.train()
+            return
+        self._append_codes(len(self.codes), count)
+
+    def search(self, query: np.ndarray, k: int, alive: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if not self.trained or len(self.codes) < len(self.matrix):
+            return ExactIndex(self.directory, self.matrix).search(query, k, alive)
+
+        # First pass on the codes
+        candidates = max(k, settings.RERANK_CANDIDATES)
+        best_rows, best_scores = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        for start in range(0, len(self.codes), SCAN_CHUNK_ROWS):
+            rows = np.arange(start, min(start + SCAN_CHUNK_ROWS, len(self.codes)))
+            rows = rows[alive[rows]]
+            scores = self.quantizer.scores(query, np.asarray(self.codes[rows]))
+            best_rows, best_scores = top_k(np.concatenate([best_rows, rows]), np.concatenate([best_scores, scores]), candidates)
+
+        # Exact re-score of the candidates, read in file order
+        rows = np.sort(best_rows)
+        return top_k(rows, self.matrix.scores(query, rows), k)
+
+    def files(self) -> list:
+        return [self.codebook_path, self.codes_path]
+
+    def save(self) -> None:
+        if self.trained:
+            np.savez(self.codebook_path, trained_on=self.trained_on, **self.quantizer.state())
+
+
+def measure_recall(vectors: np.ndarray, queries: np.ndarray, quantizer, k: int, candidates: int) -> Tuple[float, float]:
+    """
+    Measures the recall@k of a trained quantizer against exact search, with and without re-ranking.
+
+    Args:
+        vectors (np.ndarray): The indexed vectors.
+        queries (np.ndarray): The query vectors.
+        quantizer: A trained ScalarQuantizer or ProductQuantizer.
+        k (int): Number of results.
+        candidates (int): Candidates passed to the exact re-score.
+
+    Returns:
+        Tuple[float, float]: Recall@k of the first pass alone, and after re-ranking.
+    """
+    codes = quantizer.encode(vectors)
+    rows = np.arange(len(vectors))
+    first_pass_hits = reranked_hits = 0
+    for query in queries:
+        exact, _ = top_k(rows, vectors @ query, k)
+        approximate, _ = top_k(rows, quantizer.scores(query, codes), max(k, candidates))
+        reranked, _ = top_k(approximate, vectors[approximate] @ query, k)
+        first_pass_hits += len(np.intersect1d(exact, approximate[:k]))
+        reranked_hits += len(np.intersect1d(exact, reranked))
+    total = k * len(queries)
+    return first_pass_hits / total, reranked_hits / total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure recall@k and memory of the vector quantizers.")
+    parser.add_argument("--collection", help="Local collection to measure (directory under LOCAL_DB_PATH). Default: synthetic data.")
+    parser.add_argument("--vectors", type=int, default=20000, help="Number of synthetic vectors.")
+    parser.add_argument("--dim", type=int, default=1536, help="Dimension of the synthetic vectors.")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=settings.NUM_DOCS)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.collection:
+        from src.vectordbs.localdb import LocalVectorDB
+        matrix = LocalVectorDB(args.collection).matrix
+        vectors = matrix.get(np.arange(len(matrix)))
+        # Held-in queries perturbed with noise, like paraphrases of indexed chunks
+        queries = vectors[rng.choice(len(vectors), args.queries)] + rng.normal(0, 0.02, (args.queries, matrix.dim))
+    else:
+        # Clustered unit vectors, closer to text embeddings than uniform noise
+        centers = rng.standard_normal((64, args.dim))
+        vectors = centers[rng.integers(0, 64, args.vectors)] + 0.8 * rng.standard_normal((args.vectors, args.dim))
+        queries = centers[rng.integers(0, 64, args.queries)] + 0.8 * rng.standard_normal((args.queries, args.dim))
+    vectors = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+    dim = vectors.shape[1]
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), settings.QUANTIZATION_TRAIN_SAMPLE), replace=False)]
+
+    print(f"{len(vectors)} vectors of dimension {dim}, {len(queries)} queries, recall@{args.k}, {settings.RERANK_CANDIDATES} re-rank candidates")
+    print(f"{'quantizer':<12}{'bytes/vector':>14}{'MB/million':>12}{'reduction':>11}{'first pass':>12}{'re-ranked':>11}{'train s':>9}")
+    print(f"{'float32':<12}{dim * 4:>14}{dim * 4:>12}{'1x':>11}{1.0:>12.3f}{1.0:>11.3f}{'-':>9}")
+    for quantizer in [ScalarQuantizer(dim), ProductQuantizer(dim, dim // 4), ProductQuantizer(dim, dim // 8)]:
+        start = time.perf_counter()
+        quantizer.train(sample)
+        train_time = time.perf_counter() - start
+        first_pass, reranked = measure_recall(vectors, queries, quantizer, args.k, settings.RERANK_CANDIDATES)
+        name = f"{quantizer.name}/{quantizer.code_size}" if quantizer.name == "pq" else quantizer.name
+        print(f"{name:<12}{quantizer.code_size:>14}{quantizer.code_size:>12}{f'{dim * 4 // quantizer.code_size}x':>11}"
+              f"{first_pass:>12.3f}{reranked:>11.3f}{train_time:>9.1f}")
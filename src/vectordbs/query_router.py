@@ -0,0 +1,54 @@
+import re
+
+from langchain.chains.query_constructor.base import AttributeInfo
+
+# Metadata attributes that the self-query retriever may filter on
+METADATA_FIELD_INFO = [
+    AttributeInfo(
+        name="file_name",
+        description="Path of the document the content comes from, relative to the data folder, e.g. contract.pdf or 2024/contract.pdf",
+        type="string",
+    ),
+    AttributeInfo(
+        name="page",
+        description="1-based page number of the document the content comes from",
+        type="integer",
+    ),
+    AttributeInfo(
+        name="source_type",
+        description="Kind of content the chunk was extracted from: text, table or image",
+        type="string",
+    ),
+]
+
+# Cheap signals that a query restricts the search to some documents, pages or kinds of content
+FILTER_INTENT_PATTERNS = [
+    re.compile(r"\bpages?\s*(no\.?|number)?\s*#?\d+", re.IGNORECASE),
+    re.compile(r"\bp{1,2}\.\s*\d+", re.IGNORECASE),
+    re.compile(r"\b(first|last|second|third|final)\s+page\b", re.IGNORECASE),
+    re.compile(r"\b[\w.-]+\.(pdf|docx?|html?|txt)\b", re.IGNORECASE),
+    re.compile(r"\b(file|document)\s+(named|called|titled)\b", re.IGNORECASE),
+    re.compile(r"\b(file[_ ]name|file[_ ]path|image[_ ]path)\b", re.IGNORECASE),
+    # Tables and images are stored as their own source types ("in the table", "the image shows")
+    re.compile(
+        r"\b(in|from|on|of|the|this|that|these|those|which|what|each|any|all)\s+"
+        r"(tables?|images?|figures?|charts?|graphs?|diagrams?|pictures?|photos?|photographs?|illustrations?|screenshots?)\b"
+        r"(?!\s+of\s+contents)",
+        re.IGNORECASE,
+    ),
+    re.compile(r"\b(source[_ ]type|tabular)\b", re.IGNORECASE),
+]
+
+
+def has_filter_intent(query: str) -> bool:
+    """
+    Decides locally whether a query contains metadata filter intent (a page, a document or a source
+    type), i.e. whether it is worth paying an LLM call to build a structured query.
+
+    Args:
+        query (str): The user query.
+
+    Returns:
+        bool: True if the query mentions pages, documents, tables or images to restrict the search to.
+    """
+    return any(pattern.search(query) for pattern in FILTER_INTENT_PATTERNS)
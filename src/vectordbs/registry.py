@@ -0,0 +1,123 @@
+import os
+import threading
+from typing import Dict
+
+from chromadb import PersistentClient
+from chromadb.config import DEFAULT_TENANT, DEFAULT_DATABASE, Settings
+
+from src.clients import get_chat_model
+from src.config import settings
+from src.file_lock import file_lock
+from src.embeddings.cached_embeddings import get_embeddings
+from src.ttl_cache import TTLCache
+from src.vectordbs.base import VectorDatabaseInterface
+
+
+class VectorEngine:
+    """
+    Process-wide resources of a ChromaDB database: one persistent client, the shared embeddings
+    and chat models, one lightweight handle per collection, and the retrieval cache with the
+    write generation of each collection that keeps it valid.
+
+    Write generations are counters stored next to the database, so that writes made by other
+    processes (batch ingestion, another app process) invalidate this process's cached results too.
+    """
+
+    def __init__(self, path: str = None):
+        """
+        Args:
+            path (str, optional): Location of the ChromaDB database. Defaults to settings.DB_NAME.
+        """
+        self.path = path or settings.DB_NAME
+        self.client = PersistentClient(
+                        path=self.path,
+                        settings=Settings(),
+                        tenant=DEFAULT_TENANT,
+                        database=DEFAULT_DATABASE,
+                    )
+        self.embeddings_model = get_embeddings()
+        self.LLM = get_chat_model()
+        self.lock = threading.Lock()
+        self.handles: Dict[str, VectorDatabaseInterface] = {}
+        self.retrieval_cache = TTLCache(settings.RETRIEVAL_CACHE_MAX_ENTRIES, settings.RETRIEVAL_CACHE_TTL)
+
+    def _generation_path(self, collection_name: str) -> str:
+        return os.path.join(self.path, f"{collection_name}.generation")
+
+    def generation(self, collection_name: str) -> int:
+        """
+        Returns the write generation of a collection; retrieval results cached under an older generation are stale.
+        """
+        try:
+            with open(self._generation_path(collection_name)) as f:
+                return int(f.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def bump_generation(self, collection_name: str) -> None:
+        """
+        Records a write to a collection, invalidating its cached retrieval results in every process.
+        """
+        path = self._generation_path(collection_name)
+        with self.lock, file_lock(f"{path}.lock"):
+            generation = self.generation(collection_name) + 1
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(str(generation))
+            os.replace(tmp_path, path)
+
+    def get_collection(self, collection_name: str) -> VectorDatabaseInterface:
+        """
+        Returns the handle of a collection, creating it on first use.
+
+        Args:
+            collection_name (str): Name of the ChromaDB collection.
+
+        Returns:
+            VectorDatabaseInterface: The shared handle of that collection.
+        """
+        from src.vectordbs.chromadb import ChromaDB
+
+        with self.lock:
+            if collection_name not in self.handles:
+                self.handles[collection_name] = ChromaDB(collection_name=collection_name, engine=self)
+            return self.handles[collection_name]
+
+
+_engines: Dict[str, VectorEngine] = {}
+_engines_lock = threading.Lock()
+_local_collections: Dict[str, VectorDatabaseInterface] = {}
+
+
+def get_engine(path: str = None) -> VectorEngine:
+    """
+    Returns the process-wide engine of a database location, creating it on first use.
+    """
+    path = path or settings.DB_NAME
+    with _engines_lock:
+        if path not in _engines:
+            _engines[path] = VectorEngine(path)
+        return _engines[path]
+
+
+def get_vector_db(collection_name: str) -> VectorDatabaseInterface:
+    """
+    Returns the shared handle of a collection in the database selected by settings.VECTOR_DB.
+
+    Args:
+        collection_name (str): Name of the collection.
+
+    Returns:
+        VectorDatabaseInterface: The collection handle.
+    """
+    vector_database = settings.VECTOR_DB.lower()
+    if vector_database == "chromadb":
+        return get_engine().get_collection(collection_name)
+    if vector_database == "local":
+        from src.vectordbs.localdb import LocalVectorDB
+
+        with _engines_lock:
+            if collection_name not in _local_collections:
+                _local_collections[collection_name] = LocalVectorDB(collection_name)
+            return _local_collections[collection_name]
+    raise ValueError(f"Vector database '{settings.VECTOR_DB}' is not supported")